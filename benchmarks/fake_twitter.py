@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# File: benchmarks/fake_twitter.py
+#
+# Part of ‘Taubenschlag'
+# GitHub: https://github.com/bithon/Taubenschlag
+#
+# Author: Oliver Zehentleitner
+#         https://about.me/oliver_zehentleitner/
+#
+# Copyright (c) 2019, Oliver Zehentleitner
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL-
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+# In-process fake of the Twitter API for the offline benchmarks: a generated world of bot accounts, rt source
+# timelines, DMs and stored tweet ids. `FakeTwitter.api_factory` can be passed to `Taubenschlag(api_factory=...)`, the
+# `FakeApi` clients implement the tweepy.API methods that are used by the bot. `latency` simulates the round trip of a
+# Twitter API call (seconds).
+
+from collections import Counter
+import random
+import threading
+import time
+import tweepy
+
+words = ["the", "community", "blockchain", "data", "is", "growing", "today", "new", "release", "of", "our", "app",
+         "check", "this", "out", "great", "news", "for", "everyone", "building", "on", "open", "index", "protocol"]
+
+
+class FakeUser(object):
+    def __init__(self, user_id, screen_name, name):
+        self.id = user_id
+        self.id_str = str(user_id)
+        self.screen_name = screen_name
+        self.name = name
+
+
+class FakeStatus(object):
+    def __init__(self, status_id, text, user, retweeted=False):
+        self.id = status_id
+        self.text = text
+        self.user = user
+        self.retweeted = retweeted
+
+
+class FakeDirectMessage(object):
+    def __init__(self, dm_id, sender_id, text):
+        self.id = str(dm_id)
+        self.message_create = {'sender_id': str(sender_id), 'message_data': {'text': text}}
+
+
+class FakeTwitter(object):
+    bot_user_id = 1
+
+    def __init__(self, accounts=1000, sources=25, tweets_per_source=20, dms=100, stored_tweets=10000, hit_rate=0.2,
+                 conditions=("#gowiththeflo", "$flo", "#floblockchain"), latency=0.0, seed=None):
+        self.random = random.Random(seed)
+        self.conditions = list(conditions)
+        self.hit_rate = hit_rate
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        # snowflake ids of now, so the stored tweet ids are inside the retention window of the seen tweet index
+        self.next_id = (int(time.time() * 1000) - 1288834974657) << 22
+        self.statuses = {}
+        self.users = {}
+        self.screen_names = {}
+        self._add_user(self.bot_user_id, "fakebot")
+        self.account_ids = []
+        for index in range(accounts):
+            self.account_ids.append(str(self._add_user(10000 + index, "account_" + str(index)).id))
+        self.source_names = []
+        for index in range(sources):
+            self.source_names.append(self._add_user(20000000 + index, "Source_" + str(index)).screen_name)
+        self.stored_tweet_ids = [self._new_id() for index in range(stored_tweets)]
+        self.timelines = {}
+        for screen_name in self.source_names:
+            self.timelines[screen_name.lower()] = []
+        self.add_tweets(tweets_per_source)
+        self.retweets = set()
+        self.revoked_tokens = set()
+        self.sent_dms = 0
+        self.inbox = []
+        self.add_dms(dms)
+
+    def _add_user(self, user_id, screen_name):
+        user = FakeUser(user_id, screen_name, screen_name.replace("_", " ").title())
+        self.users[str(user_id)] = user
+        self.screen_names[screen_name.lower()] = user
+        return user
+
+    def _new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    def _text(self):
+        text = self.random.choices(words, k=self.random.randint(8, 30))
+        if self.random.random() < self.hit_rate:
+            text.insert(self.random.randint(0, len(text)), self.random.choice(self.conditions))
+        return " ".join(text)
+
+    def add_dms(self, amount, commands=("help", "get-info", "get-bot-info", "get-cmd-list", "set-rt-level:1")):
+        # DMs of random saved accounts, the inbox is newest first like `list_direct_messages`
+        for index in range(amount):
+            self.inbox.insert(0, FakeDirectMessage(self._new_id(), self.random.choice(self.account_ids),
+                                                   self.random.choice(commands)))
+
+    def add_tweets(self, tweets_per_source):
+        # new tweets on top of every rt source timeline
+        for screen_name in self.source_names:
+            user = self.screen_names[screen_name.lower()]
+            for index in range(tweets_per_source):
+                status = FakeStatus(self._new_id(), self._text(), user)
+                self.statuses[status.id] = status
+                self.timelines[screen_name.lower()].insert(0, status)
+
+    def api_factory(self, consumer_key, consumer_secret, access_token, access_token_secret):
+        # the generated access tokens start with the user id like the real ones: '<user_id>-<token>'
+        return FakeApi(self, access_token.split("-")[0])
+
+    def credentials(self, user_id):
+        return {'access_token': str(user_id) + "-token", 'access_token_secret': "secret"}
+
+    def revoke_token(self, user_id):
+        self.revoked_tokens.add(str(user_id))
+
+    def call(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+
+class FakeApi(object):
+    # tweepy.API of one user of the FakeTwitter world
+    def __init__(self, world, user_id):
+        self.world = world
+        self.user_id = str(user_id)
+
+    def _get_user(self, user_id=None, screen_name=None):
+        if user_id is not None:
+            return self.world.users.get(str(user_id))
+        return self.world.screen_names.get(str(screen_name).lower())
+
+    def create_friendship(self, id=None, user_id=None, screen_name=None):
+        self.world.call("create_friendship")
+        user = self._get_user(user_id=id or user_id, screen_name=screen_name)
+        if user is None:
+            raise tweepy.TweepError("User not found.", api_code=50)
+        return user
+
+    def destroy_direct_message(self, id):
+        self.world.call("destroy_direct_message")
+        with self.world.lock:
+            self.world.inbox = [dm for dm in self.world.inbox if dm.id != str(id)]
+
+    def get_status(self, id):
+        self.world.call("get_status")
+        try:
+            status = self.world.statuses[int(id)]
+        except KeyError:
+            raise tweepy.TweepError("No status found with that ID.", api_code=144)
+        return FakeStatus(status.id, status.text, status.user,
+                          retweeted=(self.user_id, status.id) in self.world.retweets)
+
+    def get_user(self, user_id=None, screen_name=None, id=None):
+        self.world.call("get_user")
+        user = self._get_user(user_id=user_id or id, screen_name=screen_name)
+        if user is None:
+            raise tweepy.TweepError("User not found.", api_code=50)
+        return user
+
+    def list_direct_messages(self, count=20, cursor=None):
+        self.world.call("list_direct_messages")
+        with self.world.lock:
+            return list(self.world.inbox[:count])
+
+    def lookup_users(self, user_ids=None, screen_names=None):
+        self.world.call("lookup_users")
+        users = []
+        for user_id in user_ids or []:
+            if str(user_id) in self.world.users:
+                users.append(self.world.users[str(user_id)])
+        for screen_name in screen_names or []:
+            if str(screen_name).lower() in self.world.screen_names:
+                users.append(self.world.screen_names[str(screen_name).lower()])
+        return users
+
+    def retweet(self, id):
+        self.world.call("retweet")
+        if self.user_id in self.world.revoked_tokens:
+            raise tweepy.TweepError("Invalid or expired token.", api_code=89)
+        with self.world.lock:
+            if (self.user_id, id) in self.world.retweets:
+                raise tweepy.TweepError("You have already retweeted this Tweet.", api_code=327)
+            self.world.retweets.add((self.user_id, id))
+
+    def send_direct_message(self, recipient_id, text):
+        self.world.call("send_direct_message")
+        with self.world.lock:
+            self.world.sent_dms += 1
+
+    def user_timeline(self, screen_name=None, since_id=None, max_id=None, count=20):
+        self.world.call("user_timeline")
+        timeline = []
+        for status in self.world.timelines.get(str(screen_name).lower(), []):
+            if max_id is not None and status.id > max_id:
+                continue
+            if since_id is not None and status.id <= since_id:
+                break
+            timeline.append(status)
+            if len(timeline) >= count:
+                break
+        return timeline
+
+    def verify_credentials(self):
+        # like tweepy: False if the token is not valid anymore
+        self.world.call("verify_credentials")
+        if self.user_id in self.world.revoked_tokens:
+            return False
+        return self.world.users.get(self.user_id)
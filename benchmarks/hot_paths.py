@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# File: benchmarks/hot_paths.py
+#
+# Part of ‘Taubenschlag'
+# GitHub: https://github.com/bithon/Taubenschlag
+#
+# Author: Oliver Zehentleitner
+#         https://about.me/oliver_zehentleitner/
+#
+# Copyright (c) 2019, Oliver Zehentleitner
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL-
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+# Offline benchmarks of the hot paths of the bot against the in-process fake Twitter API of `fake_twitter.py`: a search
+# and retweet round, a DM batch, the leaderboard and `save_db()` for every db backend. Prints latency percentiles and
+# throughput and compares them with a baseline file (`--save-baseline` writes it). The baseline is not part of the
+# repository, the timings depend on the machine, so the regression check only compares runs on the same machine.
+#
+# Example:
+#   python3 ./benchmarks/hot_paths.py --save-baseline
+#   python3 ./benchmarks/hot_paths.py --fail-threshold 20
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+import configparser
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from fake_twitter import FakeTwitter
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+# the benchmarks run in a temp dir, relative paths of the arguments are resolved against the dir of the invocation
+invocation_dir = os.getcwd()
+logging.basicConfig(handlers=[logging.NullHandler()])
+
+from taubenschlag import Taubenschlag
+
+backends = {'json': {'backend': "json", 'journal': "False"},
+            'json-journal': {'backend': "json", 'journal': "True"},
+            'sqlite': {'backend': "sqlite", 'journal': "False"}}
+
+
+def percentile(samples, percent):
+    # nearest rank
+    samples = sorted(samples)
+    index = max(0, min(len(samples) - 1, int(round(percent / 100 * len(samples) + 0.5)) - 1))
+    return samples[index]
+
+
+def summarize(samples, units):
+    # samples: seconds per run, units: processed items (tweets, DMs, ...) of all runs
+    return {'runs': len(samples),
+            'p50_ms': round(percentile(samples, 50) * 1000, 3),
+            'p90_ms': round(percentile(samples, 90) * 1000, 3),
+            'p99_ms': round(percentile(samples, 99) * 1000, 3),
+            'max_ms': round(max(samples) * 1000, 3),
+            'throughput': round(units / sum(samples), 2) if sum(samples) > 0 else 0.0}
+
+
+def write_config(work_dir, world, backend, rt_levels):
+    config = configparser.ConfigParser()
+    config.read(os.path.join(repo_dir, "conf.d", "main.cfg"))
+    config['DATABASE']['backend'] = backends[backend]['backend']
+    config['DATABASE']['journal'] = backends[backend]['journal']
+    config['SYSTEM']['bot_twitter_account'] = "fakebot"
+    config['SYSTEM']['sys_admin_list'] = "account_0"
+    config['SYSTEM']['ssh_backup_on_new_user'] = "False"
+    config['SYSTEM']['dm_ingestion'] = "polling"
+    config['SYSTEM']['retweet_jitter_window'] = "0"
+    config['SYSTEM']['retweet_account_min_spacing'] = "0"
+    config['SYSTEM']['telegram_post_new_tweets_to_group'] = "False"
+    config['SYSTEM']['telegram_post_new_tweets_to_channel'] = "False"
+    config['SYSTEM']['user_cache_warm_up'] = "False"
+    config['SYSTEM']['tracing'] = "off"
+    config['SYSTEM']['profile_rounds'] = "0"
+    config['SECRETS'] = {'consumer_key': "key", 'consumer_secret': "secret",
+                         'access_token': str(world.bot_user_id) + "-bot", 'access_token_secret': "secret",
+                         'consumer_key_dm': "key", 'consumer_secret_dm': "secret",
+                         'access_token_dm': str(world.bot_user_id) + "-dm", 'access_token_secret_dm': "secret",
+                         'ssh_backup_user': "", 'ssh_backup_pass': "", 'ssh_backup_server': "",
+                         'ssh_backup_port': "22", 'ssh_backup_path': "",
+                         'telegram_auth_token': "", 'telegram_group_id': "", 'telegram_channel_id': ""}
+    sources = world.source_names
+    for rt_level in range(1, rt_levels + 1):
+        config['RT-LEVEL-' + str(rt_level)] = {'conditions': ",".join(world.conditions),
+                                               'from': ",".join(sources[rt_level - 1::rt_levels] or sources)}
+    os.makedirs(os.path.join(work_dir, "conf.d"))
+    os.makedirs(os.path.join(work_dir, "db"))
+    with open(os.path.join(work_dir, "conf.d", "main.cfg"), 'w') as f:
+        config.write(f)
+    accounts = {}
+    for user_id in world.account_ids:
+        accounts[user_id] = dict(world.credentials(user_id), retweet_level=world.random.randint(1, rt_levels),
+                                 retweets=world.random.randint(0, 5000))
+    with open(os.path.join(work_dir, "db", config['DATABASE']['db_file']), 'w') as f:
+        json.dump({'tweets': world.stored_tweet_ids, 'accounts': accounts}, f)
+
+
+def bench_search_round(bot, world, args):
+    # the first round processes the whole timelines (no cursors yet) and is not measured, the measured rounds process
+    # `new_tweets_per_round` new tweets per source. Throughput: retweets per second.
+    bot.search_and_retweet_round()
+    samples = []
+    units = 0
+    for run in range(args.rounds):
+        world.add_tweets(args.new_tweets_per_round)
+        retweets = len(world.retweets)
+        samples.append(bot.search_and_retweet_round())
+        units += len(world.retweets) - retweets
+    return summarize(samples, units)
+
+
+def bench_dm_batch(bot, world, args):
+    samples = []
+    for run in range(args.rounds):
+        world.add_dms(args.dms)
+        dm_list = bot.api_dm.list_direct_messages(count=args.dms)
+        start = time.perf_counter()
+        bot.process_direct_messages(dm_list)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, args.dms * args.rounds)
+
+
+def bench_leaderboard_rebuild(bot, world, args):
+    samples = []
+    for run in range(args.rounds):
+        start = time.perf_counter()
+        bot.leaderboard.rebuild(bot.data['accounts'])
+        bot.get_leaderboard_table_string()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, len(bot.data['accounts']) * args.rounds)
+
+
+def bench_leaderboard_update(bot, world, args):
+    # one retweet of a random account, followed by the rank and top 10 queries of `get-info` and `get-bot-info`
+    samples = []
+    for run in range(args.rounds * 100):
+        user_id = random.choice(world.account_ids)
+        start = time.perf_counter()
+        bot.db_increment(['accounts', user_id, 'retweets'])
+        bot.leaderboard.get_rank(user_id)
+        bot.get_leaderboard_table_string()
+        samples.append(time.perf_counter() - start)
+    bot.save_db()
+    return summarize(samples, len(samples))
+
+
+def bench_save_db(bot, world, args):
+    # `changes` retweet counters are changed before every save
+    samples = []
+    for run in range(args.rounds * 10):
+        for change in range(args.changes):
+            bot.db_increment(['accounts', random.choice(world.account_ids), 'retweets'])
+        start = time.perf_counter()
+        bot.save_db()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, len(samples))
+
+
+benchmarks = [("search_round", bench_search_round),
+              ("dm_batch", bench_dm_batch),
+              ("leaderboard_rebuild", bench_leaderboard_rebuild),
+              ("leaderboard_update", bench_leaderboard_update),
+              ("save_db", bench_save_db)]
+
+
+def run_backend(backend, args):
+    # every backend gets a new world and its own work dir, because the bot uses ./conf.d and ./db
+    world = FakeTwitter(accounts=args.accounts, sources=args.sources, tweets_per_source=args.tweets_per_source,
+                        dms=0, stored_tweets=args.stored_tweets, hit_rate=args.hit_rate, latency=args.latency,
+                        seed=args.seed)
+    bench_dir = os.getcwd()
+    work_dir = os.path.join(bench_dir, backend)
+    results = {}
+    write_config(work_dir, world, backend, args.rt_levels)
+    os.chdir(work_dir)
+    try:
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            bot = Taubenschlag(config_path="./conf.d", args=[], api_factory=world.api_factory)
+            startup_time = time.perf_counter() - start
+        results[backend + "/startup"] = summarize([startup_time], len(bot.data['accounts']))
+        for name, function in benchmarks:
+            if args.only and name not in args.only:
+                continue
+            with redirect_stdout(io.StringIO()):
+                results[backend + "/" + name] = function(bot, world, args)
+        bot.retweet_pool.shutdown()
+        bot.timeline_pool.shutdown()
+        bot.db_storage.sync()
+    finally:
+        os.chdir(bench_dir)
+    return results
+
+
+def get_machine():
+    return {'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpus': os.cpu_count(),
+            'python': platform.python_implementation() + " " + platform.python_version()}
+
+
+def compare(results, baseline, fail_threshold):
+    # returns the list of regressions above `fail_threshold` percent (p50 latency up or throughput down)
+    regressions = []
+    print("")
+    print("Compared with the baseline of " + str(baseline.get('created', "unknown")) + ":")
+    for name in results:
+        if name not in baseline['results']:
+            print("\t" + name.ljust(34) + " not in baseline")
+            continue
+        old = baseline['results'][name]
+        p50_change = (results[name]['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] > 0 else 0.0
+        throughput_change = (results[name]['throughput'] - old['throughput']) / old['throughput'] * 100 \
+            if old['throughput'] > 0 else 0.0
+        line = "\t" + name.ljust(34) + " p50: " + ("%+.1f" % p50_change).rjust(7) + "%   throughput: " + \
+               ("%+.1f" % throughput_change).rjust(7) + "%"
+        if fail_threshold is not None and (p50_change > fail_threshold or throughput_change < -fail_threshold):
+            regressions.append(name)
+            line += "   REGRESSION"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="offline benchmarks of the bot hot paths against a fake Twitter API")
+    parser.add_argument('--accounts', dest='accounts', type=int, default=200, help='amount of saved accounts')
+    parser.add_argument('--sources', dest='sources', type=int, default=10, help='amount of rt source timelines')
+    parser.add_argument('--tweets-per-source', dest='tweets_per_source', type=int, default=5,
+                        help='tweets per source timeline before the first round')
+    parser.add_argument('--new-tweets-per-round', dest='new_tweets_per_round', type=int, default=1,
+                        help='new tweets per source timeline before every round')
+    parser.add_argument('--hit-rate', dest='hit_rate', type=float, default=0.2,
+                        help='share of tweets that contain a condition')
+    parser.add_argument('--rt-levels', dest='rt_levels', type=int, default=3, help='amount of rt levels')
+    parser.add_argument('--dms', dest='dms', type=int, default=100, help='DMs per DM batch')
+    parser.add_argument('--stored-tweets', dest='stored_tweets', type=int, default=20000,
+                        help='tweet ids in the seen tweet index')
+    parser.add_argument('--changes', dest='changes', type=int, default=10, help='db changes before every save_db')
+    parser.add_argument('--latency', dest='latency', type=float, default=0.0,
+                        help='simulated latency of every Twitter API call (seconds)')
+    parser.add_argument('--rounds', dest='rounds', type=int, default=5, help='runs of every benchmark')
+    parser.add_argument('--backends', dest='backends', default=",".join(backends),
+                        help='db backends to benchmark (default: ' + ",".join(backends) + ')')
+    parser.add_argument('--only', dest='only', default="",
+                        help='comma separated benchmarks to run (' + ",".join(name for name, function in benchmarks) +
+                             ')')
+    parser.add_argument('--seed', dest='seed', type=int, default=1, help='seed of the generated data')
+    parser.add_argument('--baseline', dest='baseline', default=os.path.join(repo_dir, "benchmarks", "baseline.json"),
+                        help='baseline file')
+    parser.add_argument('--save-baseline', dest='save_baseline', action="store_true",
+                        help='save the results as new baseline')
+    parser.add_argument('--fail-threshold', dest='fail_threshold', type=float,
+                        help='exit with 1 if p50 or throughput of a benchmark is worse than the baseline by more '
+                             'than this percentage')
+    args = parser.parse_args()
+    args.baseline = os.path.join(invocation_dir, args.baseline)
+    args.only = [name for name in args.only.split(",") if name]
+    random.seed(args.seed)
+    params = {'accounts': args.accounts, 'sources': args.sources, 'tweets_per_source': args.tweets_per_source,
+              'new_tweets_per_round': args.new_tweets_per_round, 'hit_rate': args.hit_rate,
+              'rt_levels': args.rt_levels, 'dms': args.dms, 'stored_tweets': args.stored_tweets,
+              'changes': args.changes, 'latency': args.latency, 'rounds': args.rounds}
+    results = {}
+    bench_dir = tempfile.mkdtemp(prefix="taubenschlag_bench_")
+    try:
+        os.chdir(bench_dir)
+        for backend in args.backends.split(","):
+            print("Running the benchmarks with the " + backend + " db backend ...")
+            results.update(run_backend(backend, args))
+    finally:
+        os.chdir(invocation_dir)
+        shutil.rmtree(bench_dir, ignore_errors=True)
+    print("")
+    print("benchmark".ljust(35) + "runs".rjust(6) + "p50 ms".rjust(11) + "p90 ms".rjust(11) + "p99 ms".rjust(11) +
+          "max ms".rjust(11) + "items/s".rjust(13))
+    for name in results:
+        print(name.ljust(35) + str(results[name]['runs']).rjust(6) + str(results[name]['p50_ms']).rjust(11) +
+              str(results[name]['p90_ms']).rjust(11) + str(results[name]['p99_ms']).rjust(11) +
+              str(results[name]['max_ms']).rjust(11) + str(results[name]['throughput']).rjust(13))
+    regressions = []
+    try:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline['params'] != params:
+            print("")
+            print("The baseline was created with other parameters: " + str(baseline['params']))
+        else:
+            if baseline.get('machine') != get_machine():
+                print("")
+                print("Warning: the baseline was created on another machine (" + str(baseline.get('machine')) + "), "
+                      "the timings are not comparable")
+            regressions = compare(results, baseline, args.fail_threshold)
+    except FileNotFoundError:
+        print("")
+        print("No baseline found at " + args.baseline + ", create one with --save-baseline")
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'created': time.strftime("%Y-%m-%d %H:%M:%S"), 'machine': get_machine(), 'params': params,
+                       'results': results}, f, indent=2)
+        print("Saved the baseline to " + args.baseline)
+    if len(regressions) > 0:
+        print("Regressions: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
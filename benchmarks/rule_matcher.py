@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# File: benchmarks/rule_matcher.py
+#
+# Part of ‘Taubenschlag'
+# GitHub: https://github.com/bithon/Taubenschlag
+#
+# Author: Oliver Zehentleitner
+#         https://about.me/oliver_zehentleitner/
+#
+# Copyright (c) 2019, Oliver Zehentleitner
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL-
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Compares the compiled RuleMatcher with the old nested `for condition: for tweet:` loop of `search_and_retweet()`
+# on the conditions of `./conf.d/rt-level-rule-set.cfg`.
+
+from argparse import ArgumentParser
+import configparser
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taubenschlag import RuleMatcher
+
+words = ["the", "community", "blockchain", "data", "is", "growing", "today", "new", "release", "of", "our", "app",
+         "check", "this", "out", "great", "news", "for", "everyone", "building", "on", "open", "index", "protocol"]
+
+
+def generate_tweets(amount, conditions, hit_rate):
+    tweets = []
+    for tweet_id in range(amount):
+        text = random.choices(words, k=random.randint(8, 30))
+        if random.random() < hit_rate:
+            condition = random.choice(conditions)
+            if random.random() < 0.5:
+                condition = condition.upper()
+            text.insert(random.randint(0, len(text)), condition)
+        tweets.append((tweet_id, " ".join(text)))
+    return tweets
+
+
+def nested_loop(conditions, tweets):
+    matched = set()
+    for condition in conditions:
+        for tweet_id, text in tweets:
+            if condition == "any":
+                retweet_permitted = True
+            else:
+                if str(condition).lower() in str(text).lower():
+                    retweet_permitted = True
+                else:
+                    retweet_permitted = False
+            if retweet_permitted is True:
+                if tweet_id not in matched:
+                    matched.add(tweet_id)
+    return matched
+
+
+def single_pass(matcher, tweets):
+    matched = set()
+    for tweet_id, text in tweets:
+        if matcher.match(text) is not False:
+            matched.add(tweet_id)
+    return matched
+
+
+def main():
+    parser = ArgumentParser(description="benchmark of the rt level rule matcher")
+    parser.add_argument('--tweets', dest='tweets', type=int, default=20000, help='amount of generated tweets')
+    parser.add_argument('--hit-rate', dest='hit_rate', type=float, default=0.2,
+                        help='share of tweets that contain a condition')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=5, help='runs per level, the best one counts')
+    parser.add_argument('--synthetic-conditions', dest='synthetic_conditions', type=int, default=40,
+                        help='amount of generated hashtags for an additional synthetic rule set')
+    args = parser.parse_args()
+    config = configparser.ConfigParser()
+    config.read("./conf.d/rt-level-rule-set.cfg")
+    rule_sets = []
+    for section in config.sections():
+        rule_sets.append((section, config[section]['conditions'].split(",")))
+    if args.synthetic_conditions > 0:
+        rule_sets.append(("SYNTHETIC", ["#" + "".join(random.choices(string.ascii_lowercase, k=random.randint(4, 12)))
+                                        for index in range(args.synthetic_conditions)]))
+    for section, conditions in rule_sets:
+        tweets = generate_tweets(args.tweets, [condition for condition in conditions if condition != "any"] or
+                                 ["any"], args.hit_rate)
+        compile_start = time.perf_counter()
+        matcher = RuleMatcher(conditions)
+        compile_time = time.perf_counter() - compile_start
+        nested_times = []
+        single_times = []
+        for run in range(args.repeat):
+            start = time.perf_counter()
+            nested_result = nested_loop(conditions, tweets)
+            nested_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            single_result = single_pass(matcher, tweets)
+            single_times.append(time.perf_counter() - start)
+        if nested_result != single_result:
+            print(section + ": ERROR - the results of the matchers are different!")
+            sys.exit(1)
+        print(section + " (" + str(len(conditions)) + " conditions, " + str(args.tweets) + " tweets, " +
+              str(len(single_result)) + " matches):")
+        print("\tnested loop:  " + str(round(min(nested_times) * 1000, 2)) + " ms")
+        print("\tsingle pass:  " + str(round(min(single_times) * 1000, 2)) + " ms (compile: " +
+              str(round(compile_time * 1000, 3)) + " ms)")
+        print("\tspeedup:      " + str(round(min(nested_times) / min(single_times), 2)) + "x")
+
+
+if __name__ == "__main__":
+    main()
@@ -36,39 +36,1773 @@
 from __future__ import print_function
 from argparse import ArgumentParser
 from cheroot import wsgi
-from copy import deepcopy
-from flask import Flask, redirect, request
-from paramiko import SSHClient, AutoAddPolicy
-from scp import SCPClient
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy, deepcopy
+from flask import Flask, Response, jsonify, redirect, request
+from paramiko import SSHClient, SSHException, AutoAddPolicy
 from shutil import copyfile
 import argparse
+import base64
+import bisect
 import configparser
 import datetime
+import gzip
+import hashlib
+import hmac
 import logging
+import itertools
 import json
 import os
+import queue
 import random
+import re
 import requests
+import sqlite3
+import sys
 import textwrap
 import threading
 import time
 import tweepy
+import types
 
-abspath = os.path.abspath(__file__)
-dname = os.path.dirname(abspath)
-os.chdir(dname)
 
-logging.basicConfig(format="{asctime} [{levelname:8}] {process} {thread} {module} {pathname} {lineno}: {message}",
-                    filename='taubenschlag.log',
-                    style="{")
-logging.getLogger('taubenschlag').addHandler(logging.StreamHandler())
-logging.getLogger('taubenschlag').setLevel(logging.INFO)
+class Metrics(object):
+    # Counters and latency histograms of the bot, rendered in the Prometheus text format by the `/metrics` route.
+    # Values that already exist elsewhere (cache stats, queue sizes, ...) are added at render time by collectors.
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
 
+    def __init__(self, prefix="taubenschlag_"):
+        self.prefix = prefix
+        self.descriptions = {}
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.lock = threading.Lock()
 
-class Taubenschlag(object):
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(str(name) + '="' + str(labels[name]).replace("\\", "\\\\").replace('"', '\\"')
+                              .replace("\n", "\\n") + '"' for name in sorted(labels)) + "}"
+
+    def add_collector(self, collector):
+        # `collector()` returns a list of (name, labels, value) gauges
+        self.collectors.append(collector)
+
+    def describe(self, name, metric_type, description):
+        self.descriptions[self.prefix + name] = (metric_type, description)
+
+    def inc(self, name, value=1, **labels):
+        key = (self.prefix + name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (self.prefix + name, tuple(sorted(labels.items())))
+        with self.lock:
+            try:
+                histogram = self.histograms[key]
+            except KeyError:
+                histogram = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                self.histograms[key] = histogram
+            for index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    histogram['buckets'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def render(self):
+        samples = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append(name + self._labels(dict(labels)) + " " + str(value))
+            for (name, labels), histogram in self.histograms.items():
+                cumulative = 0
+                for index, bucket in enumerate(self.buckets):
+                    cumulative += histogram['buckets'][index]
+                    samples.setdefault(name, []).append(name + "_bucket" + self._labels(dict(labels, le=bucket)) +
+                                                        " " + str(cumulative))
+                samples[name].append(name + "_bucket" + self._labels(dict(labels, le="+Inf")) + " " +
+                                     str(histogram['count']))
+                samples[name].append(name + "_sum" + self._labels(dict(labels)) + " " + str(histogram['sum']))
+                samples[name].append(name + "_count" + self._labels(dict(labels)) + " " + str(histogram['count']))
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    samples.setdefault(self.prefix + name, []).append(self.prefix + name + self._labels(labels) +
+                                                                      " " + str(value))
+            except Exception as error_msg:
+                logging.error("metrics collector failed: " + str(error_msg))
+        lines = []
+        for name in sorted(samples):
+            try:
+                metric_type, description = self.descriptions[name]
+                lines.append("# HELP " + name + " " + description)
+                lines.append("# TYPE " + name + " " + metric_type)
+            except KeyError:
+                pass
+            lines.extend(samples[name])
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedApi(object):
+    # Proxy for a tweepy.API that records the latency, the errors and the rate limit hits of every call per endpoint
+    # (= name of the API method) in `metrics` and, if tracing is enabled, a span per call. With a `governor` every
+    # call takes its budget from the RateLimitGovernor under `token` (the owner of the access token) first.
+    def __init__(self, api, metrics, tracer=None, governor=None, token=None):
+        self.api = api
+        self.metrics = metrics
+        self.tracer = tracer
+        self.governor = governor
+        self.token = str(token)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.api, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            if self.governor is not None:
+                self.governor.acquire(self.token, name)
+            start_time = time.time()
+            try:
+                if self.tracer is not None and self.tracer.enabled:
+                    with self.tracer.span("twitter_api." + name):
+                        result = attribute(*args, **kwargs)
+                else:
+                    result = attribute(*args, **kwargs)
+                if self.governor is not None:
+                    self.governor.update(self.token, name, getattr(self.api, 'last_response', None))
+                return result
+            except tweepy.error.RateLimitError as error_msg:
+                self.metrics.inc("twitter_api_rate_limit_hits_total", endpoint=name)
+                self.metrics.inc("twitter_api_errors_total", endpoint=name, code="88")
+                if self.governor is not None:
+                    error_msg.retry_after = self.governor.exhausted(self.token, name, error_msg.response)
+                raise
+            except tweepy.error.TweepError as error_msg:
+                self.metrics.inc("twitter_api_errors_total", endpoint=name, code=str(error_msg.api_code))
+                raise
+            finally:
+                self.metrics.observe("twitter_api_call_duration_seconds", time.time() - start_time, endpoint=name)
+        return call
+
+
+class RateLimitGovernor(object):
+    # Rate limit budgets of the Twitter API per token and endpoint, read from the `x-rate-limit-*` headers of the
+    # responses. `acquire()` takes one call from the budget. If it is used up, the call waits for the reset of the
+    # window if that is at most `max_wait` seconds away, otherwise it fails at once with a RateLimitError (with
+    # `retry_after`) and the caller can go on with other work. The priority of the calls of a thread is set with
+    # `with governor.priority("interactive"|"normal"|"bulk"):`. Bulk calls leave `bulk_reserve` and normal calls
+    # `normal_reserve` of every budget to the higher priorities, so DM replies still get through during a fan-out.
+    # Only the endpoints below are tracked, the endpoint is matched against the URL of `api.last_response` because
+    # the tweepy.API objects are shared by threads.
+    resources = {'create_friendship': "/friendships/create",
+                 'destroy_direct_message': "/direct_messages/events/destroy",
+                 'get_status': "/statuses/show",
+                 'get_user': "/users/show",
+                 'list_direct_messages': "/direct_messages/events/list",
+                 'lookup_users': "/users/lookup",
+                 'retweet': "/statuses/retweet",
+                 'send_direct_message': "/direct_messages/events/new",
+                 'user_timeline': "/statuses/user_timeline",
+                 'verify_credentials': "/account/verify_credentials"}
+
+    def __init__(self, max_wait=60, bulk_reserve=0.2, normal_reserve=0.05, metrics=None):
+        self.max_wait = float(max_wait)
+        self.reserves = {'interactive': 0.0, 'normal': float(normal_reserve), 'bulk': float(bulk_reserve)}
+        self.metrics = metrics
+        self.buckets = {}
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.rejected = 0
+        self.exhausted_count = 0
+        self.local = threading.local()
+        self.condition = threading.Condition()
+
+    def _priorities(self):
+        try:
+            return self.local.priorities
+        except AttributeError:
+            self.local.priorities = []
+            return self.local.priorities
+
+    def acquire(self, token, endpoint):
+        priority = self.get_priority()
+        key = (str(token), endpoint)
+        with self.condition:
+            while True:
+                bucket = self.buckets.get(key)
+                now = time.time()
+                if bucket is None or bucket['reset'] <= now:
+                    # unknown or reset window, the next response tells the new budget
+                    self.buckets.pop(key, None)
+                    return True
+                if bucket['remaining'] > bucket['limit'] * self.reserves[priority]:
+                    bucket['remaining'] -= 1
+                    return True
+                wait_time = bucket['reset'] - now
+                if wait_time > self.max_wait:
+                    self.rejected += 1
+                    if self.metrics is not None:
+                        self.metrics.inc("rate_limit_rejected_total", endpoint=endpoint, priority=priority)
+                    error_msg = tweepy.error.RateLimitError("rate limit budget of " + endpoint + " used up for " +
+                                                            priority + " calls, reset in " + str(int(wait_time)) +
+                                                            " seconds")
+                    error_msg.retry_after = wait_time
+                    raise error_msg
+                self.waits += 1
+                self.wait_seconds += wait_time
+                if self.metrics is not None:
+                    self.metrics.observe("rate_limit_wait_seconds", wait_time, priority=priority)
+                logging.info("waiting " + str(round(wait_time, 1)) + " seconds for the rate limit reset of " + endpoint)
+                self.condition.wait(wait_time)
+
+    def exhausted(self, token, endpoint, response=None):
+        # the budget was used up by a 429 response, returns the seconds until the reset
+        reset = None
+        try:
+            reset = float(response.headers['x-rate-limit-reset'])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            pass
+        if reset is None or reset <= time.time():
+            reset = time.time() + 60 * 15
+        with self.condition:
+            self.exhausted_count += 1
+            self.buckets[(str(token), endpoint)] = {'limit': 1, 'remaining': 0, 'reset': reset}
+        return reset - time.time()
+
+    def get_priority(self):
+        priorities = self._priorities()
+        if priorities:
+            return priorities[-1]
+        return "normal"
+
+    def get_wait_time(self, token, endpoint):
+        # seconds until a call of the current priority gets budget again (0 = now)
+        with self.condition:
+            bucket = self.buckets.get((str(token), endpoint))
+            if bucket is None or bucket['remaining'] > bucket['limit'] * self.reserves[self.get_priority()]:
+                return 0
+            return max(0, bucket['reset'] - time.time())
+
+    def priority(self, priority):
+        return RateLimitPriority(self, priority)
+
+    def stats(self):
+        with self.condition:
+            return {'buckets': len(self.buckets),
+                    'waits': self.waits,
+                    'wait_seconds': round(self.wait_seconds, 1),
+                    'rejected': self.rejected,
+                    'exhausted': self.exhausted_count}
+
+    def update(self, token, endpoint, response):
+        try:
+            if self.resources[endpoint] not in response.url:
+                # response of an other endpoint that was called with the same api object in the meantime
+                return False
+            limit = int(response.headers['x-rate-limit-limit'])
+            remaining = int(response.headers['x-rate-limit-remaining'])
+            reset = float(response.headers['x-rate-limit-reset'])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return False
+        with self.condition:
+            bucket = self.buckets.get((str(token), endpoint))
+            if bucket is not None and bucket['reset'] == reset:
+                # calls that acquired budget after this request are already counted
+                remaining = min(remaining, bucket['remaining'])
+            self.buckets[(str(token), endpoint)] = {'limit': limit, 'remaining': remaining, 'reset': reset}
+            self.condition.notify_all()
+        return True
+
+
+class RateLimitPriority(object):
+    # Context manager of RateLimitGovernor.priority(), sets the priority of the calls of the current thread
+    def __init__(self, governor, priority):
+        self.governor = governor
+        self.priority = priority
+
+    def __enter__(self):
+        self.governor._priorities().append(self.priority)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.governor._priorities().pop()
+        return False
+
+
+class TraceSpan(object):
+    # One span of the Tracer, use it as context manager. `attributes` can be extended until the span is closed.
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = None
+        self.parent_id = None
+        self.start = None
+
+    def __enter__(self):
+        if self.tracer is not None:
+            self.tracer.open(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.tracer is not None:
+            if exc_type is not None:
+                self.attributes['error'] = exc_type.__name__
+            self.tracer.close(self)
+        return False
+
+
+class Tracer(object):
+    # Nested tracing spans (round > rt level > tweet > account > Twitter API call, ...) written as JSON lines or as
+    # Chrome trace events (chrome://tracing, https://ui.perfetto.dev). The parent of a new span is the innermost open
+    # span of the thread, `wrap()` hands it over to functions that run in a thread pool. If tracing is off `span()`
+    # returns a shared no-op span.
+    def __init__(self, trace_format="off", file_path="./taubenschlag_trace.json"):
+        self.format = trace_format
+        self.enabled = trace_format in ("jsonl", "chrome")
+        self.file_path = file_path
+        self.file = False
+        self.span_ids = itertools.count(1)
+        self.thread_names = set()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # the attributes of the no-op span are never written, it only has to accept them
+        self.null_span = TraceSpan(None, None, {})
+
+    def _stack(self):
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def _write(self, span, end):
+        thread = threading.current_thread()
+        if self.format == "chrome":
+            lines = []
+            if thread.ident not in self.thread_names:
+                self.thread_names.add(thread.ident)
+                lines.append(json.dumps({'name': "thread_name", 'ph': "M", 'pid': os.getpid(), 'tid': thread.ident,
+                                         'args': {'name': thread.name}}))
+            lines.append(json.dumps({'name': span.name, 'cat': "taubenschlag", 'ph': "X",
+                                     'ts': int(span.start * 1000000), 'dur': int((end - span.start) * 1000000),
+                                     'pid': os.getpid(), 'tid': thread.ident,
+                                     'args': dict(span.attributes, span_id=span.span_id, parent_id=span.parent_id)},
+                                    default=str))
+            text = "".join(line + ",\n" for line in lines)
+        else:
+            text = json.dumps({'name': span.name, 'span_id': span.span_id, 'parent_id': span.parent_id,
+                               'start': span.start, 'duration': end - span.start, 'thread': thread.name,
+                               'attributes': span.attributes}, default=str) + "\n"
+        with self.lock:
+            if self.file is False:
+                self.file = open(self.file_path, 'a')
+                if self.format == "chrome" and self.file.tell() == 0:
+                    # the closing bracket is optional in the Chrome trace format, so the file can be appended
+                    self.file.write("[\n")
+            self.file.write(text)
+
+    def close(self, span):
+        end = time.time()
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        self._write(span, end)
+
+    def current(self):
+        stack = self._stack()
+        if stack:
+            return stack[-1]
+        return None
+
+    def flush(self):
+        with self.lock:
+            if self.file is not False:
+                self.file.flush()
+
+    def open(self, span):
+        stack = self._stack()
+        span.span_id = next(self.span_ids)
+        if stack:
+            span.parent_id = stack[-1].span_id
+        span.start = time.time()
+        stack.append(span)
+
+    def span(self, name, **attributes):
+        if self.enabled is False:
+            return self.null_span
+        return TraceSpan(self, name, attributes)
+
+    def wrap(self, function, name=None, **attributes):
+        # returns `function` for an other thread: its spans get the current span as parent, optional in a new span
+        if self.enabled is False:
+            return function
+        parent = self.current()
+
+        def wrapped(*args, **kwargs):
+            stack = self._stack()
+            previous_stack = list(stack)
+            stack[:] = [parent] if parent is not None else []
+            try:
+                if name is None:
+                    return function(*args, **kwargs)
+                with self.span(name, **attributes):
+                    return function(*args, **kwargs)
+            finally:
+                stack[:] = previous_stack
+        return wrapped
+
+
+class SamplingProfiler(object):
+    # Samples the stacks of all threads every `interval` seconds in its own thread and writes them in the folded stack
+    # format of flamegraph.pl and speedscope: one line `thread;outer function;...;inner function count` per stack.
+    def __init__(self, interval=0.01):
+        self.interval = float(interval)
+        self.samples = {}
+        self.sample_count = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        own_thread_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code.co_name + " (" + os.path.basename(frame.f_code.co_filename) + ":" +
+                                 str(frame.f_code.co_firstlineno) + ")")
+                    frame = frame.f_back
+                key = thread_names.get(thread_id, str(thread_id)) + ";" + ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.sample_count += 1
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def write(self, file_path):
+        with open(file_path, 'w') as f:
+            for key in sorted(self.samples):
+                f.write(key + " " + str(self.samples[key]) + "\n")
+        return self.sample_count
+
+
+class TwitterHttpSession(requests.Session):
+    # tweepy 3 creates and closes a requests session for every API call (tweepy.binder), so a cached client still
+    # opened a new TLS connection per call. Installed as the session of the binder by `share_twitter_connections()`,
+    # all these sessions use one shared connection pool and closing a session keeps its connections alive for the
+    # next call. A session can not be shared itself, the binder stores the parameters of the call in it.
+    adapter = None
+
+    def __init__(self):
+        super(TwitterHttpSession, self).__init__()
+        if TwitterHttpSession.adapter is not None:
+            self.mount("https://", TwitterHttpSession.adapter)
+
+    def close(self):
+        for adapter in self.adapters.values():
+            if adapter is not TwitterHttpSession.adapter:
+                adapter.close()
+
+
+def share_twitter_connections(pool_maxsize):
+    if TwitterHttpSession.adapter is not None or not hasattr(tweepy, "binder"):
+        return False
+    TwitterHttpSession.adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=int(pool_maxsize))
+    binder_requests = types.ModuleType("requests")
+    binder_requests.__dict__.update(requests.__dict__)
+    binder_requests.Session = TwitterHttpSession
+    tweepy.binder.requests = binder_requests
+    return True
+
+
+class ApiClientPool(object):
+    # Authenticated tweepy clients of the user accounts, keyed by user id. A client gets rebuilt if the access token
+    # of the account changes (new oAuth) and evicted if the token got revoked. The clients share the keep-alive
+    # connections of one pool with up to `connection_pool_size` connections (TwitterHttpSession).
+    def __init__(self, consumer_key, consumer_secret, metrics=None, tracer=None, api_factory=None, governor=None,
+                 connection_pool_size=10):
+        if api_factory is None:
+            share_twitter_connections(connection_pool_size)
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.api_factory = api_factory
+        self.metrics = metrics
+        self.tracer = tracer
+        self.governor = governor
+        self.clients = {}
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def evict(self, user_id):
+        with self.lock:
+            try:
+                del self.clients[str(user_id)]
+                self.evicted += 1
+            except KeyError:
+                pass
+
+    def get_api(self, user_id, access_token, access_token_secret):
+        with self.lock:
+            try:
+                client_token, client_token_secret, api = self.clients[str(user_id)]
+                if client_token == access_token and client_token_secret == access_token_secret:
+                    self.reused += 1
+                    return api
+            except KeyError:
+                pass
+        if self.api_factory is not None:
+            api = self.api_factory(self.consumer_key, self.consumer_secret, access_token, access_token_secret)
+        else:
+            auth = tweepy.OAuthHandler(self.consumer_key, self.consumer_secret)
+            auth.set_access_token(access_token, access_token_secret)
+            api = tweepy.API(auth)
+        if self.metrics is not None:
+            api = InstrumentedApi(api, self.metrics, tracer=self.tracer, governor=self.governor, token=user_id)
+        with self.lock:
+            self.clients[str(user_id)] = (access_token, access_token_secret, api)
+            self.created += 1
+        return api
+
+    def stats(self):
+        with self.lock:
+            if self.created + self.reused > 0:
+                reuse_rate = round(self.reused / (self.created + self.reused) * 100, 2)
+            else:
+                reuse_rate = 0.0
+            return {'size': len(self.clients),
+                    'created': self.created,
+                    'reused': self.reused,
+                    'evicted': self.evicted,
+                    'reuse_rate': reuse_rate}
+
+
+class UserCache(object):
+    # Shared TTL + LRU cache for `users/show` lookups. Unknown or suspended users are cached negatively, so we
+    # dont ask Twitter again and again for accounts that dont exist anymore. `get_users()` hydrates many users at once
+    # with up to 100 ids per `users/lookup` call and `lookup_concurrency` calls in parallel. The screen names point to
+    # the cached profiles and get evicted together with them.
+    def __init__(self, api, max_size=10000, ttl=3600, negative_ttl=600, lookup_concurrency=4):
+        self.api = api
+        self.max_size = int(max_size)
+        self.ttl = int(ttl)
+        self.negative_ttl = int(negative_ttl)
+        self.lookup_pool = ThreadPoolExecutor(max_workers=int(lookup_concurrency))
+        self.lookups = 0
+        self.entries = OrderedDict()
+        self.screen_names = {}
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.lock = threading.Lock()
+
+    def _lookup_users(self, user_ids):
+        users = {}
+        try:
+            found = self.api.lookup_users(user_ids=user_ids)
+        except tweepy.error.RateLimitError:
+            raise
+        except tweepy.error.TweepError as error_msg:
+            # 17 = no user matches the ids, all users of the chunk are cached negatively below
+            if error_msg.api_code != 17:
+                raise
+            found = []
+        for user in found:
+            self.put(user)
+            users[str(user.id)] = user
+        with self.lock:
+            self.lookups += 1
+            for user_id in user_ids:
+                if user_id not in users:
+                    self._set_entry(user_id, None, tweepy.TweepError("User not found.", api_code=50))
+        return users
+
+    def _get_entry(self, key):
+        try:
+            expires, user, error = self.entries[key]
+        except KeyError:
+            return False
+        if expires < time.time():
+            self._remove_entry(key)
+            return False
+        self.entries.move_to_end(key)
+        return user, error
+
+    def _set_entry(self, key, user, error=None):
+        if error is None:
+            expires = time.time() + self.ttl
+        else:
+            expires = time.time() + self.negative_ttl
+        if key in self.entries:
+            self._remove_entry(key)
+        self.entries[key] = (expires, user, error)
+        if user is not None:
+            self.screen_names["@" + str(user.screen_name).lower()] = key
+        while len(self.entries) > self.max_size:
+            self._remove_entry(next(iter(self.entries)))
+
+    def _remove_entry(self, key):
+        expires, user, error = self.entries.pop(key)
+        if user is not None and self.screen_names.get("@" + str(user.screen_name).lower()) == key:
+            del self.screen_names["@" + str(user.screen_name).lower()]
+
+    def get_user(self, user_id=None, screen_name=None):
+        if user_id is not None:
+            key = str(user_id)
+        else:
+            key = "@" + str(screen_name).lower()
+        with self.lock:
+            if key.startswith("@") and key in self.screen_names:
+                entry = self._get_entry(self.screen_names[key])
+            else:
+                entry = self._get_entry(key)
+            if entry is not False:
+                user, error = entry
+                if error is None:
+                    self.hits += 1
+                    return user
+                self.negative_hits += 1
+                raise tweepy.TweepError(error.reason, api_code=error.api_code)
+            self.misses += 1
+        try:
+            if user_id is not None:
+                user = self.api.get_user(user_id=user_id)
+            else:
+                user = self.api.get_user(screen_name=screen_name)
+        except tweepy.error.RateLimitError:
+            raise
+        except tweepy.error.TweepError as error_msg:
+            # 50 = user not found, 63 = user has been suspended
+            if error_msg.api_code in (50, 63):
+                with self.lock:
+                    self._set_entry(key, None, error_msg)
+            raise
+        self.put(user)
+        return user
+
+    def get_users(self, user_ids):
+        # returns {user_id: user}, unknown and suspended users are missing in the result
+        result = {}
+        missing = []
+        with self.lock:
+            for user_id in OrderedDict.fromkeys(str(user_id) for user_id in user_ids):
+                entry = self._get_entry(user_id)
+                if entry is False:
+                    self.misses += 1
+                    missing.append(user_id)
+                    continue
+                user, error = entry
+                if error is None:
+                    self.hits += 1
+                    result[user_id] = user
+                else:
+                    self.negative_hits += 1
+        chunks = [missing[index:index + 100] for index in range(0, len(missing), 100)]
+        if len(chunks) == 1:
+            result.update(self._lookup_users(chunks[0]))
+        elif len(chunks) > 1:
+            futures = [self.lookup_pool.submit(self._lookup_users, chunk) for chunk in chunks]
+            for future in futures:
+                result.update(future.result())
+        return result
+
+    def put(self, user):
+        with self.lock:
+            self._set_entry(str(user.id), user)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            try:
+                self._remove_entry(str(user_id))
+            except KeyError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            requests_total = self.hits + self.negative_hits + self.misses
+            if requests_total > 0:
+                hit_rate = round((self.hits + self.negative_hits) / requests_total * 100, 2)
+            else:
+                hit_rate = 0.0
+            return {'size': len(self.entries),
+                    'hits': self.hits,
+                    'negative_hits': self.negative_hits,
+                    'misses': self.misses,
+                    'lookups': self.lookups,
+                    'hit_rate': hit_rate}
+
+    def warm_up(self, user_ids):
+        return len(self.get_users(user_ids))
+
+
+class RuleMatcher(object):
+    # The conditions of a rt level, compiled once at config load. A tweet is lowercased once and not once per
+    # condition. Up to `regex_threshold` conditions plain substring searches are faster than a regex alternation in
+    # CPython, above that all conditions are combined into one regex (see ./benchmarks/rule_matcher.py).
+    # match() returns the matched condition, 'any' or False.
+    regex_threshold = 8
+
+    def __init__(self, conditions):
+        self.conditions = []
+        self.lookup = {}
+        self.match_any = False
+        for condition in conditions:
+            if condition == "any":
+                self.match_any = True
+            elif condition.lower() not in self.lookup:
+                self.conditions.append((condition.lower(), condition))
+                self.lookup[condition.lower()] = condition
+        if len(self.conditions) > self.regex_threshold:
+            patterns = sorted(self.lookup, key=len, reverse=True)
+            self.regex = re.compile("|".join(re.escape(pattern) for pattern in patterns))
+        else:
+            self.regex = False
+
+    def match(self, text):
+        if len(self.conditions) == 0:
+            if self.match_any:
+                return "any"
+            return False
+        text = str(text).lower()
+        if self.regex is not False:
+            result = self.regex.search(text)
+            if result is not None:
+                return self.lookup[result.group(0)]
+        else:
+            for pattern, condition in self.conditions:
+                if pattern in text:
+                    return condition
+        if self.match_any:
+            return "any"
+        return False
+
+
+class SeenTweetIndex(object):
+    # Set of already processed tweet ids. Tweet ids are snowflakes and contain their creation time, so ids older than
+    # the retention window can be dropped and are covered by the watermark: every id <= watermark counts as seen. On
+    # disk the ids are stored sorted and delta encoded.
+    twitter_epoch_ms = 1288834974657
+
+    def __init__(self, retention_days=0):
+        self.retention_days = int(retention_days)
+        self.ids = set()
+        self.watermark = 0
+        self.exported = False
+        self.lock = threading.Lock()
+
+    def __contains__(self, tweet_id):
+        tweet_id = int(tweet_id)
+        return tweet_id <= self.watermark or tweet_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, tweet_id):
+        with self.lock:
+            self.ids.add(int(tweet_id))
+            self.exported = False
+
+    def export(self):
+        with self.lock:
+            if self.exported is False:
+                deltas = []
+                last_id = 0
+                for tweet_id in sorted(self.ids):
+                    deltas.append(tweet_id - last_id)
+                    last_id = tweet_id
+                self.exported = {'format': "delta",
+                                 'watermark': self.watermark,
+                                 'ids': deltas}
+            return self.exported
+
+    def load(self, value, watermark=0):
+        with self.lock:
+            self.ids = set()
+            self.watermark = int(watermark)
+            self.exported = False
+            if isinstance(value, list):
+                # old db layout or sqlite: plain list of tweet ids
+                self.ids = set(int(tweet_id) for tweet_id in value)
+            elif isinstance(value, dict):
+                self.watermark = int(value['watermark'])
+                last_id = 0
+                for delta in value['ids']:
+                    last_id += delta
+                    self.ids.add(last_id)
+        self.prune()
+
+    def prune(self):
+        if self.retention_days <= 0:
+            return 0
+        boundary_ms = int(time.time() * 1000) - self.retention_days * 86400 * 1000 - self.twitter_epoch_ms
+        boundary_id = boundary_ms << 22
+        with self.lock:
+            if boundary_id <= self.watermark:
+                return 0
+            expired_ids = [tweet_id for tweet_id in self.ids if tweet_id < boundary_id]
+            for tweet_id in expired_ids:
+                self.ids.discard(tweet_id)
+            self.watermark = boundary_id - 1
+            self.exported = False
+        return len(expired_ids)
+
+
+class DbJournal(object):
+    # Append-only journal for the JSON db: every change is written as one JSON line, fsync is done in batches and a
+    # compaction writes a new snapshot of the db and truncates the journal. Records carry a sequence number and the
+    # snapshot remembers the last applied one, so a crash between snapshot and truncation can not apply a record twice.
+    def __init__(self, file_path, fsync_interval=1, compact_after=10000):
+        self.file_path = file_path
+        self.fsync_interval = float(fsync_interval)
+        self.compact_after = int(compact_after)
+        self.file = False
+        self.seq = 0
+        self.records = 0
+        self.written_bytes = 0
+        self.unsynced = False
+        self.last_sync = time.time()
+        self.lock = threading.Lock()
+
+    def append(self, record):
+        with self.lock:
+            if self.file is False:
+                self.file = open(self.file_path, 'a')
+            self.seq += 1
+            record['seq'] = self.seq
+            line = json.dumps(record) + "\n"
+            self.file.write(line)
+            self.written_bytes += len(line)
+            self.records += 1
+            self.unsynced = True
+            return self.seq
+
+    def flush(self, force_sync=False):
+        with self.lock:
+            if self.file is False:
+                return False
+            self.file.flush()
+            if self.unsynced and (force_sync or time.time() - self.last_sync >= self.fsync_interval):
+                os.fsync(self.file.fileno())
+                self.unsynced = False
+                self.last_sync = time.time()
+            return True
+
+    def needs_compaction(self):
+        return self.records >= self.compact_after
+
+    def read(self, after_seq=0, repair=True):
+        # a record that was not completely written before the bot went down is cut off with `repair`, otherwise new
+        # records would be appended to the torn line and be lost on the next start
+        records = []
+        good_offset = 0
+        torn = False
+        try:
+            with open(self.file_path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line.decode('utf-8')) if line.strip() else None
+                    except (UnicodeDecodeError, json.decoder.JSONDecodeError) as error_msg:
+                        logging.error("skipping truncated journal record: " + str(error_msg))
+                        torn = True
+                        break
+                    if not line.endswith(b"\n"):
+                        # complete record without its line break
+                        torn = True
+                    good_offset += len(line)
+                    if record is None:
+                        continue
+                    self.seq = max(self.seq, int(record['seq']))
+                    if int(record['seq']) > after_seq:
+                        records.append(record)
+        except FileNotFoundError:
+            pass
+        if torn and repair:
+            with open(self.file_path, 'r+b') as f:
+                f.truncate(good_offset)
+                if good_offset > 0:
+                    f.seek(good_offset - 1)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            logging.warning("repaired the db journal, cut off after byte " + str(good_offset))
+        self.seq = max(self.seq, after_seq)
+        self.records = len(records)
+        return records
+
+    def truncate(self):
+        with self.lock:
+            if self.file is not False:
+                self.file.close()
+            self.file = open(self.file_path, 'w')
+            os.fsync(self.file.fileno())
+            self.records = 0
+            self.unsynced = False
+            self.last_sync = time.time()
+
+
+def apply_db_record(data, seen_tweets, record):
+    if record['op'] == "tweet":
+        seen_tweets.add(record['id'])
+        # the fan-out of the tweet is finished, its retweets are not needed in the ledger anymore
+        data.get('retweet_ledger', {}).get('tweets', {}).pop(str(record['id']), None)
+        return True
+    if record['op'] == "retweet":
+        # retweet ledger: stable index per account and a bitmap of the accounts that retweeted per tweet
+        ledger = data.setdefault('retweet_ledger', {'accounts': {}, 'tweets': {}})
+        index = ledger['accounts'].setdefault(str(record['user_id']), len(ledger['accounts']))
+        ledger['tweets'][str(record['tweet_id'])] = ledger['tweets'].get(str(record['tweet_id']), 0) | (1 << index)
+        return True
+    target = data
+    for key in record['path'][:-1]:
+        target = target[key]
+    key = record['path'][-1]
+    if record['op'] == "set":
+        target[key] = record['value']
+    elif record['op'] == "incr":
+        target[key] = target.get(key, 0) + record['value']
+    elif record['op'] == "del":
+        del target[key]
+    return True
+
+
+class DbState(object):
+    # Copy-on-write state of the db with one writer (`Taubenschlag._db_change()` under the db lock). `snapshot()`
+    # hands out the current tree in O(1), the first change after a snapshot copies the dicts on its path (shallow, the
+    # rest of the tree is shared), so a snapshot never changes and can be read by other threads without a lock.
+    def __init__(self, data):
+        self.data = data
+        # ids of the dicts that were copied since the last snapshot, they belong to the writer only
+        self.owned = set()
+        self.snapshots = 0
+        self.copies = 0
+
+    def _own(self, parent, key):
+        node = parent[key]
+        if id(node) not in self.owned:
+            node = copy(node)
+            parent[key] = node
+            self.owned.add(id(node))
+            self.copies += 1
+        return node
+
+    def apply(self, seen_tweets, record):
+        if id(self.data) not in self.owned:
+            self.data = copy(self.data)
+            self.owned.add(id(self.data))
+            self.copies += 1
+        if record['op'] == "tweet":
+            paths = [['retweet_ledger', 'tweets']]
+        elif record['op'] == "retweet":
+            paths = [['retweet_ledger', 'accounts'], ['retweet_ledger', 'tweets']]
+        else:
+            paths = [record['path'][:-1]]
+        for path in paths:
+            node = self.data
+            for key in path:
+                if key not in node:
+                    break
+                node = self._own(node, key)
+        apply_db_record(self.data, seen_tweets, record)
+        return self.data
+
+    def snapshot(self):
+        self.owned.clear()
+        self.snapshots += 1
+        return self.data
+
+    def stats(self):
+        return {'snapshots': self.snapshots,
+                'copies': self.copies}
+
+
+class DirectMessageEvent(object):
+    # DM event of the account activity webhook with the attributes of a tweepy DirectMessage that the bot uses
+    def __init__(self, event):
+        self.id = event['id']
+        self.created_timestamp = event.get('created_timestamp')
+        self.message_create = event['message_create']
+
+
+class JsonStorage(object):
+    # The whole db is one JSON file in ./db/, optional with an append-only journal (DbJournal) for the changes since
+    # the last snapshot. A `read_only` storage (fan-out workers) never repairs the journal of the writing process.
+    def __init__(self, db_file, journal=False, journal_fsync_interval=1, journal_compact_after=10000, read_only=False):
+        self.db_file = db_file
+        self.read_only = read_only
+        self.written_bytes = 0
+        if journal:
+            self.journal = DbJournal(db_file + "_journal",
+                                     fsync_interval=journal_fsync_interval,
+                                     compact_after=journal_compact_after)
+            self.sync_interval = self.journal.fsync_interval
+        else:
+            self.journal = False
+            self.sync_interval = False
+
+    def commit(self, data, seen_tweets):
+        if self.journal is not False:
+            self.journal.flush()
+            if self.journal.needs_compaction() is False:
+                return True
+        return self.write_snapshot(data, seen_tweets)
+
+    def get_version(self):
+        # changes if an other process changed the db files
+        version = []
+        for file_path in (self.db_file, self.db_file + "_journal"):
+            try:
+                stat = os.stat(file_path)
+                version.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                version.append(None)
+        return tuple(version)
+
+    def load(self, data_layout, seen_tweets):
+        try:
+            with open(self.db_file, 'r') as f:
+                try:
+                    data = json.load(f)
+                except json.decoder.JSONDecodeError as error_msg:
+                    logging.error(str(error_msg) + " - creating new db!")
+                    data = data_layout
+        except FileNotFoundError as error_msg:
+            logging.error("create new db!" + str(error_msg))
+            data = data_layout
+        for key in data_layout:
+            if key not in data:
+                data[key] = deepcopy(data_layout[key])
+        seen_tweets.load(data.get('tweets'))
+        if self.journal is not False:
+            records = self.journal.read(after_seq=data.get('journal_seq', 0), repair=self.read_only is False)
+            for record in records:
+                try:
+                    apply_db_record(data, seen_tweets, record)
+                except KeyError as error_msg:
+                    logging.error("can not replay journal record " + str(record['seq']) + ": " + str(error_msg))
+            if len(records) > 0:
+                print("Replayed " + str(len(records)) + " records from the db journal!")
+        return data
+
+    def stats(self):
+        try:
+            file_size = os.path.getsize(self.db_file)
+        except OSError:
+            file_size = 0
+        written_bytes = self.written_bytes
+        if self.journal is not False:
+            written_bytes += self.journal.written_bytes
+        return {'file_size': file_size,
+                'written_bytes': written_bytes}
+
+    def sync(self):
+        if self.journal is not False:
+            self.journal.flush(force_sync=True)
+
+    def write(self, record, data):
+        if self.journal is not False:
+            self.journal.append(record)
+
+    def write_snapshot(self, data, seen_tweets):
+        try:
+            os.remove(self.db_file + "_backup")
+        except FileNotFoundError:
+            pass
+        try:
+            copyfile(self.db_file, self.db_file + "_backup")
+        except FileNotFoundError:
+            pass
+        try:
+            data = dict(data, tweets=seen_tweets.export())
+            if self.journal is not False:
+                self.journal.flush(force_sync=True)
+                data['journal_seq'] = self.journal.seq
+            with open(self.db_file + "_tmp", 'w+') as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+                self.written_bytes += f.tell()
+            os.replace(self.db_file + "_tmp", self.db_file)
+            if self.journal is not False:
+                self.journal.truncate()
+        except PermissionError as error_msg:
+            print("ERROR!!! Can not save database file!")
+            logging.critical("can not save database file! " + str(error_msg))
+            return False
+        return True
+
+
+class ShardQueue(object):
+    # Job handoff between the coordinator and the fan-out workers through a SQLite file on the (shared) storage of the
+    # db. Workers register with a heartbeat, the coordinator publishes one job per tweet with the list of workers at
+    # publishing time and every worker reports the result for its shard of the accounts. The `chain` of a job limits
+    # it to a part of the accounts: a list of [ring workers, owners] pairs, an account belongs to the job if its owner
+    # in every ring is one of the owners (used to hand over the shards of workers that died during a job).
+    def __init__(self, sqlite_file, worker_timeout=30):
+        self.sqlite_file = sqlite_file
+        self.worker_timeout = float(worker_timeout)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(sqlite_file, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, "
+                                      "heartbeat REAL NOT NULL, host TEXT, pid INTEGER);"
+                                      "CREATE TABLE IF NOT EXISTS jobs (job_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                      "tweet_id TEXT NOT NULL, rt_level INTEGER NOT NULL, workers TEXT NOT NULL, "
+                                      "chain TEXT NOT NULL DEFAULT '[]', created REAL NOT NULL);"
+                                      "CREATE TABLE IF NOT EXISTS results (job_id INTEGER NOT NULL, "
+                                      "worker_id TEXT NOT NULL, result TEXT NOT NULL, "
+                                      "PRIMARY KEY (job_id, worker_id));"
+                                      "CREATE TABLE IF NOT EXISTS worker_progress (worker_id TEXT PRIMARY KEY, "
+                                      "job_id INTEGER NOT NULL);")
+
+    def delete_job(self, job_id):
+        with self.lock:
+            self.connection.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+            self.connection.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            self.connection.commit()
+
+    def get_jobs(self, after_job_id):
+        with self.lock:
+            rows = self.connection.execute("SELECT job_id, tweet_id, rt_level, workers, chain FROM jobs "
+                                           "WHERE job_id > ? ORDER BY job_id", (after_job_id,)).fetchall()
+        return [{'job_id': row[0], 'tweet_id': row[1], 'rt_level': row[2], 'workers': json.loads(row[3]),
+                 'chain': json.loads(row[4])} for row in rows]
+
+    def get_handled_job_id(self, worker_id):
+        # the last job a worker reported a result for, None for a new worker
+        with self.lock:
+            row = self.connection.execute("SELECT job_id FROM worker_progress WHERE worker_id = ?",
+                                          (worker_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def get_last_job_id(self):
+        with self.lock:
+            row = self.connection.execute("SELECT MAX(job_id) FROM jobs").fetchone()
+        return row[0] or 0
+
+    def get_live_workers(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT worker_id FROM workers WHERE heartbeat > ? ORDER BY worker_id",
+                                           (time.time() - self.worker_timeout,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_results(self, job_id):
+        with self.lock:
+            rows = self.connection.execute("SELECT worker_id, result FROM results WHERE job_id = ?",
+                                           (job_id,)).fetchall()
+        return dict((row[0], json.loads(row[1])) for row in rows)
+
+    def heartbeat(self, worker_id):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO workers (worker_id, heartbeat, host, pid) "
+                                    "VALUES (?, ?, ?, ?)", (worker_id, time.time(), os.uname()[1], os.getpid()))
+            self.connection.commit()
+
+    def publish(self, tweet_id, rt_level, workers, chain=None):
+        with self.lock:
+            cursor = self.connection.execute("INSERT INTO jobs (tweet_id, rt_level, workers, chain, created) "
+                                             "VALUES (?, ?, ?, ?, ?)", (str(tweet_id), int(rt_level),
+                                                                        json.dumps(workers), json.dumps(chain or []),
+                                                                        time.time()))
+            self.connection.commit()
+            return cursor.lastrowid
+
+    def report(self, job_id, worker_id, result):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO results (job_id, worker_id, result) VALUES (?, ?, ?)",
+                                    (job_id, worker_id, json.dumps(result)))
+            self.connection.execute("INSERT OR REPLACE INTO worker_progress (worker_id, job_id) VALUES (?, ?)",
+                                    (worker_id, job_id))
+            self.connection.commit()
+
+    def unregister(self, worker_id):
+        with self.lock:
+            self.connection.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+            self.connection.commit()
+
+
+class ShardRing(object):
+    # Consistent hashing of the account ids onto the workers with `virtual_nodes` points per worker on the ring, if a
+    # worker joins or leaves only its share of the accounts moves.
+    def __init__(self, workers, virtual_nodes=64):
+        self.workers = sorted(workers)
+        self.ring = []
+        for worker_id in self.workers:
+            for node in range(int(virtual_nodes)):
+                self.ring.append((self._hash(worker_id + "#" + str(node)), worker_id))
+        self.ring.sort()
+        self.hashes = [point for point, worker_id in self.ring]
+
+    def _hash(self, key):
+        return int(hashlib.md5(str(key).encode("utf-8")).hexdigest()[:16], 16)
+
+    def get_owner(self, user_id):
+        if not self.ring:
+            return None
+        index = bisect.bisect(self.hashes, self._hash(user_id)) % len(self.ring)
+        return self.ring[index][1]
+
+
+class ShardTweet(object):
+    # the tweet of a fan-out job, the workers only need its id
+    def __init__(self, tweet_id):
+        self.id = int(tweet_id)
+
+
+class SqliteStorage(object):
+    # Accounts, seen tweets and counters in indexed SQLite tables. Every change is written as an incremental update and
+    # all changes up to the next commit() are one transaction. Other top level keys of the db are stored as JSON
+    # documents. On the first start the existing JSON db (incl. its journal) gets migrated. A `read_only` storage
+    # (fan-out workers) never migrates, it loads the db of the writing process after its migration with `refresh_db()`.
+    account_columns = ('access_token', 'access_token_secret', 'retweet_level', 'retweets')
+
+    def __init__(self, sqlite_file, json_db_file=False, read_only=False):
+        self.sqlite_file = sqlite_file
+        self.json_db_file = json_db_file
+        self.read_only = read_only
+        self.sync_interval = False
+        self.watermark = 0
+        self.connection = sqlite3.connect(sqlite_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("CREATE TABLE IF NOT EXISTS accounts (user_id TEXT PRIMARY KEY, "
+                                      "access_token TEXT, access_token_secret TEXT, retweet_level INTEGER, "
+                                      "retweets INTEGER NOT NULL DEFAULT 0, extra TEXT NOT NULL DEFAULT '{}');"
+                                      "CREATE INDEX IF NOT EXISTS accounts_retweet_level ON accounts (retweet_level);"
+                                      "CREATE TABLE IF NOT EXISTS seen_tweets (tweet_id INTEGER PRIMARY KEY);"
+                                      "CREATE TABLE IF NOT EXISTS statistic (name TEXT PRIMARY KEY, "
+                                      "value INTEGER NOT NULL DEFAULT 0);"
+                                      "CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, value TEXT);"
+                                      "CREATE TABLE IF NOT EXISTS retweet_ledger (tweet_id TEXT PRIMARY KEY, "
+                                      "bitmap TEXT NOT NULL);")
+        self.ledger_accounts = 0
+
+    def _get_document(self, name, default=None):
+        row = self.connection.execute("SELECT value FROM documents WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def _set_document(self, name, value):
+        self.connection.execute("INSERT OR REPLACE INTO documents (name, value) VALUES (?, ?)",
+                                (name, json.dumps(value)))
+
+    def _write_account(self, user_id, account):
+        extra = {}
+        for key in account:
+            if key not in self.account_columns:
+                extra[key] = account[key]
+        self.connection.execute("INSERT OR REPLACE INTO accounts (user_id, access_token, access_token_secret, "
+                                "retweet_level, retweets, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                                (str(user_id), account.get('access_token'), account.get('access_token_secret'),
+                                 account.get('retweet_level'), account.get('retweets', 0), json.dumps(extra)))
+
+    def _write_retweet_ledger(self, ledger, tweet_ids):
+        for tweet_id in tweet_ids:
+            self.connection.execute("INSERT OR REPLACE INTO retweet_ledger (tweet_id, bitmap) VALUES (?, ?)",
+                                    (str(tweet_id), format(ledger['tweets'][str(tweet_id)], "x")))
+        if len(ledger['accounts']) != self.ledger_accounts:
+            self._set_document('retweet_ledger_accounts', ledger['accounts'])
+            self.ledger_accounts = len(ledger['accounts'])
+
+    def _write_statistic(self, name, value, increment=False):
+        if increment:
+            self.connection.execute("INSERT INTO statistic (name, value) VALUES (?, ?) "
+                                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, value))
+        else:
+            self.connection.execute("INSERT OR REPLACE INTO statistic (name, value) VALUES (?, ?)", (name, value))
+
+    def commit(self, data, seen_tweets):
+        try:
+            if seen_tweets.watermark != self.watermark:
+                self.connection.execute("DELETE FROM seen_tweets WHERE tweet_id <= ?", (seen_tweets.watermark,))
+                self._set_document('seen_tweets_watermark', seen_tweets.watermark)
+                self.watermark = seen_tweets.watermark
+            self.connection.commit()
+        except sqlite3.Error as error_msg:
+            print("ERROR!!! Can not save database file!")
+            logging.critical("can not commit to sqlite db! " + str(error_msg))
+            return False
+        return True
+
+    def get_version(self):
+        # changes if an other connection committed to the db
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def get_account_ids(self, min_retweet_level):
+        rows = self.connection.execute("SELECT user_id FROM accounts WHERE retweet_level >= ?", (min_retweet_level,))
+        return [row[0] for row in rows]
+
+    def load(self, data_layout, seen_tweets):
+        if self._get_document('migrated') is None and self.read_only is False:
+            self.migrate_from_json(data_layout)
+        data = deepcopy(data_layout)
+        for row in self.connection.execute("SELECT user_id, access_token, access_token_secret, retweet_level, "
+                                           "retweets, extra FROM accounts"):
+            account = {'access_token': row[1],
+                       'access_token_secret': row[2],
+                       'retweet_level': row[3],
+                       'retweets': row[4]}
+            account.update(json.loads(row[5]))
+            data['accounts'][row[0]] = account
+        for row in self.connection.execute("SELECT name, value FROM statistic"):
+            data['statistic'][row[0]] = row[1]
+        for row in self.connection.execute("SELECT name, value FROM documents"):
+            if row[0] not in ('migrated', 'seen_tweets_watermark', 'retweet_ledger_accounts'):
+                data[row[0]] = json.loads(row[1])
+        data['retweet_ledger'] = {'accounts': self._get_document('retweet_ledger_accounts', {}), 'tweets': {}}
+        for row in self.connection.execute("SELECT tweet_id, bitmap FROM retweet_ledger"):
+            data['retweet_ledger']['tweets'][row[0]] = int(row[1], 16)
+        self.ledger_accounts = len(data['retweet_ledger']['accounts'])
+        self.watermark = self._get_document('seen_tweets_watermark', 0)
+        seen_tweets.load([row[0] for row in self.connection.execute("SELECT tweet_id FROM seen_tweets")],
+                         watermark=self.watermark)
+        return data
+
+    def migrate_from_json(self, data_layout):
+        if self.json_db_file is not False and (os.path.isfile(self.json_db_file) or
+                                               os.path.isfile(self.json_db_file + "_journal")):
+            print("Migrating " + str(self.json_db_file) + " to " + str(self.sqlite_file) + " ...")
+            seen_tweets = SeenTweetIndex()
+            data = JsonStorage(self.json_db_file, journal=True).load(deepcopy(data_layout), seen_tweets)
+            for user_id in data['accounts']:
+                self._write_account(user_id, data['accounts'][user_id])
+            for name in data['statistic']:
+                self._write_statistic(name, data['statistic'][name])
+            self.connection.executemany("INSERT OR IGNORE INTO seen_tweets (tweet_id) VALUES (?)",
+                                        [(tweet_id,) for tweet_id in seen_tweets.ids])
+            self._set_document('seen_tweets_watermark', seen_tweets.watermark)
+            if 'retweet_ledger' in data:
+                self._write_retweet_ledger(data['retweet_ledger'], list(data['retweet_ledger']['tweets']))
+            for name in data:
+                if name not in ('tweets', 'accounts', 'statistic', 'journal_seq', 'retweet_ledger'):
+                    self._set_document(name, data[name])
+            print("Migrated " + str(len(data['accounts'])) + " accounts and " + str(len(seen_tweets)) +
+                  " tweets to the sqlite db!")
+        self._set_document('migrated', str(datetime.datetime.now()))
+        self.connection.commit()
+
+    def stats(self):
+        try:
+            file_size = os.path.getsize(self.sqlite_file)
+        except OSError:
+            file_size = 0
+        return {'file_size': file_size,
+                'changes': self.connection.total_changes}
+
+    def sync(self):
+        pass
+
+    def write(self, record, data):
+        if record['op'] == "tweet":
+            self.connection.execute("INSERT OR IGNORE INTO seen_tweets (tweet_id) VALUES (?)", (record['id'],))
+            self.connection.execute("DELETE FROM retweet_ledger WHERE tweet_id = ?", (str(record['id']),))
+            return True
+        if record['op'] == "retweet":
+            self._write_retweet_ledger(data['retweet_ledger'], [record['tweet_id']])
+            return True
+        path = record['path']
+        if path[0] == "accounts":
+            if len(path) == 1:
+                self.connection.execute("DELETE FROM accounts")
+                for user_id in data['accounts']:
+                    self._write_account(user_id, data['accounts'][user_id])
+            elif record['op'] == "del" and len(path) == 2:
+                self.connection.execute("DELETE FROM accounts WHERE user_id = ?", (str(path[1]),))
+            elif record['op'] == "incr" and len(path) == 3 and path[2] in self.account_columns:
+                self.connection.execute("UPDATE accounts SET " + path[2] + " = " + path[2] + " + ? WHERE user_id = ?",
+                                        (record['value'], str(path[1])))
+            else:
+                self._write_account(path[1], data['accounts'][str(path[1])])
+        elif path[0] == "statistic" and len(path) == 2:
+            self._write_statistic(path[1], data['statistic'][path[1]])
+        else:
+            if path[0] in data:
+                self._set_document(path[0], data[path[0]])
+            else:
+                self.connection.execute("DELETE FROM documents WHERE name = ?", (path[0],))
+        return True
+
+
+class SubscriberIndex(object):
+    # Account ids per retweet level, kept up to date on every db change of an account. An account with retweet level
+    # n retweets the tweets of all rt levels <= n.
     def __init__(self):
+        self.levels = {}
+        self.accounts = {}
+        self.lock = threading.Lock()
+
+    def _remove(self, user_id):
+        try:
+            self.levels[self.accounts[user_id]].discard(user_id)
+            del self.accounts[user_id]
+        except KeyError:
+            pass
+
+    def count(self, min_retweet_level):
+        with self.lock:
+            return sum(len(self.levels[level]) for level in self.levels if level >= min_retweet_level)
+
+    def get_account_ids(self, min_retweet_level):
+        account_ids = []
+        with self.lock:
+            for level in self.levels:
+                if level >= min_retweet_level:
+                    account_ids.extend(self.levels[level])
+        return account_ids
+
+    def rebuild(self, accounts):
+        with self.lock:
+            self.levels = {}
+            self.accounts = {}
+        for user_id in list(accounts):
+            self.update(user_id, accounts[user_id].get('retweet_level'))
+
+    def remove(self, user_id):
+        with self.lock:
+            self._remove(str(user_id))
+
+    def update(self, user_id, retweet_level):
+        with self.lock:
+            self._remove(str(user_id))
+            if retweet_level is None:
+                return False
+            self.accounts[str(user_id)] = int(retweet_level)
+            self.levels.setdefault(int(retweet_level), set()).add(str(user_id))
+        return True
+
+
+class Leaderboard(object):
+    # Accounts ordered by their retweets, kept up to date on every change of a retweet counter. `entries` is sorted
+    # ascending by (retweets, user_id), so the rank of an account is a bisect from the end (ties are ordered by the
+    # user id like in the former sorted table). `top_generation` changes only if the top entries changed.
+    def __init__(self, top_size=10):
+        self.top_size = top_size
+        self.entries = []
+        self.retweets = {}
+        self.top_generation = 0
+        self.lock = threading.Lock()
+
+    def _remove(self, user_id):
+        try:
+            entry = (self.retweets.pop(user_id), user_id)
+        except KeyError:
+            return False
+        del self.entries[bisect.bisect_left(self.entries, entry)]
+        return True
+
+    def count(self):
+        with self.lock:
+            return len(self.entries)
+
+    def get_rank(self, user_id):
+        with self.lock:
+            try:
+                entry = (self.retweets[str(user_id)], str(user_id))
+            except KeyError:
+                return None
+            return len(self.entries) - bisect.bisect_left(self.entries, entry)
+
+    def get_top(self):
+        with self.lock:
+            return [(user_id, retweets) for retweets, user_id in reversed(self.entries[-self.top_size:])], \
+                   self.top_generation
+
+    def rebuild(self, accounts):
+        with self.lock:
+            self.retweets = {}
+            for user_id in list(accounts):
+                self.retweets[str(user_id)] = int(accounts[user_id].get('retweets', 0))
+            self.entries = sorted((retweets, user_id) for user_id, retweets in self.retweets.items())
+            self.top_generation += 1
+
+    def remove(self, user_id):
+        with self.lock:
+            top = self.entries[-self.top_size:]
+            self._remove(str(user_id))
+            if top != self.entries[-self.top_size:]:
+                self.top_generation += 1
+
+    def update(self, user_id, retweets):
+        with self.lock:
+            top = self.entries[-self.top_size:]
+            self._remove(str(user_id))
+            self.retweets[str(user_id)] = int(retweets)
+            bisect.insort(self.entries, (int(retweets), str(user_id)))
+            if top != self.entries[-self.top_size:]:
+                self.top_generation += 1
+        return True
+
+
+class TelegramNotifier(object):
+    # Sends Telegram messages from a background thread, so a slow or failing Telegram API never blocks the bot.
+    # Messages are queued in a bounded queue and posted with a pooled HTTP session. Failed posts are retried with
+    # exponential backoff (or `retry_after` of a 429 response). A chat gets at most one post per `chat_min_interval`
+    # seconds, everything that queued up for it in the meantime is sent as one digest message.
+    max_message_length = 4096
+
+    def __init__(self, auth_token, api_url="https://api.telegram.org", queue_size=1000, chat_min_interval=3,
+                 max_retries=5, timeout=10):
+        self.url = str(api_url).rstrip("/") + "/bot" + str(auth_token) + "/sendMessage"
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.chat_min_interval = chat_min_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.last_post = {}
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retries = 0
+
+    def _digests(self, messages):
+        digests = []
+        digest = ""
+        for message in messages:
+            if len(digest) + len(message) + 4 > self.max_message_length and digest != "":
+                digests.append(digest)
+                digest = ""
+            digest += ("\r\n\r\n" if digest != "" else "") + message[:self.max_message_length]
+        digests.append(digest)
+        return digests
+
+    def _post(self, chat_id, text):
+        for attempt in range(self.max_retries + 1):
+            delay = min(2 ** attempt, 60)
+            try:
+                response = self.session.post(self.url, data={'chat_id': chat_id, 'text': text}, timeout=self.timeout)
+                if response.status_code == 200:
+                    self.sent += 1
+                    return True
+                if response.status_code == 429:
+                    try:
+                        delay = int(response.json()['parameters']['retry_after'])
+                    except (KeyError, TypeError, ValueError):
+                        pass
+                elif response.status_code < 500:
+                    logging.error("Telegram rejected the message to chat " + str(chat_id) + ": " +
+                                  str(response.status_code) + " " + str(response.text))
+                    self.failed += 1
+                    return False
+                logging.error("Telegram post to chat " + str(chat_id) + " failed: " + str(response.status_code))
+            except requests.exceptions.RequestException as error_msg:
+                logging.error("Telegram post to chat " + str(chat_id) + " failed: " + str(error_msg))
+            if attempt < self.max_retries:
+                self.retries += 1
+                time.sleep(delay)
+        print("Can not post to telegram chat " + str(chat_id) + ", giving up!")
+        self.failed += 1
+        return False
+
+    def notify(self, chat_id, message):
+        try:
+            self.queue.put_nowait((str(chat_id).strip(), str(message)))
+        except queue.Full:
+            logging.error("Telegram queue is full, dropping message to chat " + str(chat_id))
+            self.dropped += 1
+            return False
+        self.queued += 1
+        return True
+
+    def run(self):
+        pending = OrderedDict()
+        while True:
+            if len(pending) == 0:
+                chat_id, message = self.queue.get()
+                pending.setdefault(chat_id, []).append(message)
+            while True:
+                try:
+                    chat_id, message = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                pending.setdefault(chat_id, []).append(message)
+            chat_id = min(pending, key=lambda chat: self.last_post.get(chat, 0))
+            wait = self.last_post.get(chat_id, 0) + self.chat_min_interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            for digest in self._digests(pending.pop(chat_id)):
+                self._post(chat_id, digest)
+            self.last_post[chat_id] = time.time()
+
+    def stats(self):
+        return {'queued': self.queued,
+                'pending': self.queue.qsize(),
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'retries': self.retries}
+
+
+class RemoteBackup(object):
+    # Uploads the db to a remote server via SFTP over one SSH connection that is kept alive between the uploads.
+    # Triggers are debounced to at most one upload per `interval` seconds. An upload is either a gzip compressed
+    # snapshot or, in between, a gzip compressed delta with the db records since the previous upload. The deltas belong
+    # to the `generation` of their snapshot: <name>.json.gz, <name>.<generation>.<n>.jsonl.gz
+    max_delta_records = 100000
+
+    def __init__(self, server, username, password, remote_path, snapshot_function, lock, port=22, interval=300,
+                 full_every=20, name="taubenschlag_all_accounts"):
+        self.server = server
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.remote_path = str(remote_path).rstrip("/")
+        self.snapshot_function = snapshot_function
+        self.lock = lock
+        self.interval = interval
+        self.full_every = int(full_every)
+        self.name = name
+        self.ssh = None
+        self.sftp = None
+        self.generation = None
+        self.delta_count = 0
+        self.records = []
+        self.triggered = threading.Event()
+        self.last_upload = 0
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    def _connect(self):
+        if self.ssh is not None and self.ssh.get_transport() is not None and self.ssh.get_transport().is_active():
+            return self.sftp
+        self.close()
+        logging.info("Connecting to backup server " + str(self.server))
+        self.ssh = SSHClient()
+        self.ssh.set_missing_host_key_policy(AutoAddPolicy())
+        self.ssh.load_system_host_keys()
+        self.ssh.connect(self.server, port=self.port, username=self.username, password=self.password)
+        self.ssh.get_transport().set_keepalive(30)
+        self.sftp = self.ssh.open_sftp()
+        return self.sftp
+
+    def _put(self, file_name, payload):
+        sftp = self._connect()
+        with sftp.open(self.remote_path + "/" + file_name + ".tmp", "wb") as f:
+            f.write(payload)
+        sftp.posix_rename(self.remote_path + "/" + file_name + ".tmp", self.remote_path + "/" + file_name)
+        self.uploads += 1
+        self.uploaded_bytes += len(payload)
+
+    def add_record(self, record):
+        # called with `self.lock` held for every db change
+        if self.generation is None:
+            return False
+        if len(self.records) >= self.max_delta_records:
+            # too many changes for a delta, the next upload is a snapshot
+            self.generation = None
+            self.records = []
+            return False
+        self.records.append(record)
+        return True
+
+    def close(self):
+        if self.ssh is not None:
+            try:
+                self.ssh.close()
+            except Exception as error_msg:
+                logging.error("closing the backup connection failed: " + str(error_msg))
+        self.ssh = None
+        self.sftp = None
+
+    def run(self):
+        while True:
+            self.triggered.wait()
+            wait = self.last_upload + self.interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.triggered.clear()
+            try:
+                self.upload()
+            except (SSHException, OSError) as error_msg:
+                logging.error("DB backup to " + str(self.server) + " failed: " + str(error_msg))
+                print("DB backup to " + str(self.server) + " failed: " + str(error_msg))
+                self.close()
+                # retry after the next interval
+                self.triggered.set()
+            self.last_upload = time.time()
+
+    def stats(self):
+        return {'uploads': self.uploads,
+                'uploaded_bytes': self.uploaded_bytes,
+                'generation': self.generation,
+                'delta_count': self.delta_count}
+
+    def trigger(self):
+        self.triggered.set()
+
+    def upload(self):
+        with self.lock:
+            if self.generation is None or self.delta_count >= self.full_every:
+                previous_generation = self.generation
+                previous_delta_count = self.delta_count
+                self.generation = int(time.time() * 1000)
+                self.delta_count = 0
+                self.records = []
+                snapshot = self.snapshot_function()
+                snapshot['backup_generation'] = self.generation
+                records = None
+                file_name = self.name + ".json.gz"
+            else:
+                previous_generation = None
+                self.delta_count += 1
+                records = self.records
+                self.records = []
+                file_name = self.name + "." + str(self.generation) + "." + str(self.delta_count) + ".jsonl.gz"
+        # the snapshot and the records are never changed by the writer (copy-on-write), encoding and compressing them
+        # does not block the db changes
+        if records is None:
+            payload = gzip.compress(json.dumps(snapshot).encode('utf-8'))
+        else:
+            payload = gzip.compress("".join(json.dumps(record) + "\n" for record in records).encode('utf-8'))
+        print("Starting DB backup to " + str(self.server) + ": " + file_name + " (" + str(len(payload)) + " bytes)")
+        logging.info("Starting DB backup to " + str(self.server) + ": " + file_name)
+        try:
+            self._put(file_name, payload)
+        except Exception:
+            with self.lock:
+                # the snapshot or delta is missing on the server, start over with a snapshot
+                self.generation = None
+                self.records = []
+            raise
+        if previous_generation is not None:
+            for delta in range(1, previous_delta_count + 1):
+                try:
+                    self.sftp.remove(self.remote_path + "/" + self.name + "." + str(previous_generation) + "." +
+                                     str(delta) + ".jsonl.gz")
+                except IOError:
+                    pass
+        return True
+
+
+class Taubenschlag(object):
+    # `config_path`, `args` (list of command line arguments, default: sys.argv) and `api_factory` (callable that
+    # returns the Twitter API client for consumer_key, consumer_secret, access_token, access_token_secret instead of a
+    # tweepy.API) are used by the offline benchmarks in `./benchmarks`.
+    def __init__(self, config_path="./conf.d", args=None, api_factory=None):
         self.app_version = "0.11.0"
-        self.config = self._load_config()
+        self.api_factory = api_factory
+        self.config = self._load_config(config_path)
         self.app_name = self.config['SYSTEM']['app_name']
         self.dm_sender_name = self.config['SYSTEM']['dm_sender_name']
         print("Starting " + str(self.app_name) + " Bot (Taubenschlag " + str(self.app_version) + ")")
@@ -93,6 +1827,12 @@ class Taubenschlag(object):
         self.telegram_post_new_tweets_to_group = self.config['SYSTEM']['telegram_post_new_tweets_to_group']
         self.telegram_post_new_tweets_to_channel = self.config['SYSTEM']['telegram_post_new_tweets_to_channel']
         self.telegram_channel_tag = self.config['SYSTEM']['telegram_channel_tag']
+        self.telegram_notifier = TelegramNotifier(self.telegram_auth_token,
+                                                  api_url=self.config['SYSTEM']['telegram_api_url'],
+                                                  queue_size=int(self.config['SYSTEM']['telegram_queue_size']),
+                                                  chat_min_interval=float(
+                                                      self.config['SYSTEM']['telegram_chat_min_interval']),
+                                                  max_retries=int(self.config['SYSTEM']['telegram_max_retries']))
 
         parser = ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
                                 description=textwrap.dedent(self.app_name + " Bot " + self.app_version+ " by "
@@ -102,24 +1842,262 @@ class Taubenschlag(object):
                                 epilog=textwrap.dedent("GitHub: " + self.config['SYSTEM']['github_rep_url']))
         parser.add_argument('-a', '--account-list', dest='account_list',
                             help='show saved account list', action="store_true")
-        self.parsed_args = parser.parse_args()
+        parser.add_argument('-p', '--profile-rounds', dest='profile_rounds', type=int,
+                            help='run the sampling profiler for N rounds (default: profile_rounds of main.cfg)')
+        parser.add_argument('-w', '--worker', dest='worker_id',
+                            help='run as fan-out worker WORKER_ID of the coordinator (fan_out_mode = sharded)')
+        self.parsed_args = parser.parse_args(args)
+        self.metrics = Metrics()
+        self.tracer = Tracer(self.config['SYSTEM']['tracing'], self.config['SYSTEM']['tracing_file'])
+        if self.parsed_args.profile_rounds is not None:
+            self.profile_rounds = self.parsed_args.profile_rounds
+        else:
+            self.profile_rounds = int(self.config['SYSTEM']['profile_rounds'])
+        self.profiler = None
+        self.rate_limits = RateLimitGovernor(max_wait=self.config['SYSTEM']['rate_limit_max_wait'],
+                                             bulk_reserve=self.config['SYSTEM']['rate_limit_bulk_reserve'],
+                                             normal_reserve=self.config['SYSTEM']['rate_limit_normal_reserve'],
+                                             metrics=self.metrics)
         self.api_self = False
         self.refresh_api_self()
+        self.user_cache = UserCache(self.api_self,
+                                    max_size=self.config['SYSTEM']['user_cache_max_size'],
+                                    ttl=self.config['SYSTEM']['user_cache_ttl'],
+                                    negative_ttl=self.config['SYSTEM']['user_cache_negative_ttl'],
+                                    lookup_concurrency=self.config['SYSTEM']['user_lookup_concurrency'])
         self.api_dm = False
         self.refresh_api_dm()
+        # one keep-alive connection per concurrent API call of the retweet, timeline and user lookup pools
+        self.api_pool = ApiClientPool(self.consumer_key, self.consumer_secret, metrics=self.metrics,
+                                      tracer=self.tracer, api_factory=self.api_factory, governor=self.rate_limits,
+                                      connection_pool_size=int(self.config['SYSTEM']['retweet_concurrency']) +
+                                      int(self.config['SYSTEM']['timeline_fetch_concurrency']) +
+                                      int(self.config['SYSTEM']['user_lookup_concurrency']) + 2)
+        self.dm_ingestion = self.config['SYSTEM']['dm_ingestion']
+        self.dm_queue = queue.Queue()
+        self.onboarding_queue = queue.Queue()
+        self.processed_dm_ids = OrderedDict()
+        self.processed_dm_ids_lock = threading.Lock()
         self.data = False
+        self.db_state = None
+        self.db_lock = threading.RLock()
+        # fan-out workers only read the db, the coordinator writes the results of their jobs
+        self.worker_id = self.parsed_args.worker_id
+        self.db_read_only = self.worker_id is not None
+        self.db_version = None
+        self.fan_out_mode = self.config['SYSTEM']['fan_out_mode']
+        if self.fan_out_mode == "sharded" or self.worker_id is not None:
+            self.shard_queue = ShardQueue("./db/" + self.config['SYSTEM']['shard_queue_file'],
+                                          worker_timeout=self.config['SYSTEM']['shard_worker_timeout'])
+        else:
+            self.shard_queue = None
+        self.shard_rings = {}
+        if self.config['SYSTEM']['ssh_backup_on_new_user'] == "True":
+            self.remote_backup = RemoteBackup(self.config['SECRETS']['ssh_backup_server'],
+                                              self.config['SECRETS']['ssh_backup_user'],
+                                              self.config['SECRETS']['ssh_backup_pass'],
+                                              self.config['SECRETS']['ssh_backup_path'],
+                                              self.get_db_snapshot,
+                                              self.db_lock,
+                                              port=self.config['SECRETS'].get('ssh_backup_port', "22"),
+                                              interval=float(self.config['SYSTEM']['ssh_backup_interval']),
+                                              full_every=int(self.config['SYSTEM']['ssh_backup_full_every']))
+        else:
+            self.remote_backup = None
+        if self.config['DATABASE']['backend'] == "sqlite":
+            self.db_storage = SqliteStorage("./db/" + self.config['DATABASE']['sqlite_file'],
+                                            json_db_file="./db/" + self.config['DATABASE']['db_file'],
+                                            read_only=self.db_read_only)
+        else:
+            self.db_storage = JsonStorage("./db/" + self.config['DATABASE']['db_file'],
+                                          journal=self.config['DATABASE']['journal'] == "True",
+                                          journal_fsync_interval=self.config['DATABASE']['journal_fsync_interval'],
+                                          journal_compact_after=self.config['DATABASE']['journal_compact_after'],
+                                          read_only=self.db_read_only)
+        self.seen_tweets = SeenTweetIndex(self.config['DATABASE']['seen_tweets_retention_days'])
         self.data_layout = {"tweets": [],
                             "accounts": {},
+                            "timeline_cursors": {},
+                            "onboarding_jobs": {},
+                            "handled_dms": {},
+                            "retweet_ledger": {"accounts": {}, "tweets": {}},
                             "statistic": {"tweets": 0,
                                           "retweets": 0,
                                           "sent_help_dm": 0,
                                           "received_botcmds": 0}}
-        self.leaderboard_table = {}
+        self.retweet_account_min_spacing = float(self.config['SYSTEM']['retweet_account_min_spacing'])
+        self.retweet_jitter_window = float(self.config['SYSTEM']['retweet_jitter_window'])
+        self.retweet_pool = ThreadPoolExecutor(max_workers=int(self.config['SYSTEM']['retweet_concurrency']))
+        self.retweet_slots = {}
+        self.timeline_pool = ThreadPoolExecutor(max_workers=int(self.config['SYSTEM']['timeline_fetch_concurrency']))
+        self.retweet_slots_lock = threading.Lock()
+        # saved `get_status()` pre-checks, retweets the ledger skipped and 'already retweeted' errors since the start
+        self.retweet_ledger_stats = {'saved_calls': 0, 'skipped': 0, 'already_retweeted': 0}
+        self.retweet_ledger_lock = threading.Lock()
+        # accounts with a revoked or expired token, the fan-out skips them until they are removed
+        self.invalid_token_accounts = set()
+        self.token_sweep_stats = {'sweeps': 0, 'checked': 0, 'pruned': 0, 'last_sweep': None}
+        self.rt_level_matchers = {}
+        for section in self.config.sections():
+            if section.startswith("RT-LEVEL-"):
+                self.rt_level_matchers[int(section[len("RT-LEVEL-"):])] = \
+                    RuleMatcher(self.config[section]['conditions'].split(","))
+        self.rt_levels = sorted(self.rt_level_matchers)
+        self.subscriber_index = SubscriberIndex()
+        self.leaderboard = Leaderboard()
         self.leaderboard_table_string = ""
-        self.leaderboard_last_generation = "?"
-        self.bot_user_id = self.api_self.get_user(self.bot_twitter_account).id
+        self.leaderboard_table_string_generation = None
+        self.bot_user_id = self.user_cache.get_user(screen_name=self.bot_twitter_account).id
         self.sys_admin_list = self.config['SYSTEM']['sys_admin_list'].split(",")
+        # DM command registry: command name -> (handler, accepted arguments), a handler returns the body of the
+        # reply or False
+        self.dm_commands = {'get-bot-info': (self.dm_command_get_bot_info, ("",)),
+                            'get-cmd-list': (self.dm_command_get_cmd_list, ("",)),
+                            'get-info': (self.dm_command_get_info, ("",)),
+                            'help': (self.dm_command_help, ("",)),
+                            'set-rt-level': (self.dm_command_set_rt_level,
+                                             tuple(str(rt_level) for rt_level in self.rt_levels))}
         self.load_db()
+        self._init_metrics()
+        if self.config['SYSTEM']['user_cache_warm_up'] == "True":
+            self.warm_up_user_cache()
+
+    def _create_api(self, consumer_key, consumer_secret, access_token, access_token_secret):
+        if self.api_factory is not None:
+            return self.api_factory(consumer_key, consumer_secret, access_token, access_token_secret)
+        auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
+        auth.set_access_token(access_token, access_token_secret)
+        return tweepy.API(auth)
+
+    def _db_change(self, record):
+        # the only writer of the db state, readers in other threads use `get_db_snapshot()`
+        with self.db_lock:
+            self.data = self.db_state.apply(self.seen_tweets, record)
+            if self.db_read_only is False:
+                self.db_storage.write(record, self.data)
+            self._update_subscriber_index(record)
+            self._update_leaderboard(record)
+            if record['op'] == "set" and len(record['path']) == 2 and record['path'][0] == "accounts":
+                # new token of a re-authorized account, the fan-out and the token sweep use the account again
+                self.invalid_token_accounts.discard(str(record['path'][1]))
+            if self.remote_backup is not None and self.db_read_only is False:
+                self.remote_backup.add_record(record)
+
+    def _init_metrics(self):
+        self.metrics.describe("round_duration_seconds", "histogram", "duration of a search and retweet round")
+        self.metrics.describe("rt_level_duration_seconds", "histogram", "duration of one rt level of a round")
+        self.metrics.describe("timelines_fetch_duration_seconds", "histogram",
+                              "duration to fetch the timelines of all rt sources")
+        self.metrics.describe("timeline_fetch_duration_seconds", "histogram", "timeline fetch latency per rt source")
+        self.metrics.describe("timeline_fetch_skipped_total", "counter", "skipped timeline fetches (rate limit)")
+        self.metrics.describe("fan_out_duration_seconds", "histogram", "duration of the retweet fan-out of a tweet")
+        self.metrics.describe("tweets_total", "counter", "retweeted tweets")
+        self.metrics.describe("retweets_total", "counter", "retweets made by the accounts")
+        self.metrics.describe("retweet_errors_total", "counter", "failed retweets")
+        self.metrics.describe("token_sweep_checked_total", "counter", "tokens checked by the token health sweeper")
+        self.metrics.describe("token_sweep_pruned_total", "counter", "accounts removed by the token health sweeper")
+        self.metrics.describe("retweet_ledger_total", "counter", "results of the retweet ledger: saved `get_status` "
+                                                                   "calls, skipped and already retweeted")
+        self.metrics.describe("twitter_api_call_duration_seconds", "histogram", "Twitter API call latency per endpoint")
+        self.metrics.describe("twitter_api_errors_total", "counter", "Twitter API errors per endpoint and error code")
+        self.metrics.describe("twitter_api_rate_limit_hits_total", "counter",
+                              "Twitter API rate limit hits per endpoint")
+        self.metrics.describe("rate_limit_wait_seconds", "histogram",
+                              "time a Twitter API call waited for the reset of its rate limit window per priority")
+        self.metrics.describe("rate_limit_rejected_total", "counter",
+                              "Twitter API calls that were not made because the rate limit budget was used up")
+        self.metrics.describe("db_commit_duration_seconds", "histogram", "duration of a db commit (save_db)")
+        self.metrics.describe("dm_queue_lag_seconds", "histogram", "time a DM waited in the command queue")
+        self.metrics.describe("dm_command_duration_seconds", "histogram", "processing time per DM command")
+        self.metrics.describe("dm_queue_size", "gauge", "DMs waiting in the command queue")
+        self.metrics.describe("onboarding_queue_size", "gauge", "queued onboarding jobs")
+        self.metrics.describe("accounts", "gauge", "saved accounts")
+        self.metrics.describe("seen_tweets", "gauge", "tweets in the seen tweet index")
+        self.metrics.describe("user_cache_size", "gauge", "entries of the user cache")
+        self.metrics.describe("user_cache_requests_total", "counter", "user cache requests per result")
+        self.metrics.describe("user_cache_hit_rate", "gauge", "user cache hit rate in percent")
+        self.metrics.describe("user_cache_lookups_total", "counter", "bulk `users/lookup` requests of the user cache")
+        self.metrics.describe("api_pool_size", "gauge", "clients in the API client pool")
+        self.metrics.describe("api_pool_requests_total", "counter", "API client pool requests per result")
+        self.metrics.describe("api_pool_reuse_rate", "gauge", "API client pool reuse rate in percent")
+        self.metrics.describe("telegram_messages_total", "counter", "telegram messages per state")
+        self.metrics.describe("telegram_queue_size", "gauge", "telegram messages waiting in the queue")
+        self.metrics.describe("db_file_size_bytes", "gauge", "size of the db file")
+        self.metrics.describe("db_written_bytes_total", "counter", "bytes written to the db files (json backend)")
+        self.metrics.describe("db_changes_total", "counter", "changed rows (sqlite backend)")
+        self.metrics.describe("db_snapshots_total", "counter", "copy-on-write snapshots of the db state")
+        self.metrics.describe("db_copies_total", "counter", "dicts of the db state copied by a change after a snapshot")
+        self.metrics.describe("backup_uploads_total", "counter", "remote backup uploads")
+        self.metrics.describe("backup_uploaded_bytes_total", "counter", "bytes uploaded to the backup server")
+        self.metrics.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self):
+        user_cache = self.user_cache.stats()
+        api_pool = self.api_pool.stats()
+        telegram = self.telegram_notifier.stats()
+        storage = self.db_storage.stats()
+        db_state = self.db_state.stats()
+        samples = [("dm_queue_size", {}, self.dm_queue.qsize()),
+                   ("onboarding_queue_size", {}, self.onboarding_queue.qsize()),
+                   ("accounts", {}, len(self.data['accounts'])),
+                   ("seen_tweets", {}, len(self.seen_tweets)),
+                   ("user_cache_size", {}, user_cache['size']),
+                   ("user_cache_requests_total", {'result': "hit"}, user_cache['hits']),
+                   ("user_cache_requests_total", {'result': "negative_hit"}, user_cache['negative_hits']),
+                   ("user_cache_requests_total", {'result': "miss"}, user_cache['misses']),
+                   ("user_cache_hit_rate", {}, user_cache['hit_rate']),
+                   ("user_cache_lookups_total", {}, user_cache['lookups']),
+                   ("api_pool_size", {}, api_pool['size']),
+                   ("api_pool_requests_total", {'result': "created"}, api_pool['created']),
+                   ("api_pool_requests_total", {'result': "reused"}, api_pool['reused']),
+                   ("api_pool_reuse_rate", {}, api_pool['reuse_rate']),
+                   ("telegram_queue_size", {}, telegram['pending']),
+                   ("db_file_size_bytes", {}, storage['file_size']),
+                   ("db_snapshots_total", {}, db_state['snapshots']),
+                   ("db_copies_total", {}, db_state['copies'])]
+        for state in ('queued', 'sent', 'dropped', 'failed', 'retries'):
+            samples.append(("telegram_messages_total", {'state': state}, telegram[state]))
+        if 'written_bytes' in storage:
+            samples.append(("db_written_bytes_total", {}, storage['written_bytes']))
+        if 'changes' in storage:
+            samples.append(("db_changes_total", {}, storage['changes']))
+        if self.remote_backup is not None:
+            backup = self.remote_backup.stats()
+            samples.append(("backup_uploads_total", {}, backup['uploads']))
+            samples.append(("backup_uploaded_bytes_total", {}, backup['uploaded_bytes']))
+        return samples
+
+    def _onboarding_step_done(self, user_id, step):
+        self.db_set(['onboarding_jobs', user_id, 'done'], self.data['onboarding_jobs'][user_id]['done'] + [step])
+        self.save_db()
+
+    def _update_leaderboard(self, record):
+        if 'path' not in record or record['path'][0] != "accounts":
+            return False
+        path = record['path']
+        if len(path) == 1:
+            self.leaderboard.rebuild(self.data['accounts'])
+        elif record['op'] == "del" and len(path) == 2:
+            self.leaderboard.remove(path[1])
+        elif len(path) == 2 or path[2] == "retweets":
+            self.leaderboard.update(path[1], self.data['accounts'][str(path[1])].get('retweets', 0))
+        return True
+
+    def _update_subscriber_index(self, record):
+        if 'path' not in record or record['path'][0] != "accounts":
+            return False
+        path = record['path']
+        if len(path) == 1:
+            self.subscriber_index.rebuild(self.data['accounts'])
+        elif record['op'] == "del" and len(path) == 2:
+            self.subscriber_index.remove(path[1])
+        elif len(path) == 2 or path[2] == "retweet_level":
+            self.subscriber_index.update(path[1], self.data['accounts'][str(path[1])].get('retweet_level'))
+        return True
+
+    def _webhook_signature(self, payload):
+        digest = hmac.new(self.consumer_secret_dm.encode('utf-8'), msg=payload, digestmod=hashlib.sha256).digest()
+        return "sha256=" + base64.b64encode(digest).decode('ascii')
 
     def _fill_up_space(self, demand_of_chars, string):
         blanks_pre = ""
@@ -130,8 +2108,7 @@ class Taubenschlag(object):
             blanks_post += " "
         return blanks_pre + str(string) + blanks_post
 
-    def _load_config(self):
-        config_path = "./conf.d"
+    def _load_config(self, config_path):
         config = configparser.ConfigParser()
         if os.path.isdir(config_path) is False:
             logging.critical("can not access " + config_path)
@@ -175,627 +2152,1077 @@ class Taubenschlag(object):
                 return self.error_text
 
             if auth.access_token_secret is not None and auth.access_token is not None:
-                status = False
-                user = self.api_self.get_user(screen_name=auth.get_username())
+                # an access token starts with the id of its user, so the handler needs no further API call
+                user_id = str(auth.access_token).split("-", 1)[0]
+                if not user_id.isdigit():
+                    user_id = str(self.user_cache.get_user(screen_name=auth.get_username()).id)
                 try:
-                    if len(self.data['accounts']) > 0:
-                        status = True
-                except TypeError:
-                    pass
-                if status is False:
-                    self.data['accounts'] = {str(user.id): {}}
-                try:
-                    retweets_value = self.data['accounts'][str(user.id)]['retweets']
+                    retweets_value = self.data['accounts'][user_id]['retweets']
                 except KeyError:
                     retweets_value = 0
-                self.data['accounts'][str(user.id)] = {'access_token': str(auth.access_token),
-                                                       'access_token_secret': str(auth.access_token_secret),
-                                                       'retweet_level': self.default_retweet_level,
-                                                       'retweets': retweets_value}
-                logging.info("Saved new oAuth access of Twitter user " + str(user.name) + "!")
-                print("Saved new oAuth token of @" + str(user.screen_name) + " (" + str(user.name) + ")!")
-                self.save_db(new_account=True)
-                retweet_level = self.data['accounts'][str(user.id)]['retweet_level']
-                api = self.get_api_user(user.id)
-                try:
-                    api.create_friendship(id=self.bot_user_id)
-                except tweepy.error.TweepError as error_msg:
-                    if "You can't follow yourself" in str(error_msg):
-                        pass
-                    else:
-                        logging.error(str(error_msg))
-                try:
-                    self.api_self.create_friendship(id=user.id)
-                except tweepy.error.TweepError as error_msg:
-                    if "You can't follow yourself" in str(error_msg):
-                        pass
-                    else:
-                        logging.error(str(error_msg))
-                try:
-                    retweets = self.data['accounts'][str(user.id)]['retweets']
-                    self.api_self.send_direct_message(user.id, "Hello " + str(user.name) +
-                                                      "!\r\n\r\nThank you for joining " + self.app_name + "!\r\n\r\n"
-                                                      + self.retweet_sources_description +
-                                                      "\r\n\r\nTo set a retweet level, send a DM to @" +
-                                                      self.bot_twitter_account + " with the following text:\r\n"
-                                                      "* 'set-rt-level:1' to retweet only first class posts\r\n"
-                                                      "* 'set-rt-level:2' to be informative\r\n"
-                                                      "* 'set-rt-level:3' to retweet everything " + self.bot_topic +
-                                                      " related that "
-                                                      "this app finds for you!\r\n \r\nYour current retweet-level "
-                                                      "is " + str(retweet_level) + "\r\n\r\nYou have made " +
-                                                      str(retweets) + " retweets for " + self.bot_topic + "!\r\n" +
-                                                      "\r\n\r\nThis application is "
-                                                      "now connected to your Twitter Account. If you wish to "
-                                                      "revoke its access, you can do so via Twitter’s "
-                                                      "'Settings and Privacy' page "
-                                                      "(https://twitter.com/settings/sessions) by clicking on the "
-                                                      "'Revoke Access' button. However, once access is revoked, it "
-                                                      "cannot be undone via Twitter. You must reauthorize it at "
-                                                      + self.base_url + "\r\n"
-                                                      "\r\nAuthorizing " + self.app_name + " permits it to:"
-                                                      "\r\n* Read Tweets from your timeline\r\n"
-                                                      "* See who you follow, and follow new people\r\n"
-                                                      "* Update your profile\r\n"
-                                                      "* Post Tweets for you\r\n"
-                                                      "\r\n**HOWEVER, " + self.app_name + " WILL DO NONE OF THESE "
-                                                      "THINGS. " + self.app_name + " WILL ONLY RETWEET RELEVENT " +
-                                                      self.bot_topic +
-                                                      " TWEETS**\r\n\r\nAuthorizing " + self.app_name + " does not "
-                                                      "permit it to:\r\n* Access or otherwise view your Direct Messages"
-                                                      " (DMs)\r\n* Access or otherwise view your email address\r\n"
-                                                      "* Access or otherwise view your Twitter password\r\n"
-                                                      "\r\nBy authorizing any application, including '" +
-                                                      self.app_name +
-                                                      "', you continue to operate under Twitter's Terms of "
-                                                      "Service. Some usage data will be "
-                                                      "shared with Twitter. For more information, see Twitter’s "
-                                                      'Privacy Policy.'"\r\n"
-                                                      "\r\nFor questions or additional information, send a direct "
-                                                      "message with the text 'help' to me or 'get-cmd-list' to see "
-                                                      "a list of all available commands!\r\n\r\n"
-                                                      "Please report issues to "
-                                                      + self.issues_report_to +
-                                                      " - Thank you!\r\n"
-                                                      "\r\nBest regards,\r\n" + self.dm_sender_name + "!")
-                    # send status message to bot account
-                    self.send_status_message_new_user(self.bot_user_id, user.id)
-                    # send status message to sys_admins
-                    for admin_name in self.sys_admin_list:
-                        self.send_status_message_new_user(self.api_self.get_user(screen_name=admin_name).id, user.id)
-                except tweepy.error.TweepError:
-                    pass
+                self.db_set(['accounts', user_id], {'access_token': str(auth.access_token),
+                                                    'access_token_secret': str(auth.access_token_secret),
+                                                    'retweet_level': self.default_retweet_level,
+                                                    'retweets': retweets_value})
+                # follows, welcome DM, status messages and the backup are done by `onboarding_worker()`
+                self.db_set(['onboarding_jobs', user_id], {'created': time.time(), 'done': [], 'attempts': 0})
+                self.save_db()
+                self.onboarding_queue.put(user_id)
+                logging.info("Saved new oAuth access of Twitter user " + user_id + "!")
+                print("Saved new oAuth token of user " + user_id + "!")
                 return redirect(self.config['SYSTEM']['redirect_successfull_participation'], code=302)
             else:
                 return redirect(self.config['SYSTEM']['redirect_canceled'], code=302)
+        if self.config['SYSTEM']['metrics_endpoint'] == "True":
+            @app.route('/metrics')
+            def metrics():
+                return Response(self.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+        if self.dm_ingestion == "webhook":
+            @app.route('/webhooks/twitter', methods=['GET'])
+            def webhook_twitter_crc():
+                try:
+                    crc_token = request.args["crc_token"]
+                except KeyError:
+                    return "missing crc_token", 400
+                return jsonify({'response_token': self._webhook_signature(crc_token.encode('utf-8'))})
+
+            @app.route('/webhooks/twitter', methods=['POST'])
+            def webhook_twitter_event():
+                signature = request.headers.get('x-twitter-webhooks-signature', "")
+                if not hmac.compare_digest(signature, self._webhook_signature(request.get_data())):
+                    logging.error("received webhook event with invalid signature!")
+                    return "invalid signature", 403
+                events = request.get_json(silent=True)
+                if not isinstance(events, dict) or not isinstance(events.get('direct_message_events', []), list):
+                    return "invalid event", 400
+                dm_events = []
+                for event in events.get('direct_message_events', []):
+                    if not isinstance(event, dict) or event.get('type') != "message_create":
+                        continue
+                    try:
+                        sender_id = str(event['message_create']['sender_id'])
+                        text = event['message_create']['message_data']['text']
+                        dm_event = DirectMessageEvent(event)
+                    except (KeyError, TypeError):
+                        return "invalid event", 400
+                    if not isinstance(text, str):
+                        return "invalid event", 400
+                    if sender_id != str(self.bot_user_id):
+                        dm_events.append(dm_event)
+                for dm_event in dm_events:
+                    self.dm_queue.put((time.time(), dm_event))
+                return "", 200
+
         try:
             dispatcher = wsgi.PathInfoDispatcher({'/': app})
             webserver = wsgi.WSGIServer((self.config['SYSTEM']['webserver_listener_ip'],
                                          int(self.config['SYSTEM']['webserver_listener_port'])),
-                                        dispatcher)
+                                        dispatcher,
+                                        numthreads=int(self.config['SYSTEM']['webserver_threads']),
+                                        request_queue_size=int(self.config['SYSTEM']['webserver_request_queue_size']))
             webserver.start()
             logging.info("webserver started!")
         except RuntimeError as error_msg:
             logging.critical("webserver is going down! " + str(error_msg))
 
+    def send_dm_reply(self, recipient_id, text):
+        # the command of the reply already ran, so a failed reply is sent again (rate limit) or dropped, but never
+        # fails the batch
+        try:
+            self.api_self.send_direct_message(recipient_id, text)
+            return True
+        except tweepy.error.RateLimitError as error_msg:
+            logging.error("can not send DM reply to " + str(recipient_id) + ": " + str(error_msg))
+            threading.Timer(getattr(error_msg, 'retry_after', 300), self.send_dm_reply,
+                            args=(recipient_id, text)).start()
+        except tweepy.error.TweepError as error_msg:
+            # e.g. 349 = the user does not accept DMs from the bot
+            logging.error("can not send DM reply to " + str(recipient_id) + ": " + str(error_msg))
+        return False
+
     def send_status_message_new_user(self, recipient_id, new_user_id):
         logging.debug("sending DM with 'new user' alert to " + str(recipient_id))
         self.api_self.send_direct_message(recipient_id,
-                                          "Hello " + str(self.api_self.get_user(recipient_id).name) + "!\r\n\r\n"
+                                          "Hello " + str(self.user_cache.get_user(recipient_id).name) + "!\r\n\r\n"
                                           "A new user subscribed to " + self.app_name + ": " + str(new_user_id) +
-                                          " - " + str(self.api_self.get_user(new_user_id).screen_name) +
+                                          " - " + str(self.user_cache.get_user(new_user_id).screen_name) +
                                           "\r\n\r\nBest regards,\r\n" + self.dm_sender_name + "!")
 
+    def send_welcome_message_new_user(self, user, retweet_level, retweets):
+        self.api_self.send_direct_message(user.id, "Hello " + str(user.name) +
+                                          "!\r\n\r\nThank you for joining " + self.app_name + "!\r\n\r\n"
+                                          + self.retweet_sources_description +
+                                          "\r\n\r\nTo set a retweet level, send a DM to @" +
+                                          self.bot_twitter_account + " with the following text:\r\n"
+                                          "* 'set-rt-level:1' to retweet only first class posts\r\n"
+                                          "* 'set-rt-level:2' to be informative\r\n"
+                                          "* 'set-rt-level:3' to retweet everything " + self.bot_topic +
+                                          " related that "
+                                          "this app finds for you!\r\n \r\nYour current retweet-level "
+                                          "is " + str(retweet_level) + "\r\n\r\nYou have made " +
+                                          str(retweets) + " retweets for " + self.bot_topic + "!\r\n" +
+                                          "\r\n\r\nThis application is "
+                                          "now connected to your Twitter Account. If you wish to "
+                                          "revoke its access, you can do so via Twitter’s "
+                                          "'Settings and Privacy' page "
+                                          "(https://twitter.com/settings/sessions) by clicking on the "
+                                          "'Revoke Access' button. However, once access is revoked, it "
+                                          "cannot be undone via Twitter. You must reauthorize it at "
+                                          + self.base_url + "\r\n"
+                                          "\r\nAuthorizing " + self.app_name + " permits it to:"
+                                          "\r\n* Read Tweets from your timeline\r\n"
+                                          "* See who you follow, and follow new people\r\n"
+                                          "* Update your profile\r\n"
+                                          "* Post Tweets for you\r\n"
+                                          "\r\n**HOWEVER, " + self.app_name + " WILL DO NONE OF THESE "
+                                          "THINGS. " + self.app_name + " WILL ONLY RETWEET RELEVENT " +
+                                          self.bot_topic +
+                                          " TWEETS**\r\n\r\nAuthorizing " + self.app_name + " does not "
+                                          "permit it to:\r\n* Access or otherwise view your Direct Messages"
+                                          " (DMs)\r\n* Access or otherwise view your email address\r\n"
+                                          "* Access or otherwise view your Twitter password\r\n"
+                                          "\r\nBy authorizing any application, including '" +
+                                          self.app_name +
+                                          "', you continue to operate under Twitter's Terms of "
+                                          "Service. Some usage data will be "
+                                          "shared with Twitter. For more information, see Twitter’s "
+                                          'Privacy Policy.'"\r\n"
+                                          "\r\nFor questions or additional information, send a direct "
+                                          "message with the text 'help' to me or 'get-cmd-list' to see "
+                                          "a list of all available commands!\r\n\r\n"
+                                          "Please report issues to "
+                                          + self.issues_report_to +
+                                          " - Thank you!\r\n"
+                                          "\r\nBest regards,\r\n" + self.dm_sender_name + "!")
+
+    def apply_shard_result(self, tweet_id, result):
+        # the coordinator is the only writer of the db, it applies the reported result of a fan-out worker
+        made_retweets = 0
+        for user_id in result.get('retweeted', []):
+            if str(user_id) not in self.data['accounts']:
+                continue
+            self.db_add_retweet(tweet_id, user_id)
+            self.db_increment(['statistic', 'retweets'])
+            self.db_increment(['accounts', str(user_id), 'retweets'])
+            self.metrics.inc("retweets_total")
+            made_retweets += 1
+        for user_id in result.get('already_retweeted', []):
+            if str(user_id) in self.data['accounts']:
+                self.db_add_retweet(tweet_id, user_id)
+        self.save_db()
+        self.remove_accounts(result.get('invalid', []))
+        return made_retweets
+
     def check_direct_messages(self):
         time.sleep(2)
         while True:
-            try:
-                dm_list = self.api_dm.list_direct_messages()
-                for dm in reversed(dm_list):
-                    try:
-                        if self.data['accounts'][str(dm.message_create['sender_id'])]:
-                            pass
-                    except KeyError as error_msg:
-                        logging.info("The unauthorized Twitter user @" +
-                                     self.api_self.get_user(dm.message_create['sender_id']).screen_name +
-                                     " wrote a command to the bot! (error_msg: " + str(error_msg) + ")")
-                        self.api_dm.destroy_direct_message(dm.id)
+            # drain the queue, so that a whole `list_direct_messages` page gets processed as one batch
+            batch = [self.dm_queue.get()]
+            while True:
+                try:
+                    batch.append(self.dm_queue.get_nowait())
+                except queue.Empty:
+                    break
+            dm_list = []
+            with self.processed_dm_ids_lock:
+                for enqueue_time, dm in batch:
+                    self.metrics.observe("dm_queue_lag_seconds", time.time() - enqueue_time)
+                    if dm.id in self.processed_dm_ids:
                         continue
-                    if "".join(str(dm.message_create['message_data']['text']).split()).lower() == "help":
-                        print("Send help DM to " + str(dm.message_create['sender_id']) + "!")
-                        user = self.api_self.get_user(dm.message_create['sender_id'])
-                        user_id = dm.message_create['sender_id']
-                        try:
-                            retweet_level = self.data['accounts'][str(user_id)]['retweet_level']
-                        except KeyError:
-                            self.data['accounts'][str(user_id)]['retweet_level'] = 2
-                            self.save_db()
-                            retweet_level = self.data['accounts'][str(user_id)]['retweet_level']
-                        try:
-                            retweets = self.data['accounts'][str(user_id)]['retweets']
-                        except KeyError:
-                            self.data['accounts'][str(user_id)]['retweets'] = 0
-                            self.save_db()
-                            retweets = self.data['accounts'][str(user_id)]['retweets']
-                        self.api_self.send_direct_message(dm.message_create['sender_id'], "Hello " + str(user.name) +
-                                                          "!\r\n\r\n" + self.retweet_sources_description + "\r\n"
-                                                          "\r\nTo set a retweet level, send a DM to @" +
-                                                          self.bot_twitter_account + " with the following text:\r\n"
-                                                          "* 'set-rt-level:1' to retweet only first class posts\r\n"
-                                                          "* 'set-rt-level:2' to be informative\r\n"
-                                                          "* 'set-rt-level:3' to retweet everything " + self.bot_topic +
-                                                          " related that "
-                                                          "this app finds for you!\r\n \r\nYour current retweet-level "
-                                                          "is " + str(retweet_level) + "\r\n\r\nYou have made " +
-                                                          str(retweets) + " retweets for " + self.bot_topic + "!\r\n"
-                                                          "\r\nThis application "
-                                                          "is now connected to your Twitter Account. If you wish to "
-                                                          "revoke its access, you can do so via Twitter’s "
-                                                          "'Settings and Privacy' page "
-                                                          "(https://twitter.com/settings/sessions) by clicking on the "
-                                                          "'Revoke Access' button. However, once access is revoked, it "
-                                                          "cannot be undone via Twitter. You must reauthorize it at "
-                                                          + self.base_url + "\r\n"
-                                                          "\r\n\r\nAuthorizing " + self.app_name + " permits it to:"
-                                                          "\r\n* Read Tweets from your timeline\r\n"
-                                                          "* See who you follow, and follow new people\r\n"
-                                                          "* Update your profile\r\n"
-                                                          "* Post Tweets for you\r\n"
-                                                          "\r\n**HOWEVER, " + self.app_name + " WILL DO NONE OF THESE "
-                                                          "THINGS. " + self.app_name + " WILL ONLY RETWEET RELEVENT " +
-                                                          self.bot_topic + " TWEETS**\r\n"
-                                                          "\r\nAuthorizing " + self.app_name + " does not permit it to:"
-                                                          "\r\n* Access or otherwise view your Direct Messages (DMs)"
-                                                          "\r\n* Access or otherwise view your email address\r\n"
-                                                          "* Access or otherwise view your Twitter password\r\n\r\nBy "
-                                                          "authorizing any application, including '" +
-                                                          self.app_name +
-                                                          "', you continue to operate under Twitter's Terms of "
-                                                          "Service. Some usage data will be "
-                                                          "shared with Twitter. For more information, see Twitter’s "
-                                                          'Privacy Policy.'"\r\n"
-                                                          "\r\nFor questions or additional information, send a direct "
-                                                          "message with the text 'help' to me or 'get-cmd-list' to see "
-                                                          "a list of all available commands!\r\n\r\n"
-                                                          "Please report issues to "
-                                                          + self.issues_report_to + " - Thank you!\r\n"
-                                                          "\r\nBest regards,\r\n" + self.dm_sender_name + "!")
-                        self.api_dm.destroy_direct_message(dm.id)
-                        self.data['statistic']['sent_help_dm'] += 1
-                        self.save_db()
-                    elif "".join(str(dm.message_create['message_data']['text']).split()).lower() == "set-rt-level:1":
-                        print("Set retweet_level for user " + str(dm.message_create['sender_id'] + " to 1!"))
-                        user = self.api_self.get_user(dm.message_create['sender_id'])
-                        user_id = dm.message_create['sender_id']
-                        try:
-                            self.data['accounts'][str(user_id)]['retweet_level'] = 1
-                        except KeyError as error_msg:
-                            logging.error("cant execute set-rt-level, because the user.id (" + str(user_id) + ") is "
-                                          "not saved in our DB! - " + str(error_msg))
-                            self.api_dm.destroy_direct_message(dm.id)
-                            continue
-                        retweet_level = self.data['accounts'][str(user_id)]['retweet_level']
-                        self.api_self.send_direct_message(dm.message_create['sender_id'],
-                                                          "Hello " + str(user.name) +
-                                                          "!\r\n\r\nYour new retweet-level is " + str(retweet_level) +
-                                                          "\r\n\r\nFor questions or additional information, send a "
-                                                          "direct message with the text 'help' to me or 'get-cmd-list'"
-                                                          " to see a list of all available commands!"
-                                                          "\r\n\r\nBest regards,\r\n" + self.dm_sender_name + "!")
-                        self.api_dm.destroy_direct_message(dm.id)
-                        self.data['statistic']['received_botcmds'] += 1
-                        self.save_db()
-                    elif "".join(str(dm.message_create['message_data']['text']).split()).lower() == "set-rt-level:2":
-                        print("Set retweet_level for user " + str(dm.message_create['sender_id'] + " to 2!"))
-                        user = self.api_self.get_user(dm.message_create['sender_id'])
-                        user_id = dm.message_create['sender_id']
-                        try:
-                            self.data['accounts'][str(user_id)]['retweet_level'] = 2
-                        except KeyError as error_msg:
-                            logging.error("cant execute set-rt-level, because the user.id (" + str(user_id) + ") is "
-                                          "not saved in our DB! - " + str(error_msg))
-                            self.api_dm.destroy_direct_message(dm.id)
-                            continue
-                        retweet_level = self.data['accounts'][str(user_id)]['retweet_level']
-                        self.api_self.send_direct_message(dm.message_create['sender_id'],
-                                                          "Hello " + str(user.name) +
-                                                          "!\r\n\r\nYour new retweet-level is " + str(retweet_level) +
-                                                          "\r\n\r\nFor questions or additional information, send a "
-                                                          "direct message with the text 'help' to me or 'get-cmd-list'"
-                                                          " to see a list of all available commands!"
-                                                          "\r\n\r\nBest regards,\r\n" + self.dm_sender_name + "!")
-                        self.api_dm.destroy_direct_message(dm.id)
-                        self.data['statistic']['received_botcmds'] += 1
-                        self.save_db()
-                    elif "".join(str(dm.message_create['message_data']['text']).split()).lower() == "set-rt-level:3":
-                        print("Set retweet_level for user " + str(dm.message_create['sender_id'] + " to 3!"))
-                        user = self.api_self.get_user(dm.message_create['sender_id'])
-                        user_id = dm.message_create['sender_id']
-                        try:
-                            self.data['accounts'][str(user_id)]['retweet_level'] = 3
-                        except KeyError as error_msg:
-                            logging.error("cant execute set-rt-level, because the user.id (" + str(user_id) + ") is "
-                                          "not saved in our DB! - " + str(error_msg))
-                            self.api_dm.destroy_direct_message(dm.id)
-                            continue
-                        retweet_level = self.data['accounts'][str(user_id)]['retweet_level']
-                        self.api_self.send_direct_message(dm.message_create['sender_id'],
-                                                          "Hello " + str(user.name) +
-                                                          "!\r\n\r\nYour new retweet-level is " + str(retweet_level) +
-                                                          "\r\n\r\nFor questions or additional information, send a "
-                                                          "direct message with the text 'help' to me or 'get-cmd-list'"
-                                                          " to see a list of all available commands!"
-                                                          "\r\n\r\nBest regards,\r\n" + self.dm_sender_name + "!")
-                        self.api_dm.destroy_direct_message(dm.id)
-                        self.data['statistic']['received_botcmds'] += 1
-                        self.save_db()
-                    elif "".join(str(dm.message_create['message_data']['text']).split()).lower() == "get-cmd-list":
-                        user = self.api_self.get_user(dm.message_create['sender_id'])
-                        print("Send command list to " + str(user.id) + " - " + str(user.screen_name))
-                        msg = ""
-                        msg += "List of available bot commands:\r\n"
-                        msg += "* 'get-cmd-list'\r\n"
-                        msg += "* 'get-info'\r\n"
-                        msg += "* 'help'\r\n"
-                        msg += "* 'set-rt-level:1'\r\n"
-                        msg += "* 'set-rt-level:2'\r\n"
-                        msg += "* 'set-rt-level:3'\r\n"
-                        msg += "* '\r\nget-bot-info (admins only)\r\n"
-                        self.api_self.send_direct_message(dm.message_create['sender_id'],
-                                                          "Hello " +
-                                                          str(self.api_self.get_user(
-                                                              dm.message_create['sender_id']).name) +
-                                                          "!\r\n\r\n" + str(msg) + "\r\n"
-                                                          "\r\n\r\nFor questions or additional information, send a "
-                                                          "direct message with the text 'help' to me or 'get-cmd-list'"
-                                                          " to see a list of all available commands!\r\n\r\n"
-                                                          "Best regards,\r\n" + self.dm_sender_name + "!")
-                        self.api_dm.destroy_direct_message(dm.id)
-                        self.data['statistic']['received_botcmds'] += 1
-                        self.save_db()
-                    elif "".join(str(dm.message_create['message_data']['text']).split()).lower() == "get-info":
-                        user = self.api_self.get_user(dm.message_create['sender_id'])
-                        print("Send account infos to " + str(user.id) + " - " + str(user.screen_name))
-                        msg = ""
-                        msg += "Your leaderboard rank: " + str(self.leaderboard_table[str(user.id)]['rank']) + "\r\n"
-                        msg += "Your retweet-level: " + str(self.data['accounts'][str(user.id)]['retweet_level'])
-                        msg += "\r\nYour retweets: " + str(self.data['accounts'][str(user.id)]['retweets']) + "\r\n"
-                        self.api_self.send_direct_message(dm.message_create['sender_id'],
-                                                          "Hello " +
-                                                          str(self.api_self.get_user(
-                                                              dm.message_create['sender_id']).name) +
-                                                          "!\r\n\r\n" + str(msg) + "\r\n\r\nTOP 10 LEADERBOARD\r\n"
-                                                          "===================\r\n"
-                                                          + self.leaderboard_table_string +
-                                                          "\r\n\r\nFor questions or additional information, send a "
-                                                          "direct message with the text 'help' to me or 'get-cmd-list' "
-                                                          "to see a list of all available commands!\r\n\r\n"
-                                                          "Best regards,\r\n" + self.dm_sender_name + "!")
-                        self.api_dm.destroy_direct_message(dm.id)
-                        self.data['statistic']['received_botcmds'] += 1
-                        self.save_db()
-                    elif "".join(str(dm.message_create['message_data']['text']).split()).lower() == "get-bot-info":
-                        user = self.api_self.get_user(dm.message_create['sender_id'])
-                        admin_status = False
-                        for admin_name in self.sys_admin_list:
-                            if str(user.id) == str(self.api_self.get_user(screen_name=admin_name).id):
-                                admin_status = True
-                        if str(user.id) == str(self.bot_user_id) or admin_status is True:
-                            subscriptions_rt_level_1 = 0
-                            subscriptions_rt_level_2 = 0
-                            subscriptions_rt_level_3 = 0
-                            print("Send bot infos to " + str(user.id) + " - " + str(user.screen_name))
-                            msg = ""
-                            msg += "Bot: " + self.app_name + " Bot " + self.app_version + "\r\n\r\n"
-                            msg += "Accounts: " + str(len(self.data['accounts'])) + "\r\n"
-                            for user_id in self.data['accounts']:
-                                if int(self.data['accounts'][user_id]['retweet_level']) == 1:
-                                    subscriptions_rt_level_1 += 1
-                                elif int(self.data['accounts'][user_id]['retweet_level']) == 2:
-                                    subscriptions_rt_level_1 += 1
-                                    subscriptions_rt_level_2 += 1
-                                elif int(self.data['accounts'][user_id]['retweet_level']) == 3:
-                                    subscriptions_rt_level_1 += 1
-                                    subscriptions_rt_level_2 += 1
-                                    subscriptions_rt_level_3 += 1
-                                user = self.api_self.get_user(user_id)
-                                msg += "@" + user.screen_name + " - level : " + \
-                                       str(self.data['accounts'][user_id]['retweet_level']) + " - rt: " + \
-                                       str(self.data['accounts'][user_id]['retweets']) + "\r\n"
-                            msg += "\r\nAvailable accounts per RT level:\r\n"
-                            msg += "* 1: " + str(subscriptions_rt_level_1) + "\r\n"
-                            msg += "* 2: " + str(subscriptions_rt_level_2) + "\r\n"
-                            msg += "* 3: " + str(subscriptions_rt_level_3) + "\r\n\r\n"
-                            msg += "Tweets: " + str(self.data['statistic']['tweets']) + "\r\n\r\n"
-                            msg += "Retweets: " + str(self.data['statistic']['retweets']) + "\r\n\r\n"
-                            msg += "Sent help DMs: " + str(self.data['statistic']['sent_help_dm']) + "\r\n\r\n"
-                            msg += "Executed bot commands: " + str(self.data['statistic']['received_botcmds'])
-                            self.api_self.send_direct_message(dm.message_create['sender_id'],
-                                                              "Hello " +
-                                                              str(self.api_self.get_user(
-                                                                  dm.message_create['sender_id']).name) +
-                                                              "!\r\n\r\n" +
-                                                              str(msg) + "\r\n\r\nBest regards,\r\n" +
-                                                              self.dm_sender_name + "!")
-                            self.data['statistic']['received_botcmds'] += 1
-                            self.save_db()
-                        else:
-                            logging.info("Received 'get-bot-info' from unauthorized account: " + str(user.id) + " - " +
-                                         str(user.screen_name))
-                            print("Received 'get-bot-info' from unauthorized account: " + str(user.id) + " - " +
-                                  str(user.screen_name))
-                        self.api_dm.destroy_direct_message(dm.id)
+                    self.processed_dm_ids[dm.id] = enqueue_time
+                    dm_list.append(dm)
+                while len(self.processed_dm_ids) > 1000:
+                    self.processed_dm_ids.popitem(last=False)
+            if not dm_list:
+                continue
+            try:
+                with self.rate_limits.priority("interactive"):
+                    self.process_direct_messages(dm_list)
             except tweepy.error.RateLimitError as error_msg:
+                # the DMs are not destroyed yet, process the batch again after the reset of the rate limit window
                 logging.error(str(error_msg))
-                time.sleep(300)
+                with self.processed_dm_ids_lock:
+                    for dm in dm_list:
+                        self.processed_dm_ids.pop(dm.id, None)
+                threading.Timer(getattr(error_msg, 'retry_after', 300), self.requeue_direct_messages,
+                                args=(dm_list,)).start()
             except tweepy.error.TweepError as error_msg:
+                # the handled DMs of the batch are saved, the next poll only runs the rest
                 logging.critical(str(error_msg))
-            time.sleep(60)
+                with self.processed_dm_ids_lock:
+                    for dm in dm_list:
+                        self.processed_dm_ids.pop(dm.id, None)
+            except Exception as error_msg:
+                # a broken DM must not stop the thread, the DMs of the batch are polled again
+                logging.critical("processing of " + str(len(dm_list)) + " DMs failed: " + str(error_msg),
+                                 exc_info=True)
+                print("ERROR: processing of " + str(len(dm_list)) + " DMs failed: " + str(error_msg))
+                with self.processed_dm_ids_lock:
+                    for dm in dm_list:
+                        self.processed_dm_ids.pop(dm.id, None)
 
-    def get_api_user(self, user_id):
-        auth = tweepy.OAuthHandler(self.consumer_key, self.consumer_secret)
-        auth.set_access_token(self.data['accounts'][str(user_id)]['access_token'],
-                              self.data['accounts'][str(user_id)]['access_token_secret'])
-        api = tweepy.API(auth)
-        return api
+    def count_retweet_ledger(self, name):
+        with self.retweet_ledger_lock:
+            self.retweet_ledger_stats[name] += 1
+        self.metrics.inc("retweet_ledger_total", result=name)
+
+    def db_add_retweet(self, tweet_id, user_id):
+        self._db_change({'op': "retweet", 'tweet_id': str(tweet_id), 'user_id': str(user_id)})
+
+    def db_add_seen_tweet(self, tweet_id):
+        self._db_change({'op': "tweet", 'id': int(tweet_id)})
+
+    def db_delete(self, path):
+        self._db_change({'op': "del", 'path': path})
+
+    def db_increment(self, path, value=1):
+        self._db_change({'op': "incr", 'path': path, 'value': value})
+
+    def db_set(self, path, value):
+        self._db_change({'op': "set", 'path': path, 'value': value})
 
-    def leaderboard(self):
+    def db_storage_sync(self):
         while True:
-            time_start = time.time()
-            temp_leaderboard_table = {}
-            self.leaderboard_table_string = ""
-            print("Generating leaderboard ...")
-            logging.debug("Generating leaderboard ...")
-            for user_id in self.data['accounts']:
-                try:
-                    temp_leaderboard_table[user_id] = self.data['accounts'][user_id]['retweets']
-                except KeyError:
-                    time.sleep(60*1)
+            time.sleep(self.db_storage.sync_interval)
+            self.db_storage.sync()
+
+    def destroy_direct_message(self, dm_id):
+        # returns False if the DM is still in the inbox
+        try:
+            self.api_dm.destroy_direct_message(dm_id)
+        except tweepy.error.TweepError as error_msg:
+            # 34 = the DM does not exist (anymore)
+            if error_msg.api_code != 34:
+                logging.error("can not destroy DM " + str(dm_id) + ": " + str(error_msg))
+                return False
+        return True
+
+    def dm_command_get_bot_info(self, dm, user, argument):
+        admin_status = False
+        for admin_name in self.sys_admin_list:
+            if str(user.id) == str(self.user_cache.get_user(screen_name=admin_name).id):
+                admin_status = True
+        if str(user.id) != str(self.bot_user_id) and admin_status is not True:
+            logging.info("Received 'get-bot-info' from unauthorized account: " + str(user.id) + " - " +
+                         str(user.screen_name))
+            print("Received 'get-bot-info' from unauthorized account: " + str(user.id) + " - " +
+                  str(user.screen_name))
+            return False
+        print("Send bot infos to " + str(user.id) + " - " + str(user.screen_name))
+        msg = ""
+        msg += "Bot: " + self.app_name + " Bot " + self.app_version + "\r\n\r\n"
+        data = self.get_db_snapshot(with_tweets=False)
+        msg += "Accounts: " + str(len(data['accounts'])) + "\r\n"
+        accounts = self.user_cache.get_users(list(data['accounts']))
+        for user_id in data['accounts']:
+            if user_id in accounts:
+                screen_name = "@" + str(accounts[user_id].screen_name)
+            else:
+                screen_name = "unknown user " + str(user_id)
+            msg += screen_name + " - level : " + \
+                   str(data['accounts'][user_id]['retweet_level']) + " - rt: " + \
+                   str(data['accounts'][user_id]['retweets']) + "\r\n"
+        msg += "\r\nAvailable accounts per RT level:\r\n"
+        for rt_level in self.rt_levels:
+            msg += "* " + str(rt_level) + ": " + str(self.subscriber_index.count(rt_level)) + "\r\n"
+        msg += "\r\n"
+        msg += "Tweets: " + str(data['statistic']['tweets']) + "\r\n\r\n"
+        msg += "Retweets: " + str(data['statistic']['retweets']) + "\r\n\r\n"
+        msg += "Sent help DMs: " + str(data['statistic']['sent_help_dm']) + "\r\n\r\n"
+        msg += "Executed bot commands: " + str(data['statistic']['received_botcmds']) + "\r\n\r\n"
+        msg += "Saved get_status calls (retweet ledger): " + str(self.retweet_ledger_stats['saved_calls'])
+        msg += "\r\n\r\nCommand statistics (count - avg ms):\r\n"
+        for command in sorted(self.dm_commands):
+            count = data['statistic'].get('cmd_' + command + '_count', 0)
+            if count:
+                msg += "* " + command + ": " + str(count) + " - " + \
+                       str(round(data['statistic'].get('cmd_' + command + '_ms', 0) / count, 1)) + "\r\n"
+        self.db_increment(['statistic', 'received_botcmds'])
+        return msg
+
+    def dm_command_get_cmd_list(self, dm, user, argument):
+        print("Send command list to " + str(user.id) + " - " + str(user.screen_name))
+        msg = ""
+        msg += "List of available bot commands:\r\n"
+        msg += "* 'get-cmd-list'\r\n"
+        msg += "* 'get-info'\r\n"
+        msg += "* 'help'\r\n"
+        msg += "* 'set-rt-level:1'\r\n"
+        msg += "* 'set-rt-level:2'\r\n"
+        msg += "* 'set-rt-level:3'\r\n"
+        msg += "* '\r\nget-bot-info (admins only)\r\n"
+        self.db_increment(['statistic', 'received_botcmds'])
+        return str(msg) + "\r\n\r\n\r\nFor questions or additional information, send a direct message with the text " \
+                          "'help' to me or 'get-cmd-list' to see a list of all available commands!"
+
+    def dm_command_get_info(self, dm, user, argument):
+        print("Send account infos to " + str(user.id) + " - " + str(user.screen_name))
+        msg = ""
+        msg += "Your leaderboard rank: " + str(self.leaderboard.get_rank(user.id)) + "\r\n"
+        account = self.get_db_snapshot(with_tweets=False)['accounts'][str(user.id)]
+        msg += "Your retweet-level: " + str(account['retweet_level'])
+        msg += "\r\nYour retweets: " + str(account['retweets']) + "\r\n"
+        self.db_increment(['statistic', 'received_botcmds'])
+        return str(msg) + "\r\n\r\nTOP 10 LEADERBOARD\r\n===================\r\n" + \
+            self.get_leaderboard_table_string() + "\r\n\r\nFor questions or additional information, send a " \
+                                                  "direct message with the text 'help' to me or 'get-cmd-list' to " \
+                                                  "see a list of all available commands!"
+
+    def dm_command_help(self, dm, user, argument):
+        print("Send help DM to " + str(user.id) + "!")
+        user_id = str(user.id)
+        try:
+            retweet_level = self.data['accounts'][user_id]['retweet_level']
+        except KeyError:
+            self.db_set(['accounts', user_id, 'retweet_level'], 2)
+            retweet_level = self.data['accounts'][user_id]['retweet_level']
+        try:
+            retweets = self.data['accounts'][user_id]['retweets']
+        except KeyError:
+            self.db_set(['accounts', user_id, 'retweets'], 0)
+            retweets = self.data['accounts'][user_id]['retweets']
+        self.db_increment(['statistic', 'sent_help_dm'])
+        return self.retweet_sources_description + "\r\n" \
+            "\r\nTo set a retweet level, send a DM to @" + self.bot_twitter_account + " with the following text:\r\n" \
+            "* 'set-rt-level:1' to retweet only first class posts\r\n" \
+            "* 'set-rt-level:2' to be informative\r\n" \
+            "* 'set-rt-level:3' to retweet everything " + self.bot_topic + " related that this app finds for " \
+            "you!\r\n \r\nYour current retweet-level is " + str(retweet_level) + "\r\n\r\nYou have made " + \
+            str(retweets) + " retweets for " + self.bot_topic + "!\r\n" \
+            "\r\nThis application is now connected to your Twitter Account. If you wish to revoke its access, you " \
+            "can do so via Twitter’s 'Settings and Privacy' page (https://twitter.com/settings/sessions) by " \
+            "clicking on the 'Revoke Access' button. However, once access is revoked, it cannot be undone via " \
+            "Twitter. You must reauthorize it at " + self.base_url + "\r\n" \
+            "\r\n\r\nAuthorizing " + self.app_name + " permits it to:" \
+            "\r\n* Read Tweets from your timeline\r\n" \
+            "* See who you follow, and follow new people\r\n" \
+            "* Update your profile\r\n" \
+            "* Post Tweets for you\r\n" \
+            "\r\n**HOWEVER, " + self.app_name + " WILL DO NONE OF THESE THINGS. " + self.app_name + \
+            " WILL ONLY RETWEET RELEVENT " + self.bot_topic + " TWEETS**\r\n" \
+            "\r\nAuthorizing " + self.app_name + " does not permit it to:" \
+            "\r\n* Access or otherwise view your Direct Messages (DMs)" \
+            "\r\n* Access or otherwise view your email address\r\n" \
+            "* Access or otherwise view your Twitter password\r\n\r\nBy authorizing any application, including '" + \
+            self.app_name + "', you continue to operate under Twitter's Terms of Service. Some usage data will be " \
+            "shared with Twitter. For more information, see Twitter’s Privacy Policy.\r\n" \
+            "\r\nFor questions or additional information, send a direct message with the text 'help' to me or " \
+            "'get-cmd-list' to see a list of all available commands!\r\n\r\n" \
+            "Please report issues to " + self.issues_report_to + " - Thank you!"
+
+    def dm_command_set_rt_level(self, dm, user, argument):
+        print("Set retweet_level for user " + str(user.id) + " to " + argument + "!")
+        user_id = str(user.id)
+        try:
+            self.db_set(['accounts', user_id, 'retweet_level'], int(argument))
+        except KeyError as error_msg:
+            logging.error("cant execute set-rt-level, because the user.id (" + user_id + ") is "
+                          "not saved in our DB! - " + str(error_msg))
+            return False
+        retweet_level = self.data['accounts'][user_id]['retweet_level']
+        self.db_increment(['statistic', 'received_botcmds'])
+        return "Your new retweet-level is " + str(retweet_level) + "\r\n\r\nFor questions or additional " \
+               "information, send a direct message with the text 'help' to me or 'get-cmd-list' to see a list of " \
+               "all available commands!"
+
+    def fan_out_retweet(self, tweet, rt_level, owner=None):
+        # randomize order of users for a more natural behaviour: every account gets a random start time within the
+        # jitter window, but never earlier than `retweet_account_min_spacing` after its last retweet. `owner` limits
+        # the fan-out to the accounts of a shard. Returns the ids of the accounts that retweeted.
+        fan_out_start = time.time()
+        # the tokens of all retweets of the fan-out are read from one snapshot of the db
+        accounts = self.get_db_snapshot(with_tweets=False)['accounts']
+        schedule = []
+        with self.retweet_slots_lock:
+            for user_id in self.subscriber_index.get_account_ids(rt_level):
+                if str(user_id) in self.invalid_token_accounts:
+                    continue
+                if owner is not None and not owner(str(user_id)):
                     continue
+                if str(user_id) != str(self.bot_user_id) or self.config['SYSTEM']['let_bot_account_retweet'] == "True":
+                    start = max(fan_out_start + random.uniform(0, self.retweet_jitter_window),
+                                self.retweet_slots.get(str(user_id), 0) + self.retweet_account_min_spacing)
+                    self.retweet_slots[str(user_id)] = start
+                    schedule.append((start, str(user_id)))
+        schedule.sort()
+        futures = []
+        for start, user_id in schedule:
+            delay = start - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(self.retweet_pool.submit(self.tracer.wrap(self.retweet_as_user, "account", user_id=user_id),
+                                                    user_id, tweet, accounts))
+        retweeted = []
+        for (start, user_id), future in zip(schedule, futures):
+            if future.result() is True:
+                retweeted.append(user_id)
+        print("\tFan-out of " + str(tweet.id) + " finished after " + str(round(time.time() - fan_out_start, 2)) +
+              " seconds (" + str(len(retweeted)) + " of " + str(len(schedule)) + " accounts retweeted)")
+        self.metrics.observe("fan_out_duration_seconds", time.time() - fan_out_start, rt_level=rt_level)
+        return retweeted
+
+    def fan_out_sharded(self, tweet, rt_level):
+        # publishes the fan-out as job for the live workers and applies their results, the shards of workers that
+        # die during the job are handed over to the survivors with a follow-up job (or fanned out locally)
+        workers = self.shard_queue.get_live_workers()
+        if len(workers) == 0:
+            print("\tNo live fan-out workers, fan-out of " + str(tweet.id) + " runs locally!")
+            logging.warning("no live fan-out workers, fan-out of " + str(tweet.id) + " runs locally")
+            return len(self.fan_out_retweet(tweet, rt_level))
+        fan_out_start = time.time()
+        deadline = fan_out_start + float(self.config['SYSTEM']['shard_job_timeout'])
+        made_retweets = 0
+        job_id = self.shard_queue.publish(tweet.id, rt_level, workers)
+        jobs = {job_id: {'workers': workers, 'chain': [], 'done': set()}}
+        print("\tPublished fan-out job " + str(job_id) + " of " + str(tweet.id) + " to " + str(len(workers)) +
+              " workers")
+        while len(jobs) > 0:
+            live_workers = self.shard_queue.get_live_workers()
+            for job_id in list(jobs):
+                job = jobs[job_id]
+                for worker_id, result in self.shard_queue.get_results(job_id).items():
+                    if worker_id not in job['done']:
+                        job['done'].add(worker_id)
+                        made_retweets += self.apply_shard_result(tweet.id, result)
+                dead_workers = [worker_id for worker_id in job['workers']
+                                if worker_id not in job['done'] and worker_id not in live_workers]
+                if len(dead_workers) > 0:
+                    job['done'].update(dead_workers)
+                    chain = job['chain'] + [[job['workers'], dead_workers]]
+                    print("\tFan-out workers " + ", ".join(dead_workers) + " of job " + str(job_id) + " died")
+                    logging.error("fan-out workers " + ", ".join(dead_workers) + " of job " + str(job_id) + " died")
+                    if len(live_workers) > 0:
+                        follow_up_job_id = self.shard_queue.publish(tweet.id, rt_level, live_workers, chain=chain)
+                        jobs[follow_up_job_id] = {'workers': live_workers, 'chain': chain, 'done': set()}
+                    else:
+                        made_retweets += len(self.fan_out_retweet(
+                            tweet, rt_level, owner=lambda user_id, chain=chain: self.is_shard_member(user_id, chain)))
+                if job['done'] >= set(job['workers']):
+                    self.shard_queue.delete_job(job_id)
+                    del jobs[job_id]
+            if len(jobs) > 0:
+                if time.time() > deadline:
+                    for job_id in jobs:
+                        self.shard_queue.delete_job(job_id)
+                    print("\tERROR: fan-out jobs " + str(sorted(jobs)) + " of " + str(tweet.id) + " timed out!")
+                    logging.error("fan-out jobs " + str(sorted(jobs)) + " of " + str(tweet.id) + " timed out")
+                    break
+                time.sleep(0.5)
+        print("\tSharded fan-out of " + str(tweet.id) + " finished after " +
+              str(round(time.time() - fan_out_start, 2)) + " seconds (" + str(made_retweets) + " accounts retweeted)")
+        self.metrics.observe("fan_out_duration_seconds", time.time() - fan_out_start, rt_level=rt_level)
+        return made_retweets
+
+    def fetch_timeline(self, source_account, since_id=None):
+        # fetch only the tweets since the last round (`since_id`), after a downtime up to `timeline_page_depth` pages.
+        # Returns the tweets and if the fetch is complete: the pages are fetched from the newest tweet backwards, if a
+        # page fails the tweets between the cursor and the fetched pages are missing and the cursor must not move.
+        timeline = []
+        if self.rate_limits.get_wait_time("self", "user_timeline") > self.rate_limits.max_wait:
+            logging.info("skipping timeline of " + source_account + ", the rate limit is reached")
+            self.metrics.inc("timeline_fetch_skipped_total", source=source_account.lower())
+            return timeline, False
+        fetch_start = time.time()
+        complete = False
+        try:
+            if since_id is None:
+                return list(self.api_self.user_timeline(screen_name=source_account)), True
+            max_id = None
+            for page in range(int(self.config['SYSTEM']['timeline_page_depth'])):
+                if max_id is None:
+                    tweets = self.api_self.user_timeline(screen_name=source_account, since_id=since_id,
+                                                         count=int(self.config['SYSTEM']['timeline_page_size']))
+                else:
+                    tweets = self.api_self.user_timeline(screen_name=source_account, since_id=since_id,
+                                                         max_id=max_id,
+                                                         count=int(self.config['SYSTEM']['timeline_page_size']))
+                if len(tweets) == 0:
+                    break
+                timeline.extend(tweets)
+                max_id = min(tweet.id for tweet in tweets) - 1
+            complete = True
+        except tweepy.error.RateLimitError as error_msg:
+            # the rate limit governor skips the other timelines until the rate limit window is reset
+            self.metrics.inc("timeline_fetch_skipped_total", source=source_account.lower())
+            logging.error(str(error_msg))
+            print("error: " + str(error_msg) + " user: " + source_account)
+        except tweepy.error.TweepError as error_msg:
+            logging.critical(str(error_msg))
+            print("error: " + str(error_msg) + " user: " + source_account)
+        finally:
+            self.metrics.observe("timeline_fetch_duration_seconds", time.time() - fetch_start,
+                                 source=source_account.lower())
+        return timeline, complete
+
+    def fetch_timelines(self, source_accounts):
+        # returns the timelines and the new cursors of the completely fetched timelines
+        with self.tracer.span("fetch_timelines", sources=len(source_accounts)):
+            fetch_start = time.time()
+            since_ids = self.get_db_snapshot(with_tweets=False)['timeline_cursors']
+            futures = {}
+            for source_account in source_accounts:
+                futures[source_account.lower()] = self.timeline_pool.submit(
+                    self.tracer.wrap(self.fetch_timeline, "fetch_timeline", source=source_account), source_account,
+                    since_ids.get(source_account.lower()))
+            timelines = {}
+            cursors = {}
+            for source_account in futures:
+                timelines[source_account], complete = futures[source_account].result()
+                if complete and len(timelines[source_account]) > 0:
+                    cursors[source_account] = max(tweet.id for tweet in timelines[source_account])
+            print("Fetched " + str(len(timelines)) + " timelines in " + str(round(time.time() - fetch_start, 2)) +
+                  " seconds")
+            self.metrics.observe("timelines_fetch_duration_seconds", time.time() - fetch_start)
+        return timelines, cursors
+
+    def get_rt_source_accounts(self, rt_levels):
+        source_accounts = {}
+        for rt_level in rt_levels:
+            for source_account in self.config['RT-LEVEL-' + str(rt_level)]['from'].split(","):
+                source_accounts[source_account.lower()] = source_account
+        return list(source_accounts.values())
+
+    def get_api_user(self, user_id, accounts=None):
+        # `accounts` of a db snapshot that the caller already has, otherwise a new snapshot is taken
+        if accounts is None:
+            accounts = self.get_db_snapshot(with_tweets=False)['accounts']
+        return self.api_pool.get_api(user_id,
+                                     accounts[str(user_id)]['access_token'],
+                                     accounts[str(user_id)]['access_token_secret'])
+
+    def get_db_snapshot(self, with_tweets=True):
+        # immutable copy-on-write snapshot of the db (a new dict only on the top level), `with_tweets` adds the export
+        # of the seen tweet index
+        with self.db_lock:
+            snapshot = self.db_state.snapshot()
+            if with_tweets:
+                return dict(snapshot, tweets=self.seen_tweets.export())
+        return dict(snapshot)
+
+    def get_leaderboard_table_string(self):
+        # the top 10 string is only rebuilt if the top 10 of the leaderboard changed since the last call
+        top, generation = self.leaderboard.get_top()
+        if generation != self.leaderboard_table_string_generation:
+            leaderboard_table_string = ""
             rank = 1
-            self.leaderboard_table = {}
-            for key, value in reversed(sorted(temp_leaderboard_table.items(), key=lambda item: (item[1], item[0]))):
-                if rank <= 10:
-                    self.leaderboard_table_string += "#" + str(rank) + " " + \
-                                                     str(self.api_self.get_user(key).screen_name) + \
-                                                     " - " + str(value) + " retweets\r\n"
-                self.leaderboard_table[key] = {'retweets': value,
-                                               'rank': rank}
+            users = self.user_cache.get_users([user_id for user_id, retweets in top])
+            for user_id, retweets in top:
+                try:
+                    screen_name = str(users[str(user_id)].screen_name)
+                except KeyError:
+                    screen_name = "unknown user"
+                leaderboard_table_string += "#" + str(rank) + " " + screen_name + " - " + str(retweets) + \
+                                            " retweets\r\n"
                 rank += 1
-            time_end = time.time()
-            run_time = time_end - time_start
-            print("Leaderboard generation runtime: " + str(run_time) + " seconds")
-            time.sleep(60*20)
+            self.leaderboard_table_string = leaderboard_table_string
+            self.leaderboard_table_string_generation = generation
+        return self.leaderboard_table_string
+
+    def get_shard_ring(self, workers):
+        # rings are cached by their workers, the same ring is used for all jobs until a worker joins or leaves
+        key = tuple(sorted(workers))
+        if key not in self.shard_rings:
+            self.shard_rings[key] = ShardRing(key, virtual_nodes=self.config['SYSTEM']['shard_virtual_nodes'])
+        return self.shard_rings[key]
+
+    def has_retweeted(self, tweet_id, user_id):
+        with self.db_lock:
+            ledger = self.data['retweet_ledger']
+            try:
+                return ledger['tweets'].get(str(tweet_id), 0) >> ledger['accounts'][str(user_id)] & 1 == 1
+            except KeyError:
+                return False
+
+    def is_shard_member(self, user_id, chain, workers=None, worker_id=None):
+        # an account belongs to a job if its owner in every ring of the chain is one of the listed owners and (for a
+        # worker) if it is the owner in the ring of the job
+        for ring_workers, owners in chain:
+            if self.get_shard_ring(ring_workers).get_owner(user_id) not in owners:
+                return False
+        if worker_id is not None:
+            return self.get_shard_ring(workers).get_owner(user_id) == worker_id
+        return True
 
     def load_db(self):
+        with self.db_lock:
+            self.db_version = self.db_storage.get_version()
+            self.db_state = DbState(self.db_storage.load(self.data_layout, self.seen_tweets))
+            self.data = self.db_state.data
+            self.subscriber_index.rebuild(self.data['accounts'])
+            self.leaderboard.rebuild(self.data['accounts'])
+
+    def merge_timelines(self, timelines, source_accounts):
+        tweets = []
+        tweet_ids = set()
+        for source_account in source_accounts:
+            for tweet in timelines.get(source_account.lower(), []):
+                if tweet.id not in tweet_ids:
+                    tweet_ids.add(tweet.id)
+                    tweets.append(tweet)
+        return tweets
+
+    def onboarding_worker(self):
+        # the jobs are saved in the db, so an onboarding that was interrupted by a restart is continued
+        for user_id in self.get_db_snapshot(with_tweets=False)['onboarding_jobs']:
+            self.onboarding_queue.put(user_id)
+        while True:
+            user_id = self.onboarding_queue.get()
+            try:
+                self.process_onboarding_job(user_id)
+            except tweepy.error.RateLimitError as error_msg:
+                logging.error(str(error_msg))
+                threading.Timer(getattr(error_msg, 'retry_after', 300), self.onboarding_queue.put,
+                                args=(user_id,)).start()
+            except tweepy.error.TweepError as error_msg:
+                logging.error("onboarding of user " + str(user_id) + " failed: " + str(error_msg))
+                self.db_increment(['onboarding_jobs', user_id, 'attempts'])
+                self.save_db()
+                attempts = self.get_db_snapshot(with_tweets=False)['onboarding_jobs'][user_id]['attempts']
+                if attempts < int(self.config['SYSTEM']['onboarding_max_attempts']):
+                    threading.Timer(60 * attempts, self.onboarding_queue.put, args=(user_id,)).start()
+                else:
+                    print("Giving up the onboarding of user " + str(user_id) + "!")
+                    self.db_delete(['onboarding_jobs', user_id])
+                    self.save_db()
+
+    def poll_direct_messages(self):
+        time.sleep(2)
+        if self.dm_ingestion == "webhook":
+            # fallback for events the webhook missed
+            interval = int(self.config['SYSTEM']['dm_webhook_fallback_polling_interval'])
+        else:
+            interval = 60
+        while True:
+            try:
+                dm_list = self.api_dm.list_direct_messages()
+                for dm in reversed(dm_list):
+                    self.dm_queue.put((time.time(), dm))
+            except tweepy.error.RateLimitError as error_msg:
+                logging.error(str(error_msg))
+                time.sleep(getattr(error_msg, 'retry_after', 300))
+            except tweepy.error.TweepError as error_msg:
+                logging.critical(str(error_msg))
+            time.sleep(interval)
+
+    def post_to_telegram(self, message, chat_id):
+        # non blocking, the message is sent by the thread of `self.telegram_notifier`
+        with self.tracer.span("telegram", chat_id=chat_id):
+            return self.telegram_notifier.notify(chat_id, message)
+
+    def process_onboarding_job(self, user_id):
+        data = self.get_db_snapshot(with_tweets=False)
         try:
-            with open("./db/" + self.config['DATABASE']['db_file'], 'r') as f:
+            job = data['onboarding_jobs'][user_id]
+        except KeyError:
+            return False
+        if user_id not in data['accounts']:
+            self.db_delete(['onboarding_jobs', user_id])
+            self.save_db()
+            return False
+        user = self.user_cache.get_user(user_id)
+        print("Onboarding of @" + str(user.screen_name) + " (" + str(user.name) + ") ...")
+        if "backup" not in job['done']:
+            self.write_db_backup_new_user()
+            self._onboarding_step_done(user_id, "backup")
+        if "follow" not in job['done']:
+            for api, friend_id in ((self.get_api_user(user_id, data['accounts']), self.bot_user_id),
+                                   (self.api_self, user_id)):
                 try:
-                    self.data = json.load(f)
-                except json.decoder.JSONDecodeError as error_msg:
-                    logging.error(str(error_msg) + " - creating new db!")
-                    self.data = self.data_layout
-        except FileNotFoundError as error_msg:
-            logging.error("create new db!" + str(error_msg))
-            self.data = self.data_layout
+                    api.create_friendship(id=friend_id)
+                except tweepy.error.TweepError as error_msg:
+                    if "You can't follow yourself" in str(error_msg):
+                        pass
+                    else:
+                        logging.error(str(error_msg))
+            self._onboarding_step_done(user_id, "follow")
+        if "welcome_dm" not in job['done']:
+            self.send_welcome_message_new_user(user, data['accounts'][user_id]['retweet_level'],
+                                               data['accounts'][user_id]['retweets'])
+            self._onboarding_step_done(user_id, "welcome_dm")
+        if "status_messages" not in job['done']:
+            # every recipient is saved as done, a retry after a failed status message only sends the missing ones
+            # send status message to bot account
+            step = "status_message:" + str(self.bot_user_id)
+            if step not in job['done']:
+                self.send_status_message_new_user(self.bot_user_id, user.id)
+                self._onboarding_step_done(user_id, step)
+            # send status message to sys_admins
+            for admin_name in self.sys_admin_list:
+                step = "status_message:@" + admin_name.lower()
+                if step not in job['done']:
+                    self.send_status_message_new_user(self.user_cache.get_user(screen_name=admin_name).id, user.id)
+                    self._onboarding_step_done(user_id, step)
+            self._onboarding_step_done(user_id, "status_messages")
+        self.db_delete(['onboarding_jobs', user_id])
+        self.save_db()
+        return True
 
-    def post_to_telegram(self, message, chat_id):
-        send_text = 'https://api.telegram.org/bot' + str(self.telegram_auth_token) + '/sendMessage?chat_id=' + \
-                    str(chat_id).strip() + '&text=' + str(message)
-        response = requests.get(send_text)
-        return response.json()
+    def process_direct_messages(self, dm_list):
+        # Every DM of the batch is parsed once and dispatched by its command name via `self.dm_commands`. Senders
+        # are resolved once per batch, the replies are merged into one DM per sender and the db is saved once. The
+        # commands are not idempotent (counters), so a DM is saved as handled (`handled_dms`) together with its reply
+        # before the reply is sent. The command never runs again, a reply that was not sent yet (restart) is sent by
+        # the next batch with the DM.
+        senders = {}
+        replies = OrderedDict()
+        handled_dm_ids = OrderedDict()
+        for dm in dm_list:
+            sender_id = str(dm.message_create['sender_id'])
+            handled = self.data['handled_dms'].get(str(dm.id))
+            if handled is not None and handled['reply'] is None:
+                handled_dm_ids.setdefault(sender_id, []).append(dm.id)
+                continue
+            if sender_id not in senders:
+                try:
+                    senders[sender_id] = self.user_cache.get_user(sender_id)
+                except tweepy.error.RateLimitError:
+                    raise
+                except tweepy.error.TweepError as error_msg:
+                    logging.error("can not resolve the sender " + sender_id + " of DM " + str(dm.id) + ": " +
+                                  str(error_msg))
+                    if handled is not None:
+                        handled_dm_ids.setdefault(sender_id, []).append(dm.id)
+                    else:
+                        self.destroy_direct_message(dm.id)
+                    continue
+            if handled is not None:
+                replies.setdefault(sender_id, []).append(handled['reply'])
+                handled_dm_ids.setdefault(sender_id, []).append(dm.id)
+                continue
+            user = senders[sender_id]
+            if sender_id not in self.data['accounts']:
+                logging.info("The unauthorized Twitter user @" + str(user.screen_name) + " wrote a command to the "
+                             "bot!")
+                self.destroy_direct_message(dm.id)
+                continue
+            try:
+                text = dm.message_create['message_data']['text']
+            except (KeyError, TypeError):
+                logging.error("DM " + str(dm.id) + " of user " + sender_id + " has no text!")
+                self.destroy_direct_message(dm.id)
+                continue
+            command, separator, argument = "".join(str(text).split()).lower().partition(":")
+            try:
+                handler, arguments = self.dm_commands[command]
+            except KeyError:
+                continue
+            if argument not in arguments:
+                continue
+            start_time = time.time()
+            try:
+                msg = handler(dm, user, argument)
+            except Exception as error_msg:
+                # a failing command (e.g. a Twitter error in `get-bot-info`) gets an error reply and must not block
+                # the other DMs of the batch
+                logging.error("DM command '" + command + "' of user " + sender_id + " failed: " + str(error_msg))
+                print("DM command '" + command + "' of user " + sender_id + " failed: " + str(error_msg))
+                msg = "Sorry, the command '" + command + "' failed, please try again later!"
+            self.db_increment(['statistic', 'cmd_' + command + '_count'])
+            self.db_increment(['statistic', 'cmd_' + command + '_ms'], int(round((time.time() - start_time) * 1000)))
+            self.metrics.observe("dm_command_duration_seconds", time.time() - start_time, command=command)
+            if msg is False:
+                msg = None
+            else:
+                replies.setdefault(sender_id, []).append(msg)
+            self.db_set(['handled_dms', str(dm.id)], {'time': int(time.time()), 'reply': msg})
+            handled_dm_ids.setdefault(sender_id, []).append(dm.id)
+        self.save_db()
+        for sender_id in handled_dm_ids:
+            if sender_id in replies:
+                self.send_dm_reply(sender_id, "Hello " + str(senders[sender_id].name) + "!\r\n\r\n" +
+                                   "\r\n\r\n".join(replies[sender_id]) + "\r\n\r\nBest regards,\r\n" +
+                                   self.dm_sender_name + "!")
+            for dm_id in handled_dm_ids[sender_id]:
+                if self.destroy_direct_message(dm_id):
+                    self.db_delete(['handled_dms', str(dm_id)])
+                elif self.data['handled_dms'][str(dm_id)]['reply'] is not None:
+                    # the reply is sent (or dropped), only the destroy of the DM is retried
+                    self.db_set(['handled_dms', str(dm_id), 'reply'], None)
+        self.save_db()
+        return True
+
+    def process_tweet(self, tweet, rt_level, condition):
+        with self.tracer.span("tweet", tweet_id=tweet.id, rt_level=rt_level, condition=condition) as tweet_span:
+            print(str(tweet.id) + " - " + str(tweet.text[0:80]).splitlines()[0] + " ... (condition: " + condition +
+                  ")")
+            logging.debug(str(tweet.id) + " - " + str(tweet.text[0:80]).splitlines()[0] + " ... (condition: " +
+                          condition + ")")
+            if self.fan_out_mode == "sharded":
+                made_retweets = self.fan_out_sharded(tweet, rt_level)
+            else:
+                made_retweets = len(self.fan_out_retweet(tweet, rt_level))
+            tweet_span.attributes['retweets'] = made_retweets
+            if made_retweets > 0:
+                self.db_increment(['statistic', 'tweets'])
+                self.metrics.inc("tweets_total")
+                if self.telegram_post_new_tweets_to_group == "True":
+                    telegram_message = "I found a new tweet with rt-level " + str(rt_level) + \
+                                       " and made " + str(made_retweets) + " retweets:\r\n" \
+                                       "https://twitter.com/" + str(tweet.user.screen_name) + \
+                                       "/status/" + str(tweet.id) + "\r\n\r\n" \
+                                       "Please help by retweeting manually or simply let our " \
+                                       "bot do this for you and join FLO Retweets:\r\n" + \
+                                       self.base_url + "\r\n\r\nList of all tweets: " + \
+                                       self.telegram_channel_tag
+                    self.post_to_telegram(telegram_message, self.telegram_group_id)
+                if self.telegram_post_new_tweets_to_channel == "True":
+                    telegram_message = "Retweet level: " + str(rt_level) + " \r\n" \
+                                       "https://twitter.com/" + str(tweet.user.screen_name) + \
+                                       "/status/" + str(tweet.id)
+                    self.post_to_telegram(telegram_message, self.telegram_channel_id)
+            self.db_add_seen_tweet(tweet.id)
+            self.save_db()
+        return made_retweets
 
     def refresh_api_self(self):
-        auth = tweepy.OAuthHandler(self.consumer_key, self.consumer_secret)
-        auth.set_access_token(self.access_token, self.access_token_secret)
-        self.api_self = tweepy.API(auth)
+        self.api_self = InstrumentedApi(self._create_api(self.consumer_key, self.consumer_secret, self.access_token,
+                                                         self.access_token_secret),
+                                        self.metrics, tracer=self.tracer, governor=self.rate_limits, token="self")
 
     def refresh_api_dm(self):
-        auth = tweepy.OAuthHandler(self.consumer_key_dm, self.consumer_secret_dm)
-        auth.set_access_token(self.access_token_dm, self.access_token_secret_dm)
-        self.api_dm = tweepy.API(auth)
+        self.api_dm = InstrumentedApi(self._create_api(self.consumer_key_dm, self.consumer_secret_dm,
+                                                       self.access_token_dm, self.access_token_secret_dm),
+                                      self.metrics, tracer=self.tracer, governor=self.rate_limits, token="dm")
 
-    def save_db(self, new_account=False):
-        try:
-            os.remove("./db/" + self.config['DATABASE']['db_file'] + "_backup")
-        except FileNotFoundError:
-            pass
-        try:
-            copyfile("./db/" + self.config['DATABASE']['db_file'],
-                     "./db/" + self.config['DATABASE']['db_file'] + "_backup")
-        except FileNotFoundError:
-            pass
-        try:
-            with open("./db/" + self.config['DATABASE']['db_file'], 'w+') as f:
-                json.dump(self.data, f)
-            if new_account:
-                try:
-                    os.remove("./db/" + self.config['DATABASE']['db_file'] + "_backup_new_user")
-                except FileNotFoundError:
-                    pass
-                with open("./db/" + self.config['DATABASE']['db_file'] + "_backup_new_user", 'w+') as f:
-                    json.dump(self.data, f)
-                if self.config['SYSTEM']['ssh_backup_on_new_user'] == "True":
-                    self.start_thread(self.ssh_remote_backup)
-        except PermissionError as error_msg:
-            print("ERROR!!! Can not save database file!")
-            logging.critical("can not save database file! " + str(error_msg))
+    def refresh_db(self):
+        # reloads the db if an other process changed it (fan-out workers)
+        if self.db_storage.get_version() == self.db_version:
+            return False
+        self.load_db()
+        # the bot removed the reported accounts with invalid tokens, the ones that are still there got a new token
+        self.invalid_token_accounts.clear()
+        return True
+
+    def remove_accounts(self, user_ids):
+        # removes accounts with invalid tokens in bulk with one db save
+        removed = 0
+        for user_id in user_ids:
+            self.invalid_token_accounts.add(str(user_id))
+            self.api_pool.evict(user_id)
+            try:
+                self.db_delete(['accounts', str(user_id)])
+                removed += 1
+                logging.info("invalid or expired token, removed user " + str(user_id))
+            except KeyError:
+                pass
+        if removed > 0:
+            self.save_db()
+        return removed
+
+    def requeue_direct_messages(self, dm_list):
+        for dm in dm_list:
+            self.dm_queue.put((time.time(), dm))
+
+    def retweet_as_user(self, user_id, tweet, accounts=None):
+        # retweets are bulk calls, they leave a share of the rate limit budgets to DM replies and other calls
+        with self.rate_limits.priority("bulk"):
+            if str(user_id) in self.invalid_token_accounts:
+                # the token got invalid while the fan-out was scheduled
+                return False
+            try:
+                api = self.get_api_user(user_id, accounts)
+            except KeyError:
+                # the account got removed while the fan-out was scheduled
+                return False
+            # the retweet ledger replaces the `get_status()` pre-check: retweets of the bot are known locally, retweets
+            # the user made manually are reported by Twitter as error 327
+            if self.has_retweeted(tweet.id, user_id):
+                self.count_retweet_ledger("skipped")
+                return False
+            self.count_retweet_ledger("saved_calls")
+            try:
+                api.retweet(tweet.id)
+                self.db_add_retweet(tweet.id, user_id)
+                screen_name = str(self.user_cache.get_user(user_id).screen_name)
+                print("\tRetweeted:", user_id, screen_name)
+                self.metrics.inc("retweets_total")
+                self.db_increment(['statistic', 'retweets'])
+                self.db_increment(['accounts', str(user_id), 'retweets'])
+                self.save_db()
+                logging.debug("\tRetweeted: " + str(user_id) + " " + screen_name)
+                return True
+            except tweepy.error.TweepError as error_msg:
+                if error_msg.api_code == 327:
+                    # already retweeted outside of the bot
+                    self.count_retweet_ledger("already_retweeted")
+                    self.db_add_retweet(tweet.id, user_id)
+                    self.save_db()
+                elif "Invalid or expired token" in str(error_msg):
+                    account = self.get_db_snapshot(with_tweets=False)['accounts'].get(str(user_id), {})
+                    if accounts is not None and account.get('access_token') != accounts[str(user_id)]['access_token']:
+                        # the user authorized the bot again during the fan-out, the new token is not used yet
+                        return False
+                    print("\tERROR: Invalid or expired token, going to remove user " + user_id)
+                    self.remove_accounts([user_id])
+                else:
+                    print("\tERROR: " + str(error_msg) + " UserID: " + user_id)
+                    logging.error("can not retweet: " + str(error_msg) + " UserID: " + user_id)
+                    self.metrics.inc("retweet_errors_total")
+            return False
 
-    def ssh_remote_backup(self):
-        print("Starting DB backup to " + str(self.config['SECRETS']['ssh_backup_server']))
-        logging.info("Starting DB backup to " + str(self.config['SECRETS']['ssh_backup_server']))
-        ssh = SSHClient()
-        ssh.set_missing_host_key_policy(AutoAddPolicy())
-        ssh.load_system_host_keys()
-        ssh.connect(self.config['SECRETS']['ssh_backup_server'],
-                    username=self.config['SECRETS']['ssh_backup_user'],
-                    password=self.config['SECRETS']['ssh_backup_pass'])
-        with SCPClient(ssh.get_transport()) as scp:
-            scp.put("./db/" + self.config['DATABASE']['db_file'] + "_backup_new_user",
-                    self.config['SECRETS']['ssh_backup_path'] + '/taubenschlag_all_accounts.json')
+    def save_db(self, new_account=False):
+        if self.db_read_only:
+            return True
+        commit_start = time.time()
+        with self.tracer.span("save_db"), self.db_lock:
+            status = self.db_storage.commit(self.data, self.seen_tweets)
+        self.metrics.observe("db_commit_duration_seconds", time.time() - commit_start)
+        if new_account:
+            self.write_db_backup_new_user()
+        return status
 
     def search_and_retweet(self):
         while True:
+            if self.profile_rounds > 0 and self.profiler is None:
+                print("Starting the sampling profiler for " + str(self.profile_rounds) + " rounds")
+                self.profiler = SamplingProfiler(self.config['SYSTEM']['profile_interval'])
+                self.profiler.start()
+            round_duration = self.search_and_retweet_round()
+            self.tracer.flush()
+            if self.profiler is not None:
+                self.profile_rounds -= 1
+                if self.profile_rounds <= 0:
+                    self.profiler.stop()
+                    sample_count = self.profiler.write(self.config['SYSTEM']['profile_file'])
+                    print("Saved " + str(sample_count) + " profiler samples to " +
+                          self.config['SYSTEM']['profile_file'])
+                    self.profiler = None
+            with self.tracer.span("sleep"):
+                if round_duration > 60:
+                    continue
+                elif round_duration > 20:
+                    time.sleep(30)
+                else:
+                    time.sleep(60)
+
+    def print_api_pool_stats(self):
+        stats = self.api_pool.stats()
+        print("API client pool: " + str(stats['size']) + " clients - created: " + str(stats['created']) +
+              " - reused: " + str(stats['reused']) + " - evicted: " + str(stats['evicted']) + " - reuse rate: " +
+              str(stats['reuse_rate']) + "%")
+
+    def print_rate_limit_stats(self):
+        stats = self.rate_limits.stats()
+        print("Rate limits: " + str(stats['buckets']) + " tracked budgets - waits: " + str(stats['waits']) + " (" +
+              str(stats['wait_seconds']) + " seconds) - rejected calls: " + str(stats['rejected']) +
+              " - exhausted (429): " + str(stats['exhausted']))
+
+    def print_retweet_ledger_stats(self):
+        with self.retweet_ledger_lock:
+            stats = dict(self.retweet_ledger_stats)
+        print("Retweet ledger: " + str(len(self.data['retweet_ledger']['tweets'])) + " open tweets - saved get_status "
+              "calls: " + str(stats['saved_calls']) + " - skipped retweets: " + str(stats['skipped']) +
+              " - already retweeted: " + str(stats['already_retweeted']))
+
+    def print_telegram_stats(self):
+        stats = self.telegram_notifier.stats()
+        print("Telegram: " + str(stats['sent']) + " posts sent - queued messages: " + str(stats['queued']) +
+              " - pending: " + str(stats['pending']) + " - retries: " + str(stats['retries']) + " - failed: " +
+              str(stats['failed']) + " - dropped: " + str(stats['dropped']))
+
+    def print_token_sweep_stats(self):
+        stats = self.token_sweep_stats
+        if stats['last_sweep'] is not None:
+            print("Token sweeps: " + str(stats['sweeps']) + " - pruned accounts: " + str(stats['pruned']) +
+                  " - last sweep: " + stats['last_sweep']['time'] + " (checked: " +
+                  str(stats['last_sweep']['checked']) + ", pruned: " + str(stats['last_sweep']['pruned']) + ")")
+
+    def print_user_cache_stats(self):
+        stats = self.user_cache.stats()
+        print("User cache: " + str(stats['size']) + " entries - hits: " + str(stats['hits']) +
+              " - negative hits: " + str(stats['negative_hits']) + " - misses: " + str(stats['misses']) +
+              " - hit rate: " + str(stats['hit_rate']) + "% - bulk lookups: " + str(stats['lookups']))
+
+    def search_and_retweet_round(self):
+        with self.tracer.span("round"):
             print("======================================================================================")
             print("Starting new round at " + str(datetime.datetime.now()))
-            rt_levels = 2
-            round = 1
-            while rt_levels >= round:
-                start_time = time.time()
-                print("Retweeting level " + str(round) + " tweets:")
-                conditions_list = self.config['RT-LEVEL-' + str(round)]['conditions'].split(",")
-                source_accounts_list = self.config['RT-LEVEL-' + str(round)]['from'].split(",")
-                for source_account in source_accounts_list:
-                    try:
-                        timeline = self.api_self.user_timeline(source_account)
-                    except tweepy.error.TweepError as error_msg:
-                        logging.critical(str(error_msg))
-                        print("error: " + str(error_msg) + " user: " + source_account)
-                    for condition in conditions_list:
-                        for tweet in timeline:
-                            tweet_is_retweeted = False
-                            count_tweet = False
-                            if condition == "any":
-                                retweet_permitted = True
-                            else:
-                                if str(condition).lower() in str(tweet.text).lower():
-                                    retweet_permitted = True
-                                else:
-                                    retweet_permitted = False
-                            if retweet_permitted is True:
-                                try:
-                                    if tweet.id in self.data['tweets']:
-                                        tweet_is_retweeted = True
-                                except TypeError:
-                                    pass
-                                if tweet_is_retweeted is False:
-                                    print(str(tweet.id) + " - " + str(tweet.text[0:80]).splitlines()[0] + " ...")
-                                    logging.debug(str(tweet.id) + " - " + str(tweet.text[0:80]).splitlines()[0] +
-                                                  " ...")
-                                    accounts = deepcopy(self.data['accounts'])
-                                    # randomize order of users for a more natural behaviour:
-                                    random_account_list = []
-                                    for user_id in accounts:
-                                        random_account_list.append(user_id)
-                                    random.shuffle(random_account_list)
-                                    made_retweets = 0
-                                    for user_id in random_account_list:
-                                        if (str(user_id) != str(self.bot_user_id) or
-                                            self.config['SYSTEM']['let_bot_account_retweet'] == "True") \
-                                                and int(self.data['accounts'][str(user_id)]['retweet_level']) >= \
-                                                round:
-                                            time.sleep(random.randint(0, 15))
-                                            api = self.get_api_user(user_id)
-                                            try:
-                                                user_tweet = api.get_status(tweet.id)
-                                                if not user_tweet.retweeted:
-                                                    try:
-                                                        user_tweet.retweet()
-                                                        count_tweet = True
-                                                        print("\tRetweeted:", user_id,
-                                                              str(self.api_self.get_user(user_id).screen_name))
-                                                        self.data['statistic']['retweets'] += 1
-                                                        made_retweets +=1
-                                                        try:
-                                                            self.data['accounts'][str(user_id)]['retweets'] += 1
-                                                        except KeyError:
-                                                            self.data['accounts'][str(user_id)]['retweets'] = 1
-                                                        self.save_db()
-                                                        logging.debug("\tRetweeted:", user_id,
-                                                                      str(self.api_self.get_user(user_id).screen_name))
-                                                    except tweepy.TweepError as error_msg:
-                                                        print("\tERROR: " + str(error_msg))
-                                                        logging.error("can not retweet: " + str(error_msg))
-                                            except tweepy.error.TweepError as error_msg:
-                                                if "Invalid or expired token" in str(error_msg):
-                                                    logging.info("invalid or expired token, going to remove user " +
-                                                                 user_id)
-                                                    print("\tERROR: Invalid or expired token, going to remove user " +
-                                                          user_id)
-                                                    del self.data['accounts'][user_id]
-                                                    self.save_db()
-                                                else:
-                                                    logging.info(str(error_msg) + " UserID: " + user_id)
-                                                    print(str(error_msg) + " UserID: " + user_id)
-                                    if count_tweet:
-                                        self.data['statistic']['tweets'] += 1
-                                        if self.telegram_post_new_tweets_to_group == "True":
-                                            telegram_message = "I found a new tweet with rt-level " + str(round) + \
-                                                               " and made " + str(made_retweets) + " retweets:\r\n" \
-                                                               "https://twitter.com/" + str(tweet.user.screen_name) + \
-                                                               "/status/" + str(tweet.id) + "\r\n\r\n" \
-                                                               "Please help by retweeting manually or simply let our " \
-                                                               "bot do this for you and join FLO Retweets:\r\n" + \
-                                                               self.base_url + "\r\n\r\nList of all tweets: " + \
-                                                               self.telegram_channel_tag
-                                            self.post_to_telegram(telegram_message, self.telegram_group_id)
-                                        time.sleep(2)
-                                        if self.telegram_post_new_tweets_to_channel == "True":
-                                            telegram_message = "Retweet level: " + str(round) + " \r\n" \
-                                                               "https://twitter.com/" + str(tweet.user.screen_name) + \
-                                                               "/status/" + str(tweet.id)
-                                            self.post_to_telegram(telegram_message, self.telegram_channel_id)
-                                    try:
-                                        self.data['tweets'].append(tweet.id)
-                                    except AttributeError:
-                                        self.data["tweets"] = [tweet.id]
-                                    self.save_db()
-                if count_tweet is False:
-                    print("\tNo new tweet found!")
-                round += 1
-            print("Accounts: " + str(len(self.data['accounts'])))
-            subscriptions_rt_level_1 = 0
-            subscriptions_rt_level_2 = 0
-            subscriptions_rt_level_3 = 0
-            for user_id in self.data['accounts']:
-                if int(self.data['accounts'][user_id]['retweet_level']) == 1:
-                    subscriptions_rt_level_1 += 1
-                elif int(self.data['accounts'][user_id]['retweet_level']) == 2:
-                    subscriptions_rt_level_1 += 1
-                    subscriptions_rt_level_2 += 1
-                elif int(self.data['accounts'][user_id]['retweet_level']) == 3:
-                    subscriptions_rt_level_1 += 1
-                    subscriptions_rt_level_2 += 1
-                    subscriptions_rt_level_3 += 1
-                if self.parsed_args.account_list:
+            round_start_time = time.time()
+            pruned_tweets = self.seen_tweets.prune()
+            if pruned_tweets > 0:
+                print("Removed " + str(pruned_tweets) + " tweets from the seen tweet index (retention window)")
+            round_timelines, timeline_cursors = self.fetch_timelines(self.get_rt_source_accounts(self.rt_levels))
+            for round in self.rt_levels:
+                with self.tracer.span("rt_level", rt_level=round) as level_span:
+                    start_time = time.time()
+                    print("Retweeting level " + str(round) + " tweets:")
+                    source_accounts_list = self.config['RT-LEVEL-' + str(round)]['from'].split(",")
+                    tweets = self.merge_timelines(round_timelines, source_accounts_list)
+                    new_tweets = 0
+                    match_time = 0.0
+                    for tweet in tweets:
+                        if tweet.id in self.seen_tweets:
+                            continue
+                        match_start = time.time()
+                        condition = self.rt_level_matchers[round].match(tweet.text)
+                        match_time += time.time() - match_start
+                        if condition is not False:
+                            new_tweets += 1
+                            self.process_tweet(tweet, round, condition)
+                    if new_tweets == 0:
+                        print("\tNo new tweet found!")
+                    level_span.attributes['tweets'] = len(tweets)
+                    level_span.attributes['new_tweets'] = new_tweets
+                    level_span.attributes['match_seconds'] = match_time
+                    self.metrics.observe("rt_level_duration_seconds", time.time() - start_time, rt_level=round)
+            # tweets of an incomplete timeline are fetched again in the next round and skipped by the seen tweet index
+            for source_account in timeline_cursors:
+                self.db_set(['timeline_cursors', source_account], timeline_cursors[source_account])
+            self.save_db()
+            self.metrics.observe("round_duration_seconds", time.time() - round_start_time)
+            data = self.get_db_snapshot(with_tweets=False)
+            print("Accounts: " + str(len(data['accounts'])))
+            if self.parsed_args.account_list:
+                try:
+                    users = self.user_cache.get_users(list(data['accounts']))
+                except tweepy.error.TweepError as error_msg:
+                    logging.error(str(error_msg))
+                    print("error: " + str(error_msg))
+                    users = {}
+                for user_id in data['accounts']:
                     try:
-                        retweets = self.data['accounts'][str(user_id)]['retweets']
+                        retweets = data['accounts'][str(user_id)]['retweets']
                     except KeyError:
-                        self.data['accounts'][str(user_id)]['retweets'] = 0
+                        self.db_set(['accounts', str(user_id), 'retweets'], 0)
                         self.save_db()
-                        retweets = self.data['accounts'][str(user_id)]['retweets']
+                        retweets = 0
                     try:
-                        user = self.api_self.get_user(user_id)
-                    except tweepy.error.TweepError as error_msg:
-                        logging.error(str(error_msg))
-                        print("error: " + str(error_msg))
+                        screen_name = "@" + str(users[str(user_id)].screen_name)
+                    except KeyError:
+                        screen_name = "unknown"
                     print("\t" + str(self._fill_up_space(25, user_id)) +
-                          self._fill_up_space(20, "@" + user.screen_name) + " RT level: " +
-                          str(self.data['accounts'][user_id]['retweet_level']) + "\tretweets: " +
+                          self._fill_up_space(20, screen_name) + " RT level: " +
+                          str(data['accounts'][user_id]['retweet_level']) + "\tretweets: " +
                           str(retweets))
             print("Available accounts per RT level:")
-            print("\t1: " + str(subscriptions_rt_level_1))
-            print("\t2: " + str(subscriptions_rt_level_2))
-            print("\t3: " + str(subscriptions_rt_level_3))
-            print("Tweets: " + str(self.data['statistic']['tweets']))
-            print("Retweets: " + str(self.data['statistic']['retweets']))
-            print("Sent help DMs: " + str(self.data['statistic']['sent_help_dm']))
-            print("Executed bot commands: " + str(self.data['statistic']['received_botcmds']))
+            for rt_level in self.rt_levels:
+                print("\t" + str(rt_level) + ": " + str(self.subscriber_index.count(rt_level)))
+            print("Tweets: " + str(data['statistic']['tweets']))
+            print("Retweets: " + str(data['statistic']['retweets']))
+            print("Sent help DMs: " + str(data['statistic']['sent_help_dm']))
+            print("Executed bot commands: " + str(data['statistic']['received_botcmds']))
+            self.print_user_cache_stats()
+            self.print_api_pool_stats()
+            self.print_rate_limit_stats()
+            self.print_retweet_ledger_stats()
+            self.print_token_sweep_stats()
+            self.print_telegram_stats()
             print("--------------------------------------------------------------------------------------")
-            end_time = time.time()
-            if end_time - start_time > 60:
-                continue
-            elif end_time - start_time > 20:
-                time.sleep(30)
-            else:
-                time.sleep(60)
+        return time.time() - round_start_time
 
     def start_bot(self):
-        self.start_thread(self.leaderboard)
-        # wait to finish the FIRST leaderboard generation
-        time.sleep(5)
+        self.start_thread(self.onboarding_worker)
+        if self.remote_backup is not None:
+            self.start_thread(self.remote_backup.run)
+        self.start_thread(self.telegram_notifier.run)
         self.start_thread(self.search_and_retweet)
+        if float(self.config['SYSTEM']['token_sweep_interval']) > 0:
+            self.start_thread(self.token_health_sweeper)
         self.start_thread(self.check_direct_messages)
+        self.start_thread(self.poll_direct_messages)
+        if self.db_storage.sync_interval is not False:
+            self.start_thread(self.db_storage_sync)
 
     def start_thread(self, function):
         thread = threading.Thread(target=function)
@@ -804,8 +3231,154 @@ class Taubenschlag(object):
     def start_webserver(self):
         self.start_thread(self._webserver_thread)
 
+    def shard_worker_heartbeat(self):
+        while self.shard_worker_stop.wait(float(self.config['SYSTEM']['shard_heartbeat_interval'])) is False:
+            try:
+                self.shard_queue.heartbeat(self.worker_id)
+            except sqlite3.Error as error_msg:
+                logging.error("fan-out worker heartbeat: " + str(error_msg))
+
+    def start_worker(self):
+        # fan-out worker: retweets with the accounts of its shard and reports the results to the coordinator
+        self.shard_worker_stop = threading.Event()
+        # a restarted worker continues after the last job it reported, a new worker starts with the jobs published
+        # after its first heartbeat
+        handled_job_id = self.shard_queue.get_handled_job_id(self.worker_id)
+        if handled_job_id is None:
+            handled_job_id = self.shard_queue.get_last_job_id()
+        self.shard_queue.heartbeat(self.worker_id)
+        self.start_thread(self.shard_worker_heartbeat)
+        print("Fan-out worker " + self.worker_id + " started!")
+        logging.info("fan-out worker " + self.worker_id + " started")
+        try:
+            while True:
+                for job in self.shard_queue.get_jobs(handled_job_id):
+                    handled_job_id = job['job_id']
+                    if self.worker_id not in job['workers'] or \
+                            self.worker_id in self.shard_queue.get_results(job['job_id']):
+                        continue
+                    self.refresh_db()
+                    tweet = ShardTweet(job['tweet_id'])
+                    shard = []
+
+                    def owner(user_id, job=job):
+                        if self.is_shard_member(user_id, job['chain'], job['workers'], self.worker_id):
+                            shard.append(user_id)
+                            return True
+                        return False
+
+                    print("Fan-out job " + str(job['job_id']) + " of " + str(tweet.id) + " (rt level " +
+                          str(job['rt_level']) + ")")
+                    invalid_before = set(self.invalid_token_accounts)
+                    retweeted_before = set(user_id for user_id in self.get_db_snapshot(with_tweets=False)['accounts']
+                                           if self.has_retweeted(tweet.id, user_id))
+                    retweeted = self.fan_out_retweet(tweet, job['rt_level'], owner=owner)
+                    already_retweeted = [user_id for user_id in shard
+                                         if user_id not in retweeted and user_id not in retweeted_before and
+                                         self.has_retweeted(tweet.id, user_id)]
+                    self.shard_queue.report(job['job_id'], self.worker_id,
+                                            {'retweeted': retweeted, 'already_retweeted': already_retweeted,
+                                             'invalid': sorted(self.invalid_token_accounts - invalid_before)})
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            self.shard_worker_stop.set()
+            self.shard_queue.unregister(self.worker_id)
+            print("Fan-out worker " + self.worker_id + " stopped!")
+            logging.info("fan-out worker " + self.worker_id + " stopped")
+
+    def sweep_tokens(self):
+        # checks the tokens of all accounts with `verify_credentials` at `token_sweep_rate` requests per second,
+        # accounts with an invalid token are skipped by the fan-out at once and removed in bulk at the end of the sweep
+        sweep_start = time.time()
+        interval = 1 / float(self.config['SYSTEM']['token_sweep_rate'])
+        invalid_accounts = []
+        checked = 0
+        accounts = self.get_db_snapshot(with_tweets=False)['accounts']
+        with self.rate_limits.priority("bulk"):
+            for user_id in accounts:
+                try:
+                    api = self.get_api_user(user_id, accounts)
+                except KeyError:
+                    continue
+                try:
+                    valid = api.verify_credentials() is not False
+                except tweepy.error.RateLimitError as error_msg:
+                    logging.error("token sweep: " + str(error_msg))
+                    valid = True
+                except tweepy.error.TweepError as error_msg:
+                    # 89 = invalid or expired token, other errors leave the account as it is
+                    valid = error_msg.api_code != 89 and "Invalid or expired token" not in str(error_msg)
+                    if valid:
+                        logging.error("token sweep: " + str(error_msg) + " UserID: " + str(user_id))
+                checked += 1
+                if not valid:
+                    self.invalid_token_accounts.add(str(user_id))
+                    invalid_accounts.append(user_id)
+                time.sleep(interval)
+        # accounts that got a new token during the sweep are not in `invalid_token_accounts` anymore
+        pruned = self.remove_accounts([user_id for user_id in invalid_accounts
+                                       if str(user_id) in self.invalid_token_accounts])
+        self.token_sweep_stats['sweeps'] += 1
+        self.token_sweep_stats['checked'] += checked
+        self.token_sweep_stats['pruned'] += pruned
+        self.token_sweep_stats['last_sweep'] = {'time': str(datetime.datetime.now()), 'checked': checked,
+                                                'pruned': pruned, 'seconds': round(time.time() - sweep_start, 1)}
+        self.metrics.inc("token_sweep_checked_total", checked)
+        self.metrics.inc("token_sweep_pruned_total", pruned)
+        print("Token sweep: checked " + str(checked) + " tokens in " + str(round(time.time() - sweep_start, 1)) +
+              " seconds - pruned " + str(pruned) + " accounts with invalid tokens")
+        logging.info("token sweep: checked " + str(checked) + " tokens, pruned " + str(pruned) + " accounts")
+        return pruned
+
+    def token_health_sweeper(self):
+        time.sleep(60)
+        while True:
+            self.sweep_tokens()
+            time.sleep(float(self.config['SYSTEM']['token_sweep_interval']))
+
+    def warm_up_user_cache(self):
+        print("Warming up user cache ...")
+        try:
+            loaded = self.user_cache.warm_up(list(self.get_db_snapshot(with_tweets=False)['accounts']))
+        except tweepy.error.TweepError as error_msg:
+            logging.error("can not warm up user cache: " + str(error_msg))
+            print("ERROR: can not warm up user cache: " + str(error_msg))
+            return False
+        print("Loaded " + str(loaded) + " user profiles into the user cache!")
+        return True
+
+    def write_db_backup_new_user(self):
+        db_file = "./db/" + self.config['DATABASE']['db_file']
+        try:
+            os.remove(db_file + "_backup_new_user")
+        except FileNotFoundError:
+            pass
+        try:
+            snapshot = self.get_db_snapshot()
+            with open(db_file + "_backup_new_user", 'w+') as f:
+                json.dump(snapshot, f)
+        except PermissionError as error_msg:
+            print("ERROR!!! Can not save database backup file!")
+            logging.critical("can not save database backup file! " + str(error_msg))
+            return False
+        if self.remote_backup is not None:
+            self.remote_backup.trigger()
+        return True
+
 
-taubenschlag = Taubenschlag()
-taubenschlag.start_webserver()
-taubenschlag.start_bot()
+if __name__ == "__main__":
+    # the config, db and log paths are relative to the dir of the bot, tools and benchmarks that import the module keep
+    # their own cwd and logging
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    logging.basicConfig(format="{asctime} [{levelname:8}] {process} {thread} {module} {pathname} {lineno}: {message}",
+                        filename='taubenschlag.log',
+                        style="{")
+    logging.getLogger('taubenschlag').addHandler(logging.StreamHandler())
+    logging.getLogger('taubenschlag').setLevel(logging.INFO)
+    taubenschlag = Taubenschlag()
+    if taubenschlag.worker_id is not None:
+        taubenschlag.start_worker()
+    else:
+        taubenschlag.start_webserver()
+        taubenschlag.start_bot()
 
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# File: tests/test_db_journal.py
+#
+# Part of ‘Taubenschlag'
+# GitHub: https://github.com/bithon/Taubenschlag
+#
+# Author: Oliver Zehentleitner
+#         https://about.me/oliver_zehentleitner/
+#
+# Copyright (c) 2019, Oliver Zehentleitner
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL-
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Crash recovery of the JSON db journal: a torn last record must not swallow the records written after the restart.
+#
+#   python3 -m unittest discover tests
+
+from copy import deepcopy
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.basicConfig(handlers=[logging.NullHandler()])
+
+from taubenschlag import JsonStorage, SeenTweetIndex, apply_db_record
+
+data_layout = {"tweets": [],
+               "accounts": {},
+               "statistic": {"tweets": 0, "retweets": 0, "sent_help_dm": 0, "received_botcmds": 0}}
+
+
+class DbJournalRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.db_dir, "db.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir)
+
+    def start(self):
+        storage = JsonStorage(self.db_file, journal=True, journal_compact_after=10000)
+        seen_tweets = SeenTweetIndex()
+        data = storage.load(deepcopy(data_layout), seen_tweets)
+        return storage, seen_tweets, data
+
+    def change(self, storage, seen_tweets, data, record):
+        apply_db_record(data, seen_tweets, record)
+        storage.write(record, data)
+
+    def test_records_after_torn_line_survive_restarts(self):
+        storage, seen_tweets, data = self.start()
+        self.change(storage, seen_tweets, data, {'op': "incr", 'path': ['statistic', 'retweets'], 'value': 1})
+        storage.sync()
+        with open(self.db_file + "_journal", 'a') as f:
+            f.write('{"op": "incr", "path": ["statistic", "retw')
+        storage, seen_tweets, data = self.start()
+        self.assertEqual(data['statistic']['retweets'], 1)
+        for _ in range(3):
+            self.change(storage, seen_tweets, data, {'op': "incr", 'path': ['statistic', 'retweets'], 'value': 1})
+        self.change(storage, seen_tweets, data, {'op': "set", 'path': ['accounts', "42"],
+                                                 'value': {'retweet_level': 1, 'retweets': 0}})
+        storage.sync()
+        storage, seen_tweets, data = self.start()
+        storage, seen_tweets, data = self.start()
+        self.assertEqual(data['statistic']['retweets'], 4)
+        self.assertIn("42", data['accounts'])
+
+    def test_read_only_storage_does_not_repair(self):
+        storage, seen_tweets, data = self.start()
+        self.change(storage, seen_tweets, data, {'op': "incr", 'path': ['statistic', 'tweets'], 'value': 1})
+        storage.sync()
+        with open(self.db_file + "_journal", 'a') as f:
+            f.write('{"op": "incr", "pa')
+        size = os.path.getsize(self.db_file + "_journal")
+        data = JsonStorage(self.db_file, journal=True, read_only=True).load(deepcopy(data_layout), SeenTweetIndex())
+        self.assertEqual(data['statistic']['tweets'], 1)
+        self.assertEqual(os.path.getsize(self.db_file + "_journal"), size)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# File: tools/restore_backup.py
+#
+# Part of ‘Taubenschlag'
+# GitHub: https://github.com/bithon/Taubenschlag
+#
+# Author: Oliver Zehentleitner
+#         https://about.me/oliver_zehentleitner/
+#
+# Copyright (c) 2019, Oliver Zehentleitner
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL-
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Restores a JSON db from the files of the remote backup (`ssh_backup_on_new_user`): the snapshot
+# <name>.json.gz plus all deltas <name>.<generation>.<n>.jsonl.gz of its generation.
+
+from argparse import ArgumentParser
+import gzip
+import json
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from taubenschlag import SeenTweetIndex, apply_db_record  # noqa: E402
+
+
+def main():
+    parser = ArgumentParser(description="restore a JSON db from a snapshot and the deltas of the remote backup")
+    parser.add_argument('--dir', dest='dir', default=".", help='directory with the downloaded backup files')
+    parser.add_argument('--name', dest='name', default="taubenschlag_all_accounts", help='name of the backup files')
+    parser.add_argument('--output', dest='output', required=True, help='JSON db file to write')
+    args = parser.parse_args()
+    with open(os.path.join(args.dir, args.name + ".json.gz"), 'rb') as f:
+        data = json.loads(gzip.decompress(f.read()).decode('utf-8'))
+    generation = data.pop('backup_generation', None)
+    seen_tweets = SeenTweetIndex()
+    seen_tweets.load(data.get('tweets', []))
+    deltas = {}
+    pattern = re.compile("^" + re.escape(args.name) + r"\." + str(generation) + r"\.(\d+)\.jsonl\.gz$")
+    for file_name in os.listdir(args.dir):
+        match = pattern.match(file_name)
+        if match:
+            deltas[int(match.group(1))] = file_name
+    print("Snapshot of generation " + str(generation) + " with " + str(len(deltas)) + " deltas")
+    delta = 1
+    while delta in deltas:
+        with open(os.path.join(args.dir, deltas[delta]), 'rb') as f:
+            for line in gzip.decompress(f.read()).decode('utf-8').splitlines():
+                if line.strip():
+                    apply_db_record(data, seen_tweets, json.loads(line))
+        delta += 1
+    if delta <= len(deltas):
+        print("Delta " + str(delta) + " is missing, the newer deltas are ignored!")
+    data['tweets'] = seen_tweets.export()
+    with open(args.output, 'w') as f:
+        json.dump(data, f)
+    print("Restored " + str(len(data.get('accounts', {}))) + " accounts to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
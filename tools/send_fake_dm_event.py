@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# File: tools/send_fake_dm_event.py
+#
+# Part of ‘Taubenschlag'
+# GitHub: https://github.com/bithon/Taubenschlag
+#
+# Author: Oliver Zehentleitner
+#         https://about.me/oliver_zehentleitner/
+#
+# Copyright (c) 2019, Oliver Zehentleitner
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL-
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Sends a signed account activity DM event (or a CRC challenge) to the local webhook of the bot, so the webhook mode
+# (`dm_ingestion = webhook`) can be tested without Twitter.
+
+from argparse import ArgumentParser
+import base64
+import configparser
+import hashlib
+import hmac
+import json
+import os
+import random
+import requests
+import time
+
+
+def signature(consumer_secret, payload):
+    digest = hmac.new(consumer_secret.encode('utf-8'), msg=payload, digestmod=hashlib.sha256).digest()
+    return "sha256=" + base64.b64encode(digest).decode('ascii')
+
+
+def main():
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "conf.d", "secrets.cfg"))
+    try:
+        default_secret = config['SECRETS']['consumer_secret_dm']
+    except KeyError:
+        default_secret = ""
+    parser = ArgumentParser(description="send a fake DM event to the webhook of the bot")
+    parser.add_argument('--url', dest='url', default="http://127.0.0.1:17613/webhooks/twitter",
+                        help='webhook url of the bot')
+    parser.add_argument('--consumer-secret', dest='consumer_secret', default=default_secret,
+                        help='consumer secret of the DM app (default: consumer_secret_dm of ./conf.d/secrets.cfg)')
+    parser.add_argument('--sender-id', dest='sender_id', help='user id of the sender')
+    parser.add_argument('--text', dest='text', default="get-info", help='text of the DM')
+    parser.add_argument('--crc', dest='crc', help='send a CRC challenge with this token instead of a DM event',
+                        action="store_true")
+    args = parser.parse_args()
+    if args.crc:
+        crc_token = str(random.randint(0, 2**32))
+        response = requests.get(args.url, params={'crc_token': crc_token})
+        print(str(response.status_code) + " " + response.text)
+        if response.json().get('response_token') == signature(args.consumer_secret, crc_token.encode('utf-8')):
+            print("CRC response is valid!")
+        else:
+            print("CRC response is NOT valid!")
+        return
+    if args.sender_id is None:
+        parser.error("--sender-id is required to send a DM event")
+    event = {'for_user_id': "0",
+             'direct_message_events': [{'type': "message_create",
+                                        'id': str(int(time.time() * 1000)),
+                                        'created_timestamp': str(int(time.time() * 1000)),
+                                        'message_create': {'target': {'recipient_id': "0"},
+                                                           'sender_id': str(args.sender_id),
+                                                           'message_data': {'text': args.text}}}]}
+    payload = json.dumps(event).encode('utf-8')
+    response = requests.post(args.url, data=payload,
+                             headers={'content-type': "application/json",
+                                      'x-twitter-webhooks-signature': signature(args.consumer_secret, payload)})
+    print(str(response.status_code) + " " + response.text)
+
+
+if __name__ == "__main__":
+    main()
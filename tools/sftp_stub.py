@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# File: tools/sftp_stub.py
+#
+# Part of ‘Taubenschlag'
+# GitHub: https://github.com/bithon/Taubenschlag
+#
+# Author: Oliver Zehentleitner
+#         https://about.me/oliver_zehentleitner/
+#
+# Copyright (c) 2019, Oliver Zehentleitner
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL-
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Local SFTP server as stand-in for the backup server of `ssh_backup_on_new_user`. It serves a local directory to one
+# user/password, e.g. set `ssh_backup_server = 127.0.0.1`, `ssh_backup_port = 17615`, `ssh_backup_user = backup`,
+# `ssh_backup_pass = backup` and `ssh_backup_path = /` in ./conf.d/secrets.cfg.
+
+from argparse import ArgumentParser
+import os
+import paramiko
+import socket
+import threading
+
+
+class StubServer(paramiko.ServerInterface):
+    username = "backup"
+    password = "backup"
+
+    def check_auth_password(self, username, password):
+        if username == self.username and password == self.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+
+class StubSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as error_msg:
+            return paramiko.SFTPServer.convert_errno(error_msg.errno)
+
+
+class StubSFTPServer(paramiko.SFTPServerInterface):
+    root = "."
+
+    def _local_path(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def list_folder(self, path):
+        try:
+            local_path = self._local_path(path)
+            entries = []
+            for file_name in os.listdir(local_path):
+                attributes = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local_path, file_name)))
+                attributes.filename = file_name
+                entries.append(attributes)
+            return entries
+        except OSError as error_msg:
+            return paramiko.SFTPServer.convert_errno(error_msg.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(self._local_path(path)))
+        except OSError as error_msg:
+            return paramiko.SFTPServer.convert_errno(error_msg.errno)
+
+    def open(self, path, flags, attr):
+        mode = "rb"
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        try:
+            fd = os.open(self._local_path(path), flags | getattr(os, 'O_BINARY', 0), 0o600)
+            f = os.fdopen(fd, mode)
+        except OSError as error_msg:
+            return paramiko.SFTPServer.convert_errno(error_msg.errno)
+        handle = StubSFTPHandle(flags)
+        handle.filename = self._local_path(path)
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self._local_path(oldpath), self._local_path(newpath))
+        except OSError as error_msg:
+            return paramiko.SFTPServer.convert_errno(error_msg.errno)
+        return paramiko.SFTP_OK
+
+    def remove(self, path):
+        try:
+            os.remove(self._local_path(path))
+        except OSError as error_msg:
+            return paramiko.SFTPServer.convert_errno(error_msg.errno)
+        print("removed " + path)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        return self.posix_rename(oldpath, newpath)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local_path(path)))
+        except OSError as error_msg:
+            return paramiko.SFTPServer.convert_errno(error_msg.errno)
+
+
+def serve_connection(connection, host_key):
+    transport = paramiko.Transport(connection)
+    transport.add_server_key(host_key)
+    transport.set_subsystem_handler("sftp", paramiko.SFTPServer, StubSFTPServer)
+    transport.start_server(server=StubServer())
+    print("new connection from " + str(connection.getpeername()))
+    while transport.is_active():
+        transport.join(1)
+    print("connection closed")
+
+
+def main():
+    parser = ArgumentParser(description="local SFTP server as stand-in for the backup server")
+    parser.add_argument('--ip', dest='ip', default="127.0.0.1", help='listener ip')
+    parser.add_argument('--port', dest='port', default=17615, type=int, help='listener port')
+    parser.add_argument('--root', dest='root', default="./backup_stub", help='local directory that is served')
+    parser.add_argument('--user', dest='user', default="backup", help='username')
+    parser.add_argument('--password', dest='password', default="backup", help='password')
+    args = parser.parse_args()
+    os.makedirs(args.root, exist_ok=True)
+    StubSFTPServer.root = os.path.abspath(args.root)
+    StubServer.username = args.user
+    StubServer.password = args.password
+    host_key = paramiko.RSAKey.generate(2048)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.ip, args.port))
+    sock.listen(10)
+    print("SFTP stub listening on " + args.ip + ":" + str(args.port) + " - serving " + StubSFTPServer.root)
+    while True:
+        connection, address = sock.accept()
+        threading.Thread(target=serve_connection, args=(connection, host_key), daemon=True).start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# File: tools/telegram_stub.py
+#
+# Part of ‘Taubenschlag'
+# GitHub: https://github.com/bithon/Taubenschlag
+#
+# Author: Oliver Zehentleitner
+#         https://about.me/oliver_zehentleitner/
+#
+# Copyright (c) 2019, Oliver Zehentleitner
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL-
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# Local stand-in for the `sendMessage` method of the Telegram bot API, it prints every received message. Set
+# `telegram_api_url = http://127.0.0.1:17614` in ./conf.d/main.cfg to test the telegram notifier of the bot. With
+# `--fail-rate` and `--rate-limit-rate` a share of the requests is answered with 502 or 429 to test the retries.
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+import json
+import random
+import time
+
+
+class TelegramStubHandler(BaseHTTPRequestHandler):
+    fail_rate = 0.0
+    rate_limit_rate = 0.0
+
+    def _answer(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', "application/json")
+        self.send_header('content-length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if not self.path.endswith("/sendMessage"):
+            self._answer(404, {'ok': False, 'error_code': 404, 'description': "Not Found"})
+            return
+        length = int(self.headers.get('content-length', 0))
+        fields = parse_qs(self.rfile.read(length).decode('utf-8'))
+        chance = random.random()
+        if chance < self.rate_limit_rate:
+            print(time.strftime("%H:%M:%S") + " 429")
+            self._answer(429, {'ok': False, 'error_code': 429, 'description': "Too Many Requests: retry after 1",
+                               'parameters': {'retry_after': 1}})
+            return
+        if chance < self.rate_limit_rate + self.fail_rate:
+            print(time.strftime("%H:%M:%S") + " 502")
+            self._answer(502, {'ok': False, 'error_code': 502, 'description': "Bad Gateway"})
+            return
+        chat_id = fields.get('chat_id', [""])[0]
+        text = fields.get('text', [""])[0]
+        print(time.strftime("%H:%M:%S") + " chat " + chat_id + ":\r\n" + text + "\r\n")
+        self._answer(200, {'ok': True, 'result': {'message_id': int(time.time() * 1000), 'chat': {'id': chat_id},
+                                                  'text': text}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = ArgumentParser(description="local stub of the telegram bot API")
+    parser.add_argument('--ip', dest='ip', default="127.0.0.1", help='listener ip')
+    parser.add_argument('--port', dest='port', default=17614, type=int, help='listener port')
+    parser.add_argument('--fail-rate', dest='fail_rate', default=0.0, type=float,
+                        help='share of requests that are answered with 502 (0.0 - 1.0)')
+    parser.add_argument('--rate-limit-rate', dest='rate_limit_rate', default=0.0, type=float,
+                        help='share of requests that are answered with 429 (0.0 - 1.0)')
+    args = parser.parse_args()
+    TelegramStubHandler.fail_rate = args.fail_rate
+    TelegramStubHandler.rate_limit_rate = args.rate_limit_rate
+    print("Telegram stub listening on http://" + args.ip + ":" + str(args.port))
+    HTTPServer((args.ip, args.port), TelegramStubHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()